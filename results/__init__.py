@@ -1,7 +1,14 @@
+import functools
 import logging.handlers
+import os
 import MySQLdb
-from flask import Flask, render_template, g
+from flask import Flask, render_template, g, Response, stream_with_context
+from flask import request
 import index
+import fallback
+import admission
+from imp_build_utils import set_query_time_limit
+from build_calendar import get_link_date
 
 app = Flask(__name__, instance_relative_config=True)
 app.config.from_pyfile('imp-results.cfg')
@@ -16,9 +23,15 @@ if not app.debug and 'MAIL_SERVER' in app.config:
 
 
 def _connect_db():
+    # Optional timeouts (in seconds), so that a slow database fails
+    # quickly and a kept copy of the page can be shown instead
+    timeouts = dict((k, app.config[c]) for k, c in
+                    (('connect_timeout', 'DB_CONNECT_TIMEOUT'),
+                     ('read_timeout', 'DB_READ_TIMEOUT'))
+                    if app.config.get(c))
     conn = MySQLdb.connect(host=app.config['HOST'], user=app.config['USER'],
                            passwd=app.config['PASSWORD'],
-                           db=app.config['DATABASE'])
+                           db=app.config['DATABASE'], **timeouts)
     return conn
 
 
@@ -26,6 +39,10 @@ def get_db():
     """Open a new database connection if necessary"""
     if not hasattr(g, 'db_conn'):
         g.db_conn = _connect_db()
+        seconds = app.config.get('QUERY_TIME_LIMITS', {}).get(
+            g.get('page_class'))
+        if seconds:
+            set_query_time_limit(g.db_conn, seconds)
     return g.db_conn
 
 
@@ -35,18 +52,182 @@ def close_db(error):
         g.db_conn.close()
 
 
+def _get_last_build_date(branch):
+    """Get the date of the latest build on the branch, from its lastbuild
+       link (so that the database is not needed)"""
+    if branch not in index.TestPage.all_branches:
+        branch = 'develop'
+    try:
+        return get_link_date(os.readlink(os.path.join(
+            app.config['TOPDIR'], branch, 'lastbuild')))
+    except OSError:
+        return None
+
+
+def keep_pages(view):
+    """Keep the last rendered copy of the page, to be shown if the database
+       is unavailable"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Frozen pages must always be freshly rendered
+        if index.is_freezing():
+            return view(*args, **kwargs)
+        branch = request.args.get('branch', 'develop')
+        # Pages (especially those without a date) change when a new build
+        # appears, so copies are kept for each latest build
+        last_build_date = _get_last_build_date(branch)
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+               last_build_date)
+        return fallback.serve(
+            app.config, branch, index.get_lab_only(), key,
+            lambda: app.make_response(view(*args, **kwargs)),
+            # Don't keep a page made before the new build was noticed
+            keep=lambda: g.get('last_build_date') in (None, last_build_date))
+    return wrapper
+
+
+def page_class(name, coalesced=False):
+    """Mark a view as showing the given class of page, which determines how
+       many such pages are rendered at once and how long their database
+       queries are allowed to run. If `coalesced` is True, the view renders
+       its page with TestPage.coalesced(), which admits only the request
+       that does the rendering, not those that wait to share its result."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.page_class = name
+            if coalesced:
+                return view(*args, **kwargs)
+            return admission.admit(
+                app.config, name,
+                lambda: app.make_response(view(*args, **kwargs)))
+        return wrapper
+    return decorator
+
+
 @app.route('/')
 def summary():
     return render_template('layout.html')
 
 
+@app.route('/summary.json')
+@keep_pages
+@page_class('summary', coalesced=True)
+def summary_json():
+    p = index.TestPage(get_db(), app.config)
+    # Check for a match only after the response is shared with other
+    # identical requests, which may not have the same ETag
+    return p.coalesced(p.display_summary_json).make_conditional(request)
+
+
 @app.route('/platform/<int:platform_id>')
+@keep_pages
+@page_class('summary', coalesced=True)
 def platform(platform_id):
     p = index.TestPage(get_db(), app.config)
-    return p.display_platform(platform_id)
+    return p.coalesced(p.display_platform, platform_id)
 
 
 @app.route('/component/<int:component_id>')
+@keep_pages
+@page_class('lists', coalesced=True)
 def component(component_id):
     p = index.TestPage(get_db(), app.config)
-    return p.display_component(component_id)
+    return p.coalesced(p.display_component, component_id)
+
+
+@app.route('/badge.svg')
+def badge():
+    p = index.TestPage(get_db(), app.config)
+    return p.display_badge(component=request.args.get('comp', type=int),
+                           platform=request.args.get('plat', type=int))
+
+
+@app.route('/failures')
+@keep_pages
+@page_class('lists', coalesced=True)
+def all_failures():
+    p = index.TestPage(get_db(), app.config)
+    return p.coalesced(p.display_all_failures)
+
+
+@app.route('/clusters')
+@keep_pages
+@page_class('lists', coalesced=True)
+def failure_clusters():
+    p = index.TestPage(get_db(), app.config)
+    return p.coalesced(p.display_clusters)
+
+
+@app.route('/long')
+@keep_pages
+@page_class('lists', coalesced=True)
+def long_tests():
+    p = index.TestPage(get_db(), app.config)
+    return p.coalesced(p.display_long_tests)
+
+
+@app.route('/compare')
+@page_class('compare')
+def compare():
+    p = index.TestPage(get_db(), app.config)
+    return Response(stream_with_context(p.display_compare()))
+
+
+@app.route('/search')
+@page_class('lists')
+def search_page():
+    p = index.TestPage(get_db(), app.config)
+    return p.display_search()
+
+
+@app.route('/search/complete')
+def search_complete():
+    return index.display_search_complete(get_db)
+
+
+@app.route('/commits')
+def commit_lookup():
+    return index.display_commits()
+
+
+@app.route('/commits.json')
+def commit_lookup_json():
+    return index.display_commits_json()
+
+
+@app.route('/export/<kind>.<fmt>')
+@page_class('export')
+def export_results(kind, fmt):
+    p = index.TestPage(get_db(), app.config)
+    return p.display_export(kind, fmt)
+
+
+@app.route('/calendar')
+@keep_pages
+@page_class('summary', coalesced=True)
+def build_calendar():
+    p = index.TestPage(get_db(), app.config)
+    return p.coalesced(p.display_calendar)
+
+
+@app.route('/details', methods=['GET', 'POST'])
+@page_class('details')
+def test_details():
+    p = index.TestPage(get_db(), app.config)
+    return p.display_test_details()
+
+
+@app.route('/status', methods=['POST'])
+@page_class('details')
+def test_status():
+    p = index.TestPage(get_db(), app.config)
+    return p.display_test_status()
+
+
+@app.route('/detail/<int:test_id>/<int:platform_id>')
+@keep_pages
+@page_class('details')
+def test_detail(test_id, platform_id):
+    p = index.TestPage(get_db(), app.config)
+    return p.display_test_detail(test_id, platform_id)
@@ -0,0 +1,100 @@
+"""Limits on how many expensive pages are rendered at once.
+
+   Pages are grouped into classes (e.g. 'lists' for the long lists of
+   tests), and the PAGE_CONCURRENCY configuration option gives the
+   maximum number of requests of each class that are handled at once, e.g.
+   PAGE_CONCURRENCY = {'lists': 4, 'compare': 2}
+   Classes not listed are not limited. Further requests wait, in a queue
+   of at most MAX_QUEUED requests per class, for up to ADMISSION_TIMEOUT
+   seconds; if the page still cannot be rendered, a 503 response with a
+   Retry-After header is returned. Since each class is limited separately,
+   one expensive kind of page cannot use up every worker and database
+   connection.
+"""
+
+import threading
+import time
+from flask import abort, Response
+
+# Default time (in seconds) that a request waits for its turn
+ADMISSION_TIMEOUT = 10
+
+# Default maximum number of waiting requests per page class
+MAX_QUEUED = 20
+
+
+class Limiter(object):
+    """Allow at most `limit` holders at once, with at most `max_queued`
+       others waiting"""
+
+    def __init__(self, limit, max_queued):
+        self.limit, self.max_queued = limit, max_queued
+        self.active = self.waiting = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self, timeout):
+        """Try to become a holder, waiting at most `timeout` seconds.
+           Return True on success."""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.max_queued:
+                return False
+            deadline = time.time() + timeout
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(config, page_class):
+    """Get the limiter for the given class of page, or None if the class
+       is not limited"""
+    limit = config.get('PAGE_CONCURRENCY', {}).get(page_class)
+    if limit is None:
+        return None
+    with _limiters_lock:
+        lim = _limiters.get(page_class)
+        if lim is None or lim.limit != limit:
+            lim = _limiters[page_class] = Limiter(
+                limit, config.get('MAX_QUEUED', MAX_QUEUED))
+        return lim
+
+
+def admit(config, page_class, func):
+    """Return the response from func(), if a request of the given class of
+       page can be handled now or soon, otherwise abort with a 503 error.
+       func() must return a Flask Response; the limit is held until the
+       response has been sent, so includes any streaming of the page."""
+    lim = get_limiter(config, page_class)
+    if lim is None:
+        return func()
+    timeout = config.get('ADMISSION_TIMEOUT', ADMISSION_TIMEOUT)
+    if not lim.acquire(timeout):
+        abort(Response("The server is busy; please try again shortly.\n",
+                       503, {'Retry-After': str(max(int(timeout), 1)),
+                             'Content-Type': 'text/plain'}))
+    try:
+        rv = func()
+    except:  # noqa: E722
+        lim.release()
+        raise
+    rv.call_on_close(lim.release)
+    return rv
@@ -0,0 +1,451 @@
+"""Append-only columnar archive of test and benchmark history.
+
+   Runtime plots and benchmark charts need a handful of columns for one
+   test or benchmark file over every build, which in the row-oriented
+   imp_test and imp_benchmark tables means reading a large fraction of the
+   table. The archive instead stores each column of each month of builds
+   as a flat binary array, so a query memory-maps only the columns and
+   months it needs (and, since each month is sorted by date, only the
+   part of each month within the requested date range).
+
+   Layout, under <ARCHIVE_DIR>/<branch>/:
+     states               test state names, one per line; the state
+                          column stores the (0-based) line number
+     test/YYYYMM/         date, name, arch, state, runtime columns
+     benchmark/YYYYMM/    date, name, platform, runtime, checkval columns
+   Each month directory also has a 'rows' file with the number of rows;
+   this is written last, so a partially-appended build is ignored (and
+   overwritten by the next sync). Since most queries are for a single test
+   or benchmark, each month also has a 'name.idx' file: every name in the
+   month, sorted, followed by the row number of each, so that only the
+   rows for the requested names need be read.
+
+   Dates are stored as proleptic Gregorian ordinals, and NULL runtimes or
+   check values as NaN.
+
+   The archive is brought up to date with the 'sync' command, e.g.
+   python archive.py sync /path/to/imp-results.cfg develop
+"""
+
+import array
+import bisect
+import datetime
+import math
+import mmap
+import os
+import struct
+import threading
+import MySQLdb
+
+TEST_FIELDS = (('date', 'i'), ('name', 'i'), ('arch', 'i'), ('state', 'B'),
+               ('runtime', 'f'))
+BENCHMARK_FIELDS = (('date', 'i'), ('name', 'i'), ('platform', 'i'),
+                    ('runtime', 'f'), ('checkval', 'd'))
+
+
+def _null_to_nan(val):
+    return float('nan') if val is None else val
+
+
+def _nan_to_null(val):
+    return None if math.isnan(val) else val
+
+
+class _Column(object):
+    """Sequence view of the first `nrows` entries of a memory-mapped
+       column (starting `offset` bytes into the file), suitable for
+       bisect"""
+
+    def __init__(self, mm, nrows, typecode, offset=0):
+        self._mm, self._nrows, self._offset = mm, nrows, offset
+        self._fmt = '=' + typecode
+        self._size = struct.calcsize(self._fmt)
+
+    def __len__(self):
+        return self._nrows
+
+    def __getitem__(self, i):
+        return struct.unpack_from(self._fmt, self._mm,
+                                  self._offset + i * self._size)[0]
+
+
+class _Partition(object):
+    """One month of rows, stored as one file per column"""
+
+    def __init__(self, dirname, fields, indexed=None):
+        self.dirname = dirname
+        self.fields = fields
+        self.typecodes = dict(fields)
+        self.indexed = indexed
+        fname = os.path.join(dirname, 'rows')
+        if os.path.exists(fname):
+            with open(fname) as fh:
+                self.nrows = int(fh.read())
+        else:
+            self.nrows = 0
+
+    def _map(self, fname):
+        with open(os.path.join(self.dirname, fname)) as fh:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, column, start, stop):
+        """Read rows [start, stop) of the given column as an array"""
+        a = array.array(self.typecodes[column])
+        if stop > start:
+            mm = self._map(column)
+            try:
+                a.fromstring(mm[start * a.itemsize:stop * a.itemsize])
+            finally:
+                mm.close()
+        return a
+
+    def read_rows(self, column, rows):
+        """Read the given rows (a sorted list of row numbers) of the given
+           column as an array"""
+        a = array.array(self.typecodes[column])
+        if rows:
+            mm = self._map(column)
+            try:
+                data = _Column(mm, self.nrows, a.typecode)
+                a.extend(data[i] for i in rows)
+            finally:
+                mm.close()
+        return a
+
+    def lookup(self, values, start, stop):
+        """Get the sorted list of rows in [start, stop) whose value of the
+           indexed column is in the set `values`, using the index. Return
+           None if there is no up-to-date index."""
+        fname = os.path.join(self.dirname, self.indexed + '.idx')
+        if self.nrows == 0 or not os.path.exists(fname):
+            return None
+        typecode = self.typecodes[self.indexed]
+        entry = struct.calcsize('=' + typecode) + struct.calcsize('=i')
+        mm = self._map(self.indexed + '.idx')
+        try:
+            # An append may have been interrupted before indexing its rows
+            n = len(mm) // entry
+            if n < self.nrows:
+                return None
+            keys = _Column(mm, n, typecode)
+            rows = _Column(mm, n, 'i', n * struct.calcsize('=' + typecode))
+            found = []
+            for val in values:
+                for i in range(bisect.bisect_left(keys, val),
+                               bisect.bisect_right(keys, val)):
+                    if start <= rows[i] < stop:
+                        found.append(rows[i])
+        finally:
+            mm.close()
+        return sorted(found)
+
+    def has_index(self):
+        fname = os.path.join(self.dirname, self.indexed + '.idx')
+        return os.path.exists(fname) and os.stat(fname).st_size \
+            >= self.nrows * (struct.calcsize('=' + self.typecodes[self.indexed])
+                             + struct.calcsize('=i'))
+
+    def write_index(self):
+        """Write the index of all rows by the value of the indexed column"""
+        data = self.read(self.indexed, 0, self.nrows)
+        rows = array.array('i', sorted(range(len(data)),
+                                       key=data.__getitem__))
+        keys = array.array(data.typecode, (data[i] for i in rows))
+        tmpname = os.path.join(self.dirname, self.indexed + '.idx.tmp')
+        with open(tmpname, 'wb') as fh:
+            keys.tofile(fh)
+            rows.tofile(fh)
+        os.rename(tmpname, os.path.join(self.dirname, self.indexed + '.idx'))
+
+    def get_range(self, since, until):
+        """Get the range of rows with dates (as ordinals) between `since`
+           and `until` inclusive; either may be None"""
+        if self.nrows == 0:
+            return 0, 0
+        mm = self._map('date')
+        try:
+            dates = _Column(mm, self.nrows, self.typecodes['date'])
+            start = 0 if since is None else bisect.bisect_left(dates, since)
+            stop = self.nrows if until is None \
+                else bisect.bisect_right(dates, until)
+        finally:
+            mm.close()
+        return start, stop
+
+    def last_date(self):
+        if self.nrows > 0:
+            return self.read('date', self.nrows - 1, self.nrows)[0]
+
+    def append(self, columns):
+        """Append rows, given as a dict of column name -> array"""
+        if not os.path.exists(self.dirname):
+            os.makedirs(self.dirname)
+        nrows = None
+        for column, typecode in self.fields:
+            a = columns[column]
+            nrows = len(a)
+            with open(os.path.join(self.dirname, column), 'ab') as fh:
+                # Discard anything left over from an interrupted append
+                fh.truncate(self.nrows * a.itemsize)
+                a.tofile(fh)
+        self.nrows += nrows
+        # Index the new rows before readers can see them
+        if self.indexed:
+            self.write_index()
+        tmpname = os.path.join(self.dirname, 'rows.tmp')
+        with open(tmpname, 'w') as fh:
+            fh.write('%d\n' % self.nrows)
+        os.rename(tmpname, os.path.join(self.dirname, 'rows'))
+
+
+class ColumnStore(object):
+    """All rows of one kind (tests or benchmarks), partitioned by month"""
+
+    def __init__(self, topdir, fields, indexed=None):
+        self.topdir = topdir
+        self.fields = fields
+        self.typecodes = dict(fields)
+        self.indexed = indexed
+
+    def _get_months(self):
+        if not os.path.exists(self.topdir):
+            return []
+        return sorted(m for m in os.listdir(self.topdir) if m.isdigit())
+
+    def _get_partition(self, month):
+        return _Partition(os.path.join(self.topdir, month), self.fields,
+                          self.indexed)
+
+    def get_last_date(self):
+        """Get the date of the newest rows in the store, or None"""
+        for month in reversed(self._get_months()):
+            d = self._get_partition(month).last_date()
+            if d is not None:
+                return datetime.date.fromordinal(d)
+
+    def append(self, rows):
+        """Append rows (tuples in the same order as the store's fields,
+           starting with a datetime.date), which must be sorted by date and
+           be newer than any already in the store"""
+        month, part = None, None
+        for row in rows:
+            m = row[0].strftime('%Y%m')
+            if m != month:
+                if part:
+                    self._get_partition(month).append(part)
+                month = m
+                part = dict((f, array.array(t)) for f, t in self.fields)
+            part['date'].append(row[0].toordinal())
+            for (f, t), val in zip(self.fields[1:], row[1:]):
+                part[f].append(val)
+        if part:
+            self._get_partition(month).append(part)
+
+    def write_indexes(self):
+        """Index any months that are missing an up-to-date index (e.g.
+           those archived before indexes were added)"""
+        for month in self._get_months():
+            part = self._get_partition(month)
+            if part.nrows > 0 and not part.has_index():
+                part.write_index()
+
+    def query(self, columns, since=None, until=None, where=None):
+        """Get the given columns for all rows with dates between `since` and
+           `until` inclusive (either may be None), as a dict of column
+           name -> array. `where` restricts the rows to those whose
+           value in each of the given columns equals the given value (or
+           is in the given set)."""
+        s = None if since is None else since.toordinal()
+        u = None if until is None else until.toordinal()
+        s_month = None if since is None else since.strftime('%Y%m')
+        u_month = None if until is None else until.strftime('%Y%m')
+        where = dict((col, val if isinstance(val, (set, frozenset))
+                      else frozenset((val,)))
+                     for col, val in (where or {}).items())
+        result = dict((c, array.array(self.typecodes[c])) for c in columns)
+        for month in self._get_months():
+            if (s_month and month < s_month) or (u_month and month > u_month):
+                continue
+            part = self._get_partition(month)
+            start, stop = part.get_range(s, u)
+            if start >= stop:
+                continue
+            # Row numbers of the matching rows, or None for all rows
+            match = None
+            filters = where
+            if self.indexed in where:
+                match = part.lookup(where[self.indexed], start, stop)
+                if match is not None:
+                    filters = dict((col, val) for col, val in where.items()
+                                   if col != self.indexed)
+            for col, val in filters.items():
+                if match is None:
+                    data = part.read(col, start, stop)
+                    match = [start + i for i in range(len(data))
+                             if data[i] in val]
+                else:
+                    data = part.read_rows(col, match)
+                    match = [r for r, d in zip(match, data) if d in val]
+            for col in columns:
+                if match is None:
+                    result[col].extend(part.read(col, start, stop))
+                else:
+                    result[col].extend(part.read_rows(col, match))
+        return result
+
+
+class ColumnArchive(object):
+    """Columnar archive of the test and benchmark results on one branch"""
+
+    def __init__(self, topdir, branch):
+        self.topdir = os.path.join(topdir, branch.replace('/', '_'))
+        self.tests = ColumnStore(os.path.join(self.topdir, 'test'),
+                                 TEST_FIELDS, indexed='name')
+        self.benchmarks = ColumnStore(os.path.join(self.topdir, 'benchmark'),
+                                      BENCHMARK_FIELDS, indexed='name')
+        self._states_file = os.path.join(self.topdir, 'states')
+        self._load_states()
+
+    def _load_states(self):
+        if os.path.exists(self._states_file):
+            with open(self._states_file) as fh:
+                self.states = fh.read().split()
+        else:
+            self.states = []
+
+    def get_last_date(self):
+        """Get the date of the last build in the archive, or None"""
+        return self.tests.get_last_date()
+
+    def _get_state_code(self, state):
+        try:
+            return self.states.index(state)
+        except ValueError:
+            self.states.append(state)
+            if not os.path.exists(self.topdir):
+                os.makedirs(self.topdir)
+            with open(self._states_file, 'a') as fh:
+                fh.write(state + '\n')
+            return len(self.states) - 1
+
+    def query_tests(self, columns, since=None, until=None, **where):
+        """Get the given columns (any of date, name, arch, state, runtime)
+           for test results between `since` and `until` inclusive, as a
+           dict of column name -> list, optionally restricted to the given
+           column values, e.g. query_tests(['date', 'runtime'], name=42,
+           state='OK')"""
+        if 'state' in where:
+            states = where['state']
+            if not isinstance(states, (set, frozenset)):
+                states = frozenset((states,))
+            where['state'] = frozenset(self.states.index(s) for s in states
+                                       if s in self.states)
+        ret = self.tests.query(columns, since, until, where)
+        return self._convert(ret)
+
+    def query_benchmarks(self, columns, since=None, until=None, **where):
+        """Get the given columns (any of date, name, platform, runtime,
+           checkval) for benchmark results between `since` and `until`
+           inclusive; see query_tests()"""
+        ret = self.benchmarks.query(columns, since, until, where)
+        return self._convert(ret)
+
+    def _convert(self, ret):
+        """Convert raw columns back to dates, states and NULLs"""
+        out = {}
+        if 'state' in ret and ret['state'] \
+           and max(ret['state']) >= len(self.states):
+            # New states were added by a sync in another process
+            self._load_states()
+        for col, data in ret.items():
+            if col == 'date':
+                out[col] = [datetime.date.fromordinal(d) for d in data]
+            elif col == 'state':
+                out[col] = [self.states[s] for s in data]
+            elif col in ('runtime', 'checkval'):
+                out[col] = [_nan_to_null(v) for v in data]
+            else:
+                out[col] = list(data)
+        return out
+
+    def sync(self, db):
+        """Append all builds newer than those already archived, up to the
+           date of the given BuildDatabase (which must include lab-only
+           results). Since rows are only ever appended, builds are archived
+           only up to the newest that has finished; any older unfinished
+           build was aborted, so its rows are archived as they are, while
+           newer ones are added once they finish."""
+        upto = None
+        for date in reversed(db.get_build_dates_on_disk()):
+            if date <= db.date and db.is_build_finished(date):
+                upto = date
+                break
+        if upto is None:
+            return
+        for store, table, query, convert in (
+                (self.tests, db.get_branch_table('imp_test'),
+                 'SELECT date,name,arch,state,runtime FROM ',
+                 lambda r: (r[0], r[1], r[2], self._get_state_code(r[3]),
+                            _null_to_nan(r[4]))),
+                (self.benchmarks, db.get_branch_table('imp_benchmark'),
+                 'SELECT date,name,platform,runtime,checkval FROM ',
+                 lambda r: (r[0], r[1], r[2], _null_to_nan(r[3]),
+                            _null_to_nan(r[4])))):
+            last = store.get_last_date()
+            c = MySQLdb.cursors.SSCursor(db.conn)
+            if last is None:
+                c.execute(query + table + ' WHERE date<=%s ORDER BY date',
+                          (upto,))
+            else:
+                c.execute(query + table + ' WHERE date>%s AND date<=%s '
+                          'ORDER BY date', (last, upto))
+            store.append(convert(r) for r in c)
+            store.write_indexes()
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_column_archive(config, branch):
+    """Get the columnar archive for the given branch, or None if
+       ARCHIVE_DIR is not configured"""
+    topdir = config.get('ARCHIVE_DIR')
+    if not topdir:
+        return None
+    with _archives_lock:
+        a = _archives.get((topdir, branch))
+        if a is None:
+            a = _archives[(topdir, branch)] = ColumnArchive(topdir, branch)
+        return a
+
+
+def main():
+    import argparse
+    import flask
+    from build_calendar import get_link_date
+    from imp_build_utils import BuildDatabase
+    parser = argparse.ArgumentParser(
+        description="Append new builds to the columnar archive")
+    parser.add_argument('command', choices=['sync'])
+    parser.add_argument('config', help="Application configuration file")
+    parser.add_argument('branch')
+    parser.add_argument('date', nargs='?',
+                        help="Date of last build to archive (YYYYMMDD); "
+                             "by default, the most recent build")
+    args = parser.parse_args()
+    config = flask.Config(os.path.dirname(os.path.abspath(args.config)))
+    config.from_pyfile(os.path.abspath(args.config))
+    if args.date:
+        date = datetime.datetime.strptime(args.date, '%Y%m%d').date()
+    else:
+        date = get_link_date(os.readlink(os.path.join(
+            config['LAB_ONLY_TOPDIR'], args.branch, 'lastbuild')))
+    conn = MySQLdb.connect(host=config['HOST'], user=config['USER'],
+                           passwd=config['PASSWORD'], db=config['DATABASE'])
+    db = BuildDatabase(conn, config, date, True, args.branch)
+    ColumnArchive(config['ARCHIVE_DIR'], args.branch).sync(db)
+
+
+if __name__ == '__main__':
+    main()
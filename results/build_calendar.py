@@ -0,0 +1,227 @@
+"""In-memory calendar of all builds on each branch.
+
+   Every page needs the date of the last build, the version and revision of
+   the build being shown, and the builds either side of it for navigation.
+   Rather than reading these from the database on every request, we load
+   the (small) table of builds once per branch and reload it only when the
+   'lastbuild' link changes, i.e. when a new nightly build is available
+   (or, until it is, when the build the link points to is not yet in
+   the table).
+"""
+
+import bisect
+import datetime
+import os
+import threading
+import time
+
+# How often (in seconds) to check whether the lastbuild link has changed
+CHECK_INTERVAL = 60
+
+
+def get_link_date(link):
+    """Get the date of the build a lastbuild link points to"""
+    s = os.path.basename(os.path.normpath(link))
+    return datetime.date(year=int(s[:4]), month=int(s[4:6]), day=int(s[6:8]))
+
+
+class BuildCalendar(object):
+    """All builds on one branch, ordered by date, with their revisions
+       and (for the master branch) versions."""
+
+    def __init__(self):
+        #: Date of the most recent build (the target of the lastbuild link)
+        self.last_build_date = None
+        self.dates = []
+        self.revisions = []
+        self.versions = []
+        self._version_dates = {}
+        self._link = None
+        self._checked = 0.
+        self._lock = threading.Lock()
+
+    def set_builds(self, rows):
+        """Set the builds from (date, revision, version) rows, which must be
+           sorted by date"""
+        dates, revisions, versions = [], [], []
+        version_dates = {}
+        for date, rev, version in rows:
+            dates.append(date)
+            revisions.append(rev)
+            versions.append(version)
+            if version and version not in version_dates:
+                version_dates[version] = date
+        self.dates, self.revisions, self.versions = dates, revisions, versions
+        self._version_dates = version_dates
+
+    def update(self, conn, table, topdir, with_versions):
+        """Reload the builds from the database, if the lastbuild link in
+           `topdir` has changed since they were last loaded, or the build
+           it points to was not in the database then (the link can be
+           updated before the build is added)."""
+        with self._lock:
+            now = time.time()
+            if self._link is not None and now - self._checked < CHECK_INTERVAL:
+                return
+            self._checked = now
+            link = os.readlink(os.path.join(topdir, 'lastbuild'))
+            if link == self._link and self._find(self.last_build_date) \
+               is not None:
+                return
+            c = conn.cursor()
+            if with_versions:
+                c.execute('SELECT date,rev,version FROM ' + table
+                          + ' ORDER BY date')
+                self.set_builds(c)
+            else:
+                c.execute('SELECT date,rev FROM ' + table + ' ORDER BY date')
+                self.set_builds((row[0], row[1], None) for row in c)
+            self.last_build_date = get_link_date(link)
+            self._link = link
+
+    def _find(self, date):
+        i = bisect.bisect_left(self.dates, date)
+        if i < len(self.dates) and self.dates[i] == date:
+            return i
+
+    def get_revision(self, date):
+        """Get the revision built on the given date, or None"""
+        i = self._find(date)
+        if i is not None:
+            return self.revisions[i]
+
+    def get_version(self, date):
+        """Get the version built on the given date, or None"""
+        i = self._find(date)
+        if i is not None:
+            return self.versions[i]
+
+    def get_version_date(self, version):
+        """Get the date of the build of the given version, or None"""
+        return self._version_dates.get(version)
+
+    def get_previous(self, date):
+        """Get the date of the last build before `date`, or None"""
+        i = bisect.bisect_left(self.dates, date)
+        if i > 0:
+            return self.dates[i - 1]
+
+    def get_neighbors(self, date, before=1, after=2):
+        """Get up to `before` builds before `date`, and up to `after` builds
+           on or after it, as lists of dates and versions"""
+        i = bisect.bisect_left(self.dates, date)
+        start = max(i - before, 0)
+        return self.dates[start:i + after], self.versions[start:i + after]
+
+    def get_months(self):
+        """Get every (year, month) that has at least one build, newest
+           first, together with the builds in that month as a dict
+           from date to version."""
+        months = []
+        for date, version in zip(reversed(self.dates),
+                                 reversed(self.versions)):
+            if not months or months[-1][0] != (date.year, date.month):
+                months.append(((date.year, date.month), {}))
+            months[-1][1][date] = version
+        return months
+
+
+class SummaryCalendar(object):
+    """The overall state (OK, TEST, BUILD, ...) of every build on one
+       branch, for both the public and lab-only builds, ordered by date.
+       This is used to quickly find the last build in a given state."""
+
+    def __init__(self):
+        self.dates = []
+        self.public_states = []
+        self.lab_states = []
+        # All builds before this date have been loaded
+        self._loaded_before = None
+        # Index of the last matching build at or before each position, for
+        # each combination of state set and lab_only that has been queried
+        self._pointers = {}
+        self._lock = threading.Lock()
+
+    def add_rows(self, rows):
+        """Add (date, lab_only, state) rows, which must be sorted by date
+           and be newer than any already added"""
+        for date, lab_only, state in rows:
+            if not self.dates or self.dates[-1] != date:
+                self.dates.append(date)
+                self.public_states.append(None)
+                self.lab_states.append(None)
+            if lab_only:
+                self.lab_states[-1] = state
+            else:
+                self.public_states[-1] = state
+
+    def update(self, conn, table, date, last_build_date):
+        """Make sure all builds before `date` are loaded, reading only
+           those not loaded already. Builds on or after `date` are not
+           loaded, since they may not have finished yet. `date` is clamped
+           to `last_build_date` (if not None) for the same reason: builds
+           can still be added for any later date."""
+        if last_build_date is not None and date > last_build_date:
+            date = last_build_date
+        with self._lock:
+            if self._loaded_before is not None and self._loaded_before >= date:
+                return
+            c = conn.cursor()
+            if self._loaded_before is None:
+                c.execute('SELECT date,lab_only,state FROM ' + table
+                          + ' WHERE date<%s ORDER BY date,lab_only', (date,))
+            else:
+                c.execute('SELECT date,lab_only,state FROM ' + table
+                          + ' WHERE date>=%s AND date<%s '
+                          'ORDER BY date,lab_only',
+                          (self._loaded_before, date))
+            self.add_rows(c)
+            self._loaded_before = date
+
+    def _get_pointers(self, states, lab_only):
+        key = (frozenset(states), lab_only)
+        ptr = self._pointers.get(key)
+        if ptr is None:
+            ptr = self._pointers[key] = []
+        # Extend to cover any newly-added builds
+        for i in range(len(ptr), len(self.dates)):
+            match = self.public_states[i] in states \
+                and (not lab_only or self.lab_states[i] in states)
+            ptr.append(i if match else ptr[-1] if ptr else -1)
+        return ptr
+
+    def get_last_build_with_summary(self, date, states, lab_only):
+        """Get the date of the last build before `date` whose public
+           (and, if `lab_only` is True, lab-only) build is in one of the
+           given states, or None."""
+        with self._lock:
+            ptr = self._get_pointers(states, lab_only)
+            i = bisect.bisect_left(self.dates, date) - 1
+            if i >= 0 and ptr[i] >= 0:
+                return self.dates[ptr[i]]
+
+
+_calendars = {}
+_summaries = {}
+_calendars_lock = threading.Lock()
+
+
+def get_build_calendar(conn, table, topdir, with_versions):
+    """Get the up to date build calendar for the given imp_test_reporev
+       table and build directory"""
+    key = (table, topdir)
+    with _calendars_lock:
+        cal = _calendars.get(key)
+        if cal is None:
+            cal = _calendars[key] = BuildCalendar()
+    cal.update(conn, table, topdir, with_versions)
+    return cal
+
+
+def get_summary_calendar(table):
+    """Get the build summary calendar for the given imp_build_summary table"""
+    with _calendars_lock:
+        cal = _summaries.get(table)
+        if cal is None:
+            cal = _summaries[table] = SummaryCalendar()
+        return cal
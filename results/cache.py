@@ -0,0 +1,285 @@
+"""Caches shared by the application's pages, page fragments and data.
+
+   Each cache is a key-value store with optional per-entry expiry times
+   (TTL) and a bounded size. The backend is chosen with the CACHE_BACKEND
+   configuration option:
+     'lru'        in-process least-recently-used cache (the default); each
+                  process has its own copy
+     'sqlite'     a SQLite file per cache in CACHE_DIR, shared by all
+                  processes on the same machine
+     'memcached'  one or more memcached servers, given as a list of
+                  'host:port' strings in CACHE_SERVERS
+   CACHE_MAX_SIZE sets the maximum number of entries (for 'lru') or bytes
+   (for 'sqlite') per cache; memcached servers have their own limits.
+
+   Keys are tuples, and values can be any picklable object. Most users
+   should use a namespace (e.g. by branch and lab_only) rather than the
+   cache directly, so that unrelated entries never collide.
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+
+# Default maximum number of entries in an in-process cache
+MAX_ITEMS = 200
+
+# Default maximum size (in bytes) of an on-disk cache
+MAX_BYTES = 256 * 1024 * 1024
+
+# Longest expiry time that memcached treats as relative (30 days); larger
+# values are taken to be absolute Unix times
+MEMCACHED_MAX_TTL = 2592000
+
+
+class Cache(object):
+    """Base class for all caches. Each provides get(key), which returns
+       the value for the key, or None if it is not in the cache or has
+       expired; set(key, value, ttl=None), to store a value that expires
+       after `ttl` seconds (or never, if None); and delete(key), to remove
+       a key from the cache if it is present."""
+
+    def namespace(self, *parts):
+        """Get a view of this cache in which every key is prefixed by the
+           given parts, e.g. cache.namespace(branch, lab_only)"""
+        return _Namespace(self, parts)
+
+
+class _Namespace(Cache):
+    def __init__(self, cache, prefix):
+        self._cache, self._prefix = cache, prefix
+
+    def get(self, key):
+        return self._cache.get(self._prefix + (key,))
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(self._prefix + (key,), value, ttl)
+
+    def delete(self, key):
+        self._cache.delete(self._prefix + (key,))
+
+    def namespace(self, *parts):
+        return _Namespace(self._cache, self._prefix + parts)
+
+
+class LRUCache(Cache):
+    """In-process cache of at most `max_items` entries"""
+
+    def __init__(self, max_items=MAX_ITEMS):
+        self.max_items = max_items
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                return None
+            # Mark as most recently used
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteCache(Cache):
+    """Cache in a SQLite file, which can be shared by several processes.
+       When the total size of the values exceeds `max_bytes`, the least
+       recently used entries are removed."""
+
+    def __init__(self, fname, max_bytes=MAX_BYTES):
+        self.fname, self.max_bytes = fname, max_bytes
+        self._conn = sqlite3.connect(fname, timeout=30,
+                                     check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                               '(key TEXT PRIMARY KEY, value BLOB, '
+                               'size INTEGER, expires REAL, used REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS cache_used '
+                               'ON cache (used)')
+            self._conn.commit()
+
+    def get(self, key):
+        k = repr(key)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires FROM cache WHERE key=?',
+                (k,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < now:
+                self._conn.execute('DELETE FROM cache WHERE key=?', (k,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE cache SET used=? WHERE key=?',
+                               (now, k))
+            self._conn.commit()
+        return pickle.loads(str(row[0]))
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = None if ttl is None else now + ttl
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                (repr(key), sqlite3.Binary(data), len(data), expires, now))
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE key=?', (repr(key),))
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute('DELETE FROM cache WHERE expires<?',
+                           (time.time(),))
+        total = self._conn.execute(
+            'SELECT SUM(size) FROM cache').fetchone()[0] or 0
+        if total <= self.max_bytes:
+            return
+        # Remove least recently used entries until we are under the limit
+        excess = total - self.max_bytes
+        keys = []
+        for key, size in self._conn.execute(
+                'SELECT key, size FROM cache ORDER BY used'):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany('DELETE FROM cache WHERE key=?', keys)
+
+
+class MemcachedCache(Cache):
+    """Client for one or more memcached servers, using the text protocol.
+       Keys are spread over the servers by hash. Errors talking to a server
+       are treated as cache misses, so that pages still work (more slowly)
+       if the cache is down."""
+
+    def __init__(self, servers, timeout=1.0):
+        self.servers = []
+        for s in servers:
+            host, port = s.rsplit(':', 1)
+            self.servers.append((host, int(port)))
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_key(self, key):
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def _get_socket(self, mkey):
+        server = self.servers[int(mkey[:8], 16) % len(self.servers)]
+        socks = self._local.__dict__.setdefault('socks', {})
+        s = socks.get(server)
+        if s is None:
+            s = socket.create_connection(server, self.timeout)
+            socks[server] = s.makefile('rwb')
+        return server, socks[server]
+
+    def _command(self, mkey, func):
+        server = None
+        try:
+            server, fh = self._get_socket(mkey)
+            return func(fh)
+        except (socket.error, IOError, ValueError):
+            # Drop the connection; it will be reopened on the next request
+            if server:
+                self._local.socks.pop(server, None)
+
+    def get(self, key):
+        mkey = self._get_key(key)
+
+        def get(fh):
+            fh.write('get %s\r\n' % mkey)
+            fh.flush()
+            line = fh.readline()
+            if line.startswith('VALUE '):
+                length = int(line.split()[3])
+                data = fh.read(length + 2)[:-2]
+                if fh.readline() != 'END\r\n':
+                    raise ValueError("Unexpected memcached response")
+                return pickle.loads(data)
+            elif line != 'END\r\n':
+                raise ValueError("Unexpected memcached response")
+        return self._command(mkey, get)
+
+    def set(self, key, value, ttl=None):
+        mkey = self._get_key(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        # Zero means 'never expire', and negative 'expire immediately'
+        if ttl is None:
+            exptime = 0
+        elif ttl <= 0:
+            exptime = -1
+        elif ttl > MEMCACHED_MAX_TTL:
+            exptime = int(time.time() + ttl)
+        else:
+            exptime = max(int(ttl), 1)
+
+        def set(fh):
+            fh.write('set %s 0 %d %d\r\n%s\r\n'
+                     % (mkey, exptime, len(data), data))
+            fh.flush()
+            fh.readline()
+        self._command(mkey, set)
+
+    def delete(self, key):
+        mkey = self._get_key(key)
+
+        def delete(fh):
+            fh.write('delete %s\r\n' % mkey)
+            fh.flush()
+            fh.readline()
+        self._command(mkey, delete)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _make_cache(config, name):
+    backend = config.get('CACHE_BACKEND', 'lru')
+    if backend == 'lru':
+        return LRUCache(config.get('CACHE_MAX_SIZE', MAX_ITEMS))
+    elif backend == 'sqlite':
+        return SQLiteCache(os.path.join(config['CACHE_DIR'],
+                                        name + '.sqlite'),
+                           config.get('CACHE_MAX_SIZE', MAX_BYTES))
+    elif backend == 'memcached':
+        # All caches share the servers, so keep them apart by name
+        return MemcachedCache(config['CACHE_SERVERS']).namespace(name)
+    else:
+        raise ValueError("Unknown CACHE_BACKEND %s" % backend)
+
+
+def get_cache(config, name):
+    """Get the named cache (e.g. 'pages', 'fragments' or 'data'), using
+       the configured backend"""
+    key = (name, config.get('CACHE_BACKEND', 'lru'), config.get('CACHE_DIR'),
+           tuple(config.get('CACHE_SERVERS', ())))
+    with _caches_lock:
+        c = _caches.get(key)
+        if c is None:
+            c = _caches[key] = _make_cache(config, name)
+        return c
@@ -0,0 +1,125 @@
+"""Grouping of a build's test failures by the cause of failure.
+
+   On a bad night, hundreds of tests can fail for the same reason on many
+   platforms. Each failure's output ('detail') is normalized, by removing
+   things that differ between otherwise identical failures (directory
+   names, memory addresses, line numbers and other numbers), and hashed to
+   give a signature. Failures with the same signature are grouped into a
+   cluster, so that each cause only needs to be looked at once.
+
+   Clusters for a build are computed once and cached.
+"""
+
+import collections
+import hashlib
+import re
+from imp_build_utils import BuildDatabase
+from history import get_failure_history
+from cache import get_cache
+
+# Maximum length of the summary of each cluster's failure output
+MAX_SUMMARY = 200
+
+_Failure = collections.namedtuple(
+    '_Failure', ['name', 'test_name', 'unit_name', 'unit_id', 'arch',
+                 'arch_name', 'state'])
+
+_Cluster = collections.namedtuple(
+    '_Cluster', ['signature', 'summary', 'units', 'arch_names', 'first_seen',
+                 'failures'])
+
+# Patterns to replace when normalizing output, in order
+_NORMALIZE = [
+    # Directory names (keeping the file name)
+    (re.compile(r'(?:[A-Za-z]:)?(?:[\w.~+-]*[/\\])+([\w.+-]+)'), r'\1'),
+    # Memory addresses
+    (re.compile(r'0x[0-9a-fA-F]+'), '0x?'),
+    # Line numbers
+    (re.compile(r'\bline \d+', re.IGNORECASE), 'line ?'),
+    (re.compile(r'(\.\w+):\d+'), r'\1:?'),
+    # Any other numbers
+    (re.compile(r'\d+(?:\.\d+)?(?:[eE][-+]?\d+)?'), '?'),
+    # Whitespace
+    (re.compile(r'[ \t]+'), ' ')]
+
+
+def normalize_detail(detail):
+    """Normalize test output, so that the same failure gives the same text
+       regardless of where and when it happened"""
+    for regex, repl in _NORMALIZE:
+        detail = regex.sub(repl, detail)
+    return '\n'.join(line.strip() for line in detail.splitlines()
+                     if line.strip())
+
+
+def get_signature(detail):
+    """Get a short signature of the cause of a failure from its output
+       (either bytes, as returned by MySQLdb, or unicode)"""
+    normalized = normalize_detail(detail or '')
+    if isinstance(normalized, unicode):
+        normalized = normalized.encode('utf-8')
+    return hashlib.sha1(normalized).hexdigest()[:12]
+
+
+def _get_summary(detail):
+    """Get the last non-blank line of test output, which usually gives
+       the error, as unicode"""
+    lines = [x for x in (detail or '').splitlines() if x.strip()]
+    summary = lines[-1].strip() if lines else ''
+    if not isinstance(summary, unicode):
+        summary = summary.decode('utf-8', 'replace')
+    if len(summary) > MAX_SUMMARY:
+        summary = summary[:MAX_SUMMARY] + '...'
+    return summary
+
+
+def get_failure_clusters(db):
+    """Group the failures in the build by signature, and return a list
+       of clusters, largest first. The date each cluster was first seen
+       is None if the failure history index is being built by another
+       request."""
+    table = db.get_branch_table('imp_test')
+    history = get_failure_history(table)
+    # The index cannot be moved past the last build (see
+    # FailureHistory.update), and don't wait for another request to build it
+    last = db.get_calendar().last_build_date
+    indexed = last is not None and db.date <= last \
+        and history.update(db.conn, table, db.date, db.is_build_finished,
+                           wait=False)
+    groups = collections.OrderedDict()
+    for row in db.query_tests(['name', 'test_name', 'unit_name', 'unit_id',
+                               'arch', 'arch_name', 'state', 'detail'],
+                              failed=True, order_by=('unit_name', 'name',
+                                                     'arch')):
+        sig = get_signature(row['detail'])
+        group = groups.get(sig)
+        if group is None:
+            group = groups[sig] = (_get_summary(row['detail']), [], [])
+        group[1].append(_Failure(*[row[k] for k in _Failure._fields]))
+        if indexed:
+            group[2].append(history.get_failure_start(
+                row['name'], row['arch'], db.date) or db.date)
+    clusters = [_Cluster(signature, summary,
+                         sorted(set(f.unit_name for f in failures)),
+                         sorted(set(f.arch_name for f in failures)),
+                         min(starts) if starts else None, failures)
+                for signature, (summary, failures, starts) in groups.items()]
+    clusters.sort(key=lambda c: (-len(c.failures), c.first_seen))
+    return clusters
+
+
+def get_build_clusters(conn, config, date, lab_only, branch):
+    """Get the failure clusters for a build, using a cached copy if
+       available"""
+    db = BuildDatabase(conn, config, date, lab_only, branch)
+    cache = get_cache(config, 'data').namespace(branch, lab_only)
+    key = ('clusters', date)
+    clusters = cache.get(key)
+    if clusters is None:
+        clusters = get_failure_clusters(db)
+        # Failures can still be added until the build has finished, and
+        # when they were first seen may not be known yet
+        if db.is_build_finished(date) \
+           and all(c.first_seen is not None for c in clusters):
+            cache.set(key, clusters)
+    return clusters
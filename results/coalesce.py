@@ -0,0 +1,136 @@
+"""Coalescing of identical concurrent requests.
+
+   When the build email goes out, many people open the same pages within
+   a few seconds. Rather than each request running the same queries, the
+   first request for a page computes it, and identical requests that
+   arrive while it is doing so wait for and share its result.
+
+   Within a process this uses threads and events. If the COALESCE_DIR
+   configuration option is set, requests in other processes (e.g. other
+   mod_wsgi daemon processes) are also coalesced, using lock files in that
+   directory, with the result passed on in a pickle.
+"""
+
+import fcntl
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+
+# Results files older than this (in seconds) can no longer be of use to
+# any waiting request, and are removed
+MAX_RESULT_AGE = 300
+
+# Pages are spread over this many lock files (so that the number of files
+# does not grow with the number of pages); pages that share a lock file
+# are computed one at a time
+LOCK_FILES = 256
+
+
+class _Call(object):
+    """A computation in progress, which other threads can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """Run at most one computation per key at once in this process;
+       concurrent callers with the same key share the result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Return func(), or the result of the call to func() already in
+           progress for the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.exc_info:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except:  # noqa: E722
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class FileSingleFlight(object):
+    """Like SingleFlight, but across processes, using lock files in the
+       given directory. Results must be picklable."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def do(self, key, func):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        name = os.path.join(self.dirname, digest)
+        lock = os.path.join(self.dirname,
+                            '%d.lock' % (int(digest, 16) % LOCK_FILES))
+        start = time.time()
+        with open(lock, 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                # If another process computed the result while we were
+                # waiting for the lock, use it
+                try:
+                    if os.stat(name + '.result').st_mtime >= start:
+                        with open(name + '.result', 'rb') as rfh:
+                            return pickle.load(rfh)
+                except (OSError, IOError, EOFError, pickle.PickleError):
+                    pass
+                result = func()
+                self._write_result(name + '.result', result)
+                return result
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _write_result(self, fname, result):
+        fd, tmpname = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(result, fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, fname)
+        self._remove_old_results()
+
+    def _remove_old_results(self):
+        cutoff = time.time() - MAX_RESULT_AGE
+        for f in os.listdir(self.dirname):
+            if f.endswith('.result') or f.endswith('.tmp'):
+                try:
+                    if os.stat(os.path.join(self.dirname, f)).st_mtime \
+                       < cutoff:
+                        os.unlink(os.path.join(self.dirname, f))
+                except OSError:
+                    pass
+
+
+_single_flight = SingleFlight()
+
+
+def coalesce(config, key, func):
+    """Return func(), sharing the result with any identical concurrent
+       calls (those with the same key) in this process and, if
+       COALESCE_DIR is set, in other processes."""
+    dirname = config.get('COALESCE_DIR')
+    if dirname:
+        return _single_flight.do(
+            key, lambda: FileSingleFlight(dirname).do(key, func))
+    else:
+        return _single_flight.do(key, func)
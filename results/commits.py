@@ -0,0 +1,221 @@
+"""Index of the commits included in every nightly build, across branches.
+
+   Each build directory contains the git log of the commits made since
+   the previous build (imp-gitlog), so the build whose log contains a
+   commit is the first nightly build to include it. Reading every log to
+   answer "which build first included commit abc123" or "which builds
+   mention issue #1234" is slow, so the logs of each branch are instead
+   appended, in date order, to a single file, and an in-memory index of
+   commit hashes, authors and referenced issue numbers is built from them.
+
+   Layout, under <COMMIT_INDEX_DIR>/:
+     <branch>.gitlog      for each build, a line with the build date
+                          (YYYYMMDD), followed by a line for each commit,
+                          with the same NUL-separated fields as imp-gitlog
+   ('/' in branch names is replaced with '_'.) Builds are only appended
+   once they have finished, so each file only grows, and a running
+   application reads only the newly-appended part of each file.
+
+   The index is brought up to date with the 'sync' command, e.g.
+   python commits.py sync /path/to/imp-results.cfg develop master
+"""
+
+import bisect
+import collections
+import datetime
+import os
+import re
+import threading
+
+# Minimum length of a commit hash prefix that can be looked up
+MIN_PREFIX = 4
+
+# Maximum number of results for a lookup
+MAX_RESULTS = 200
+
+Commit = collections.namedtuple('Commit', ['githash', 'author_name',
+                                           'author_email', 'title',
+                                           'branch', 'date'])
+
+# References to issues in commit titles (but not, e.g., salilab/rmf#12,
+# which is an issue in a different repository)
+_ISSUE_RE = re.compile(r'(?<![\w/])#(\d+)\b')
+
+
+def get_index_path(topdir, branch):
+    return os.path.join(topdir, branch.replace('/', '_') + '.gitlog')
+
+
+def parse_query(query):
+    """Determine what kind of lookup a query is: 'issue' (e.g. '#1234'),
+       'commit' (a hash prefix) or 'author'. Return the kind and the
+       normalized query."""
+    query = query.strip()
+    m = re.match(r'#(\d+)$', query)
+    if m:
+        return 'issue', int(m.group(1))
+    if re.match('[0-9a-fA-F]{%d,40}$' % MIN_PREFIX, query):
+        return 'commit', query.lower()
+    return 'author', query.lower()
+
+
+class CommitIndex(object):
+    """Index of the commits in the builds of the given branches"""
+
+    def __init__(self, topdir, branches):
+        self.topdir = topdir
+        self._commits = []
+        self._hashes = []
+        self._authors = collections.defaultdict(list)
+        self._issues = collections.defaultdict(list)
+        # Amount of each branch's file read so far, and the current date
+        self._files = dict((b, (0, None)) for b in branches)
+        self._lock = threading.Lock()
+
+    def _add(self, commit):
+        n = len(self._commits)
+        self._commits.append(commit)
+        self._hashes.append((commit.githash.lower(), n))
+        email = commit.author_email.lower()
+        for key in set((commit.author_name.lower(), email,
+                        email.split('@')[0])):
+            self._authors[key].append(n)
+        for issue in set(int(i) for i in _ISSUE_RE.findall(commit.title)):
+            self._issues[issue].append(n)
+
+    def _read_branch(self, branch):
+        """Add any builds appended to the branch's file since it was last
+           read; return True if any commits were added"""
+        offset, date = self._files[branch]
+        fname = get_index_path(self.topdir, branch)
+        if not os.path.exists(fname) or os.stat(fname).st_size <= offset:
+            return False
+        added = False
+        with open(fname, 'rb') as fh:
+            fh.seek(offset)
+            for line in fh:
+                # Ignore a partially-written line at the end of the file
+                if not line.endswith('\n'):
+                    break
+                offset += len(line)
+                fields = line.rstrip('\r\n').decode('utf-8',
+                                                    'replace').split('\0')
+                if len(fields) == 1:
+                    date = datetime.datetime.strptime(fields[0],
+                                                      '%Y%m%d').date()
+                else:
+                    self._add(Commit(*(fields[:4] + [branch, date])))
+                    added = True
+        self._files[branch] = (offset, date)
+        return added
+
+    def refresh(self):
+        """Read any builds added to the index files since the last call"""
+        with self._lock:
+            added = False
+            for branch in self._files:
+                added = self._read_branch(branch) or added
+            if added:
+                self._hashes.sort()
+
+    def get_last_date(self, branch):
+        """Get the date of the last build of the given branch that has
+           been indexed, or None"""
+        self.refresh()
+        return self._files[branch][1]
+
+    def _find_hash(self, prefix):
+        i = bisect.bisect_left(self._hashes, (prefix,))
+        while i < len(self._hashes) and self._hashes[i][0].startswith(prefix):
+            yield self._hashes[i][1]
+            i += 1
+
+    def lookup(self, query, limit=MAX_RESULTS):
+        """Find commits by hash prefix, author (name, email or email
+           username) or issue number (e.g. '#1234'). Return the kind of
+           query (see parse_query) and a list of Commit objects, newest
+           first. For a hash prefix, only the first build on each branch
+           that included each matching commit is returned."""
+        self.refresh()
+        kind, key = parse_query(query)
+        with self._lock:
+            if kind == 'commit':
+                first = {}
+                for n in self._find_hash(key):
+                    c = self._commits[n]
+                    k = (c.githash, c.branch)
+                    if k not in first or c.date < first[k].date:
+                        first[k] = c
+                commits = list(first.values())
+            elif kind == 'issue':
+                commits = [self._commits[n] for n in self._issues.get(key, [])]
+            else:
+                commits = [self._commits[n]
+                           for n in self._authors.get(key, [])] if key else []
+        commits.sort(key=lambda c: (c.date, c.branch, c.githash),
+                     reverse=True)
+        return kind, commits[:limit]
+
+    def sync(self, db):
+        """Append the git logs of all finished builds of the branch of the
+           given BuildDatabase newer than those already indexed, up to the
+           date of the BuildDatabase. Builds older than the newest
+           finished build that have not finished were aborted, so are
+           skipped for good; newer ones are added once they finish."""
+        last = self.get_last_date(db.branch)
+        data = []
+        for date in db.get_build_dates_on_disk():
+            if (last is not None and date <= last) or date > db.date \
+               or not db.is_build_finished(date):
+                continue
+            data.append(date.strftime('%Y%m%d') + '\n')
+            for log in db.get_git_log(date) or []:
+                data.append('\0'.join(log) + '\n')
+        if data:
+            if not os.path.exists(self.topdir):
+                os.makedirs(self.topdir)
+            # Write all builds at once, so readers don't see a partial one
+            with open(get_index_path(self.topdir, db.branch), 'ab') as fh:
+                fh.write(''.join(data))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_commit_index(config, branches):
+    """Get the commit index of the given branches, or None if
+       COMMIT_INDEX_DIR is not configured"""
+    topdir = config.get('COMMIT_INDEX_DIR')
+    if not topdir:
+        return None
+    key = (topdir, tuple(branches))
+    with _indexes_lock:
+        i = _indexes.get(key)
+        if i is None:
+            i = _indexes[key] = CommitIndex(topdir, branches)
+        return i
+
+
+def main():
+    import argparse
+    import flask
+    from build_calendar import get_link_date
+    from imp_build_utils import BuildDatabase
+    parser = argparse.ArgumentParser(
+        description="Add new builds to the commit index")
+    parser.add_argument('command', choices=['sync'])
+    parser.add_argument('config', help="Application configuration file")
+    parser.add_argument('branches', nargs='+')
+    args = parser.parse_args()
+    config = flask.Config(os.path.dirname(os.path.abspath(args.config)))
+    config.from_pyfile(os.path.abspath(args.config))
+    index = CommitIndex(config['COMMIT_INDEX_DIR'], args.branches)
+    for branch in args.branches:
+        date = get_link_date(os.readlink(os.path.join(
+            config['TOPDIR'], branch, 'lastbuild')))
+        index.sync(BuildDatabase(None, config, date, False, branch))
+
+
+if __name__ == '__main__':
+    main()
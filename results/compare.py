@@ -0,0 +1,151 @@
+"""Comparison of two arbitrary builds on the same branch.
+
+   Unlike the precomputed 'delta' column (which only compares each build
+   against the one immediately before it), this can compare any two builds,
+   for example a week apart or two release versions. Since the results of
+   a finished build never change, comparisons are cached.
+"""
+
+import collections
+from imp_build_utils import BuildDatabase, OK_STATES
+from cache import get_cache
+
+# Benchmarks whose runtime changed by less than this fraction are not reported
+BENCHMARK_THRESHOLD = 0.1
+
+_TestChange = collections.namedtuple(
+    '_TestChange', ['kind', 'unit_name', 'unit_id', 'arch', 'arch_name',
+                    'name', 'test_name', 'old_state', 'new_state'])
+
+_UnitChange = collections.namedtuple(
+    '_UnitChange', ['unit_name', 'unit_id', 'arch_name', 'arch_id',
+                    'old_state', 'new_state'])
+
+_BenchmarkChange = collections.namedtuple(
+    '_BenchmarkChange', ['unit_name', 'bench_name', 'algorithm', 'file_id',
+                         'platform', 'arch_name', 'old_runtime',
+                         'new_runtime', 'ratio'])
+
+
+def diff_test_dicts(old, new):
+    """Compare two dicts of test states, as returned by
+       BuildDatabase.get_test_dict(), and return a dict of
+       (test, platform) -> (kind, old state, new state) for every test that
+       changed. Kind is one of NEWFAIL, NEWOK, CHANGED, ADDED or REMOVED."""
+    changes = {}
+    for key, new_state in new.items():
+        old_state = old.get(key)
+        if old_state is None:
+            changes[key] = ('ADDED', None, new_state)
+        elif old_state != new_state:
+            old_ok = old_state in OK_STATES
+            new_ok = new_state in OK_STATES
+            if old_ok and not new_ok:
+                kind = 'NEWFAIL'
+            elif new_ok and not old_ok:
+                kind = 'NEWOK'
+            else:
+                kind = 'CHANGED'
+            changes[key] = (kind, old_state, new_state)
+    for key in set(old.keys()) - set(new.keys()):
+        changes[key] = ('REMOVED', old[key], None)
+    return changes
+
+
+def diff_benchmarks(old, new, threshold=BENCHMARK_THRESHOLD):
+    """Compare two dicts of benchmark results, as returned by
+       BuildDatabase.get_benchmark_results(), and return a list of
+       changes in runtime larger than `threshold`, biggest slowdown first."""
+    changes = []
+    for key, row in new.items():
+        old_row = old.get(key)
+        if old_row is None or not old_row['runtime'] or row['runtime'] is None:
+            continue
+        ratio = row['runtime'] / old_row['runtime']
+        if abs(ratio - 1.0) >= threshold:
+            changes.append(_BenchmarkChange(
+                row['unit_name'], row['bench_name'], row['algorithm'],
+                row['file_id'], key[1], None, old_row['runtime'],
+                row['runtime'], ratio))
+    changes.sort(key=lambda x: (-x.ratio, x.unit_name, x.bench_name))
+    return changes
+
+
+class BuildComparison(object):
+    """Differences between an older build (`since`) and a newer one
+       (`date`) on the same branch."""
+
+    def __init__(self, conn, config, since, date, lab_only, branch):
+        self.since, self.date = since, date
+        old_db = BuildDatabase(conn, config, since, lab_only, branch)
+        new_db = BuildDatabase(conn, config, date, lab_only, branch)
+        arch_names = new_db.get_arch_names()
+        self.tests = self._get_test_changes(old_db, new_db, arch_names)
+        self.units = self._get_unit_changes(old_db, new_db)
+        self.benchmarks = [
+            b._replace(arch_name=arch_names.get(b.platform))
+            for b in diff_benchmarks(old_db.get_benchmark_results(),
+                                     new_db.get_benchmark_results())]
+        self.git_log = new_db.get_git_log_since(since)
+        # Builds still in progress can change, so must not be cached
+        self.finished = (new_db.is_build_finished(since)
+                         and new_db.is_build_finished(date))
+
+    def get_counts(self):
+        """Get the number of changed tests of each kind"""
+        counts = dict.fromkeys(('NEWFAIL', 'NEWOK', 'CHANGED', 'ADDED',
+                                'REMOVED'), 0)
+        for t in self.tests:
+            counts[t.kind] += 1
+        return counts
+
+    def _get_test_changes(self, old_db, new_db, arch_names):
+        changes = diff_test_dicts(old_db.get_test_dict(),
+                                  new_db.get_test_dict())
+        # Only the changed tests need names; this also drops any tests in
+        # components we are not allowed to see
+        names = new_db.get_test_names(sorted(set(k[0] for k in changes)))
+        tests = []
+        for (name, arch), (kind, old_state, new_state) in changes.items():
+            n = names.get(name)
+            if n is not None:
+                tests.append(_TestChange(kind, n['unit_name'], n['unit_id'],
+                                         arch, arch_names.get(arch), name,
+                                         n['test_name'], old_state,
+                                         new_state))
+        tests.sort(key=lambda x: (x.unit_name, x.test_name, x.arch_name))
+        return tests
+
+    def _get_unit_changes(self, old_db, new_db):
+        old = old_db.get_unit_summary()
+        new = new_db.get_unit_summary()
+        changes = []
+        # Include components and platforms that are no longer built
+        units = new.all_units + [u for u in old.all_units
+                                 if u not in new.unit_ids]
+        archs = new.all_archs + [a for a in old.all_archs
+                                 if a not in new.arch_ids]
+        for unit in units:
+            for arch in archs:
+                new_state = new.data.get(unit, {}).get(arch, {}).get('state')
+                old_state = old.data.get(unit, {}).get(arch, {}).get('state')
+                if new_state != old_state:
+                    changes.append(_UnitChange(
+                        unit, new.unit_ids.get(unit, old.unit_ids.get(unit)),
+                        arch, new.arch_ids.get(arch, old.arch_ids.get(arch)),
+                        old_state, new_state))
+        return changes
+
+
+def get_build_comparison(conn, config, since, date, lab_only, branch):
+    """Get the comparison between two builds, using a cached copy if
+       available. Comparisons are only cached once both builds have
+       finished."""
+    cache = get_cache(config, 'data').namespace(branch, lab_only)
+    key = ('compare', since, date)
+    comp = cache.get(key)
+    if comp is None:
+        comp = BuildComparison(conn, config, since, date, lab_only, branch)
+        if comp.finished:
+            cache.set(key, comp)
+    return comp
@@ -0,0 +1,186 @@
+"""Deduplicated storage of test output.
+
+   The same output (often a long traceback) is usually stored every night
+   for every platform on which a test keeps failing. Instead, each distinct
+   output can be stored once, compressed, in the imp_test_detail table,
+   keyed by the SHA1 hash of its text; imp_test.detail then holds just a
+   fixed-size reference ('sha1:' followed by the hash). Output not yet
+   moved to the table is stored in imp_test.detail as before, so both
+   forms can be mixed, and BuildDatabase reads either transparently.
+
+   Existing output is moved with the 'migrate' command, which should also
+   be run after each nightly build, e.g.
+   python details.py migrate /path/to/imp-results.cfg develop master
+   Recently used outputs are kept in memory, so are only fetched and
+   decompressed once.
+"""
+
+import hashlib
+import zlib
+import MySQLdb
+from cache import LRUCache
+
+# Prefix of references to output in the imp_test_detail table
+REFERENCE_PREFIX = 'sha1:'
+
+# Maximum number of outputs to keep in memory
+MAX_CACHED_DETAILS = 1000
+
+_details = LRUCache(MAX_CACHED_DETAILS)
+
+
+def _encode(text):
+    return text.encode('utf-8') if isinstance(text, unicode) else text
+
+
+def get_reference(text):
+    """Get the reference used to store the given output"""
+    return REFERENCE_PREFIX + hashlib.sha1(_encode(text)).hexdigest()
+
+
+def is_reference(detail):
+    return detail is not None and detail.startswith(REFERENCE_PREFIX)
+
+
+def _fetch(conn, hashes):
+    """Get a dict of the output for each of the given hashes, fetching
+       only those not already in memory"""
+    # imp_build_utils imports this module, so import from it here
+    from imp_build_utils import MAX_IN_BATCH
+    found = {}
+    for h in set(hashes):
+        text = _details.get(h)
+        if text is not None:
+            found[h] = text
+    missing = sorted(set(hashes) - set(found))
+    c = conn.cursor()
+    for i in range(0, len(missing), MAX_IN_BATCH):
+        batch = missing[i:i + MAX_IN_BATCH]
+        c.execute('SELECT hash, body FROM imp_test_detail WHERE hash IN ('
+                  + ','.join(['%s'] * len(batch)) + ')', tuple(batch))
+        for h, body in c:
+            # Return bytes (UTF-8 encoded), just as MySQLdb does for output
+            # that is not yet deduplicated
+            found[h] = zlib.decompress(body)
+            _details.set(h, found[h])
+    return found
+
+
+def resolve(conn, details):
+    """Given a dict of test outputs, some of which may be references,
+       return a dict with the same keys, containing only the text of
+       each output"""
+    hashes = [d[len(REFERENCE_PREFIX):] for d in details.values()
+              if is_reference(d)]
+    if not hashes:
+        return details
+    found = _fetch(conn, hashes)
+    return dict((k, found.get(d[len(REFERENCE_PREFIX):], '')
+                 if is_reference(d) else d) for k, d in details.items())
+
+
+def get_text(conn, detail):
+    """Get the text of a single test output, which may be a reference"""
+    return resolve(conn, {0: detail})[0]
+
+
+class ResolvedRows(object):
+    """Rows from a cursor (which can be iterated over, or read with
+       fetchone or fetchall like the cursor) with any references in the
+       given column replaced with the output text"""
+
+    def __init__(self, conn, cursor, column='detail'):
+        self._rows = [dict(row) for row in cursor]
+        details = resolve(conn, dict((n, row[column])
+                                     for n, row in enumerate(self._rows)))
+        for n, row in enumerate(self._rows):
+            row[column] = details[n]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+def create_table(conn):
+    c = conn.cursor()
+    c.execute('CREATE TABLE IF NOT EXISTS imp_test_detail '
+              '(hash CHAR(40) NOT NULL PRIMARY KEY, body MEDIUMBLOB NOT NULL)')
+
+
+def migrate(conn, table, batch_size=1000):
+    """Move the output of every test in the given table (e.g. imp_test or
+       a branch table) into the imp_test_detail table, replacing it with a
+       reference. Return the number of tests moved."""
+    from imp_build_utils import MAX_IN_BATCH
+    c = conn.cursor()
+    moved = 0
+    after = None
+    while True:
+        # Continue from the last row seen (ordered by date, name and arch),
+        # rather than rescanning rows already moved
+        query = "SELECT name, arch, date, detail FROM " + table \
+                + " WHERE detail<>'' AND detail NOT LIKE '" \
+                + REFERENCE_PREFIX + "%%'"
+        args = ()
+        if after is not None:
+            query += ' AND (date>%s OR (date=%s AND (name>%s OR ' \
+                     '(name=%s AND arch>%s))))'
+            date, name, arch = after
+            args = (date, date, name, name, arch)
+        c.execute(query + ' ORDER BY date, name, arch LIMIT %d' % batch_size,
+                  args)
+        rows = c.fetchall()
+        if not rows:
+            return moved
+        after = (rows[-1][2], rows[-1][0], rows[-1][1])
+        bodies = dict((get_reference(row[3])[len(REFERENCE_PREFIX):],
+                       row[3]) for row in rows)
+        hashes = sorted(bodies.keys())
+        for i in range(0, len(hashes), MAX_IN_BATCH):
+            batch = hashes[i:i + MAX_IN_BATCH]
+            c.execute('SELECT hash FROM imp_test_detail WHERE hash IN ('
+                      + ','.join(['%s'] * len(batch)) + ')', tuple(batch))
+            for row in c.fetchall():
+                del bodies[row[0]]
+        for h, text in bodies.items():
+            c.execute('INSERT INTO imp_test_detail (hash, body) '
+                      'VALUES (%s, %s)',
+                      (h, MySQLdb.Binary(zlib.compress(_encode(text), 9))))
+        for name, arch, date, detail in rows:
+            c.execute('UPDATE ' + table + ' SET detail=%s WHERE name=%s '
+                      'AND arch=%s AND date=%s',
+                      (get_reference(detail), name, arch, date))
+        conn.commit()
+        moved += len(rows)
+
+
+def main():
+    import argparse
+    import os
+    import flask
+    from imp_build_utils import BuildDatabase
+    parser = argparse.ArgumentParser(
+        description="Move test output into deduplicated storage")
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('config', help="Application configuration file")
+    parser.add_argument('branches', nargs='+')
+    args = parser.parse_args()
+    config = flask.Config(os.path.dirname(os.path.abspath(args.config)))
+    config.from_pyfile(os.path.abspath(args.config))
+    conn = MySQLdb.connect(host=config['HOST'], user=config['USER'],
+                           passwd=config['PASSWORD'], db=config['DATABASE'])
+    create_table(conn)
+    for branch in args.branches:
+        db = BuildDatabase(conn, config, None, True, branch)
+        n = migrate(conn, db.get_branch_table('imp_test'))
+        print("%s: %d test outputs moved" % (branch, n))
+
+
+if __name__ == '__main__':
+    main()
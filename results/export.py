@@ -0,0 +1,259 @@
+"""Bulk export of raw test and benchmark results.
+
+   Rows of imp_test or imp_benchmark for a branch and range of dates
+   (optionally only for one component and/or platform) are written as CSV
+   or newline-delimited JSON, optionally gzip-compressed as they are
+   generated. Rows are read with an unbuffered server-side cursor from a
+   query on the results table alone (components are selected with a
+   subquery on the small name tables); component, platform and test names
+   are filled in from a cached lookup of the name tables rather than by
+   joins. Memory use therefore does not depend on the size of the
+   export.
+
+   Exports are available from the web application (e.g.
+   /export/tests.csv?since=20191101&until=20191130) or from the command
+   line, e.g.
+   python export.py /path/to/imp-results.cfg tests develop 20191101 20191130
+"""
+
+import csv
+import datetime
+import json
+import zlib
+import MySQLdb
+from StringIO import StringIO
+from cache import get_cache
+
+# Time (in seconds) to keep the lookup of names; new tests are added to
+# the database every night, so the lookup is also reloaded if any table
+# has gained rows
+NAMES_TTL = 60 * 60
+
+# Number of rows to format at once
+CHUNK_ROWS = 1000
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# Queries for the ids of the tests and benchmarks in each component, to
+# select the components to export
+_TEST_IDS = ('SELECT imp_test_names.id FROM imp_test_names, imp_test_units '
+             'WHERE imp_test_names.unit=imp_test_units.id')
+_BENCHMARK_IDS = ('SELECT imp_benchmark_names.id FROM imp_benchmark_names, '
+                  'imp_benchmark_files, imp_test_units '
+                  'WHERE imp_benchmark_names.file=imp_benchmark_files.id '
+                  'AND imp_benchmark_files.unit=imp_test_units.id')
+
+# Columns of each kind of export
+TEST_COLUMNS = ('date', 'test', 'component', 'platform', 'state', 'runtime',
+                'delta')
+BENCHMARK_COLUMNS = ('date', 'benchmark', 'algorithm', 'file', 'component',
+                     'platform', 'runtime', 'checkval')
+
+
+class Names(object):
+    """Lookup of component, platform, test and benchmark names by id"""
+
+    def __init__(self, conn):
+        self.max_ids = _get_max_ids(conn)
+        c = conn.cursor()
+
+        def get(query):
+            c.execute(query)
+            return dict((row[0], row[1:]) for row in c)
+        self.units = get('SELECT id, name, lab_only FROM imp_test_units')
+        self.archs = get('SELECT id, name FROM imp_test_archs')
+        self.tests = get('SELECT id, name, unit FROM imp_test_names')
+        self.benchmark_files = get('SELECT id, name, unit '
+                                   'FROM imp_benchmark_files')
+        self.benchmarks = get('SELECT id, name, algorithm, file '
+                              'FROM imp_benchmark_names')
+
+
+def _get_max_ids(conn):
+    """Get the largest id in each of the name tables"""
+    c = conn.cursor()
+    c.execute('SELECT (SELECT MAX(id) FROM imp_test_units), '
+              '(SELECT MAX(id) FROM imp_test_archs), '
+              '(SELECT MAX(id) FROM imp_test_names), '
+              '(SELECT MAX(id) FROM imp_benchmark_files), '
+              '(SELECT MAX(id) FROM imp_benchmark_names)')
+    return tuple(c.fetchone())
+
+
+def get_names(conn, config):
+    """Get the (cached) lookup of names, reloading it if names have been
+       added since it was made"""
+    cache = get_cache(config, 'data')
+    names = cache.get(('export_names',))
+    if names is None or names.max_ids != _get_max_ids(conn):
+        names = Names(conn)
+        cache.set(('export_names',), names, ttl=NAMES_TTL)
+    return names
+
+
+class _Exporter(object):
+    def __init__(self, db, since, until, unit, arch):
+        self.db = db
+        self.since, self.until = since, until
+        self.unit, self.arch = unit, arch
+        # Get the names now; no other queries can be run on the connection
+        # while rows are read from the unbuffered cursor
+        self.names = get_names(db.conn, db.config)
+
+    def _lookup(self, table, key):
+        """Look up a name, or return None for an unknown id (only possible
+           if a name was added after the export started)"""
+        return getattr(self.names, table).get(key)
+
+    def _get_unit(self, unit_id):
+        unit = self._lookup('units', unit_id)
+        return unit[0] if unit else None
+
+    def _get_arch(self, arch_id):
+        arch = self._lookup('archs', arch_id)
+        return arch[0] if arch else None
+
+    def _query(self, table, columns, arch_column, ids_query):
+        """Query rows of the given results table, where `ids_query` gets
+           the ids of its tests or benchmarks in each component"""
+        query = 'SELECT ' + columns + ' FROM ' \
+                + self.db.get_branch_table(table) \
+                + ' WHERE date>=%s AND date<=%s'
+        args = [self.since, self.until]
+        if self.arch is not None:
+            query += ' AND ' + arch_column + '=%s'
+            args.append(self.arch)
+        # Select components in the query, rather than skipping rows here
+        if self.unit is not None or not self.db.lab_only:
+            query += ' AND name IN (' + ids_query + self.db.get_sql_lab_only()
+            if self.unit is not None:
+                query += ' AND imp_test_units.id=%s'
+                args.append(self.unit)
+            query += ')'
+        # Don't buffer the result set in memory
+        c = MySQLdb.cursors.SSCursor(self.db.conn)
+        c.execute(query + ' ORDER BY date', tuple(args))
+        return c
+
+    def get_tests(self):
+        for date, name, arch, state, runtime, delta in self._query(
+                'imp_test', 'date, name, arch, state, runtime, delta',
+                'arch', _TEST_IDS):
+            test = self._lookup('tests', name)
+            unit = test and self._get_unit(test[1])
+            if unit is not None:
+                yield (date, test[0], unit, self._get_arch(arch), state,
+                       runtime, delta)
+
+    def get_benchmarks(self):
+        for date, name, platform, runtime, checkval in self._query(
+                'imp_benchmark', 'date, name, platform, runtime, checkval',
+                'platform', _BENCHMARK_IDS):
+            bench = self._lookup('benchmarks', name)
+            bfile = bench and self._lookup('benchmark_files', bench[2])
+            unit = bfile and self._get_unit(bfile[1])
+            if unit is not None:
+                yield (date, bench[0], bench[1], bfile[0], unit,
+                       self._get_arch(platform), runtime, checkval)
+
+
+def get_rows(db, kind, since, until, unit=None, arch=None):
+    """Get the rows of the given kind ('tests' or 'benchmarks') of export
+       from the branch of the given BuildDatabase (including lab-only
+       components only if it does), as tuples, and the names of their
+       columns"""
+    e = _Exporter(db, since, until, unit, arch)
+    if kind == 'tests':
+        return TEST_COLUMNS, e.get_tests()
+    elif kind == 'benchmarks':
+        return BENCHMARK_COLUMNS, e.get_benchmarks()
+    else:
+        raise ValueError("Unknown kind of export %s" % kind)
+
+
+def _format_value(value):
+    if isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def format_rows(columns, rows, fmt):
+    """Yield chunks of the given rows, in 'csv' or 'ndjson' format"""
+    def chunks():
+        chunk = []
+        for row in rows:
+            chunk.append([_format_value(v) for v in row])
+            if len(chunk) >= CHUNK_ROWS:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    if fmt == 'csv':
+        out = StringIO()
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for chunk in chunks():
+            writer.writerows(chunk)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        if out.getvalue():
+            yield out.getvalue()
+    elif fmt == 'ndjson':
+        for chunk in chunks():
+            yield ''.join(json.dumps(dict(zip(columns, row))) + '\n'
+                          for row in chunk)
+    else:
+        raise ValueError("Unknown export format %s" % fmt)
+
+
+def gzip_chunks(chunks):
+    """Compress a sequence of strings in gzip format as they are made"""
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = z.compress(chunk)
+        if data:
+            yield data
+    yield z.flush()
+
+
+def main():
+    import argparse
+    import os
+    import sys
+    import flask
+    from imp_build_utils import BuildDatabase
+    parser = argparse.ArgumentParser(
+        description="Export raw test or benchmark results")
+    parser.add_argument('config', help="Application configuration file")
+    parser.add_argument('kind', choices=['tests', 'benchmarks'])
+    parser.add_argument('branch')
+    parser.add_argument('since', help="First date to export (YYYYMMDD)")
+    parser.add_argument('until', help="Last date to export (YYYYMMDD)")
+    parser.add_argument('--format', choices=sorted(FORMATS.keys()),
+                        default='csv')
+    parser.add_argument('--unit', type=int, help="Only export this component")
+    parser.add_argument('--arch', type=int, help="Only export this platform")
+    parser.add_argument('--public', action='store_true',
+                        help="Omit lab-only components")
+    parser.add_argument('--gzip', action='store_true',
+                        help="Compress the output")
+    args = parser.parse_args()
+    config = flask.Config(os.path.dirname(os.path.abspath(args.config)))
+    config.from_pyfile(os.path.abspath(args.config))
+    conn = MySQLdb.connect(host=config['HOST'], user=config['USER'],
+                           passwd=config['PASSWORD'], db=config['DATABASE'])
+    since, until = [datetime.datetime.strptime(d, '%Y%m%d').date()
+                    for d in (args.since, args.until)]
+    db = BuildDatabase(conn, config, None, not args.public, args.branch)
+    columns, rows = get_rows(db, args.kind, since, until, args.unit,
+                             args.arch)
+    chunks = format_rows(columns, rows, args.format)
+    if args.gzip:
+        chunks = gzip_chunks(chunks)
+    for chunk in chunks:
+        sys.stdout.write(chunk)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Serving of previously-rendered pages when the database is slow or down.
+
+   The last successfully rendered version of each page is kept, in the
+   'pages' cache (see cache.py). If the
+   database connection fails or a query times out, that copy is served,
+   with a notice, rather than an error. If the STALE_AFTER configuration
+   option is set, a copy up to that many seconds old is served as is;
+   an older copy is also served immediately (with a notice) while the
+   page is refreshed in the background, so visitors never wait for a
+   slow database.
+   Copies older than MAX_STALENESS seconds (default one day) are never
+   served.
+"""
+
+import collections
+import threading
+import time
+import MySQLdb
+from flask import copy_current_request_context, Response
+from cache import get_cache
+
+# Default maximum age (in seconds) of a page that will be served
+MAX_STALENESS = 24 * 60 * 60
+
+_Page = collections.namedtuple('_Page', ['time', 'data', 'status',
+                                         'headers'])
+
+_refreshing = set()
+_lock = threading.Lock()
+
+
+def _render(pages, key, func, max_staleness, keep):
+    """Render a page, and keep it if successful (and keep() is True)"""
+    rv = func()
+    page = _Page(time.time(), rv.get_data(), rv.status_code,
+                 rv.headers.to_wsgi_list())
+    if page.status == 200 and keep():
+        pages.set(key, page, ttl=max_staleness)
+    return rv
+
+
+def _refresh_in_background(pages, refresh_key, key, func, max_staleness,
+                           keep):
+    """Render a page in a new thread, unless the same page (identified
+       by `refresh_key`) is already being rendered"""
+    with _lock:
+        if refresh_key in _refreshing:
+            return
+        _refreshing.add(refresh_key)
+
+    @copy_current_request_context
+    def refresh():
+        try:
+            _render(pages, key, func, max_staleness, keep).close()
+        except MySQLdb.Error:
+            pass
+        finally:
+            with _lock:
+                _refreshing.discard(refresh_key)
+    t = threading.Thread(target=refresh)
+    t.daemon = True
+    t.start()
+
+
+def _stale_response(page, reason):
+    """Make a response from a kept page, with a notice saying why it is
+       being shown and how old it is"""
+    age = int(time.time() - page.time)
+    notice = '%s These results were last updated %s ago.' \
+             % (reason, _format_age(age))
+    data = page.data
+    headers = [(k, v) for k, v in page.headers if k != 'Content-Length']
+    headers.append(('Warning', '110 - "Response is Stale"'))
+    if any(k == 'Content-Type' and v.startswith('text/html')
+           for k, v in headers):
+        data = data.replace('<body>', '<body>\n<div class="stale">%s</div>'
+                            % notice, 1)
+    return Response(data, page.status, headers)
+
+
+def _format_age(age):
+    if age < 120:
+        return '%d seconds' % age
+    elif age < 7200:
+        return '%d minutes' % (age // 60)
+    else:
+        return '%d hours' % (age // 3600)
+
+
+def serve(config, branch, lab_only, key, func, keep=lambda: True):
+    """Return the response from func(), which should be a Flask Response
+       for the page identified by `key` on the given branch, or a kept copy
+       of the page if the database is unavailable or (if STALE_AFTER is
+       set) a copy is available. Rendered pages are only kept if keep(),
+       called after rendering, returns True."""
+    pages = get_cache(config, 'pages').namespace(branch, lab_only)
+    max_staleness = config.get('MAX_STALENESS', MAX_STALENESS)
+    page = pages.get(key)
+    now = time.time()
+    if page is not None and now - page.time > max_staleness:
+        page = None
+    stale_after = config.get('STALE_AFTER')
+    if page is not None and stale_after is not None:
+        if now - page.time <= stale_after:
+            return Response(page.data, page.status, page.headers)
+        _refresh_in_background(pages, (branch, lab_only, key), key, func,
+                               max_staleness, keep)
+        return _stale_response(page, 'This page is being updated.')
+    try:
+        return _render(pages, key, func, max_staleness, keep)
+    except MySQLdb.Error:
+        if page is None:
+            raise
+        return _stale_response(
+            page, 'The results database is currently unavailable.')
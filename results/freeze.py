@@ -0,0 +1,227 @@
+"""Static export ("freeze") of the pages for finished builds.
+
+   Once a build has finished, every page about it is a pure function of
+   the database, so it can be rendered once, through the Flask app, and
+   written to disk for Apache to serve directly. Pages are written (both
+   plain and gzip-compressed) under <FREEZE_DIR>/<public|lab>/<branch>/
+   <YYYYMMDD>/, e.g. component/3.html and component/3.html.gz for
+   /component/3?date=YYYYMMDD&branch=<branch>.
+
+   Lists of tests are frozen whole (rather than paginated, as served
+   dynamically) and sorted in the browser. Pages are rendered into a
+   temporary directory, which then replaces any existing copy of the
+   build, so a complete set of pages is always served.
+
+   Rendering is spread over a pool of processes. Each frozen build records
+   a fingerprint of its data, so rerunning the command only renders builds
+   that are new or have changed, e.g.
+   python -m results.freeze develop
+"""
+
+import errno
+import gzip
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+from imp_build_utils import BuildDatabase, platforms_dict
+from index import FREEZE_ENVIRON
+
+# Name of the file in each frozen build directory holding its fingerprint
+STAMP_FILE = 'stamp'
+
+
+def get_build_dir(config, branch, date, lab_only):
+    """Get the directory containing the frozen pages for a build"""
+    return os.path.join(config['FREEZE_DIR'], 'lab' if lab_only else 'public',
+                        branch.replace('/', '_'), date.strftime('%Y%m%d'))
+
+
+def get_build_fingerprint(db):
+    """Get a string that changes whenever the results of a build change"""
+    c = db.conn.cursor()
+    h = hashlib.sha1()
+    for table, query in (
+            ('imp_test_reporev', 'SELECT rev,version FROM %s WHERE date=%%s'),
+            ('imp_build_summary', 'SELECT lab_only,state FROM %s '
+                                  'WHERE date=%%s ORDER BY lab_only'),
+            ('imp_test', 'SELECT name,arch,state,runtime,delta,detail '
+                         'FROM %s WHERE date=%%s ORDER BY name,arch'),
+            ('imp_test_unit_result', 'SELECT unit,arch,state,logline FROM %s '
+                                     'WHERE date=%%s ORDER BY unit,arch'),
+            ('imp_benchmark', 'SELECT name,platform,runtime,checkval FROM %s '
+                              'WHERE date=%%s ORDER BY name,platform')):
+        c.execute(query % db.get_branch_table(table), (db.date,))
+        # Hash row by row, so that the whole build is not held in memory
+        for row in c:
+            h.update(repr(tuple(row)))
+        h.update('\0')
+    return h.hexdigest()
+
+
+def get_build_pages(db):
+    """Get the (filename, URL) of every page to freeze for a build"""
+    args = '?date=%s&branch=%s' % (db.date.strftime('%Y%m%d'), db.branch)
+    pages = [('failures.html', '/failures' + args),
+             ('long.html', '/long' + args)]
+    unit_result = db.get_branch_table('imp_test_unit_result')
+    test = db.get_branch_table('imp_test')
+    c = db.conn.cursor()
+    c.execute('SELECT DISTINCT imp_test_units.id FROM ' + unit_result
+              + ' imp_test_unit_result, imp_test_units '
+              'WHERE imp_test_unit_result.date=%s AND '
+              'imp_test_unit_result.unit=imp_test_units.id'
+              + db.get_sql_lab_only() + ' ORDER BY imp_test_units.id',
+              (db.date,))
+    pages.extend(('component/%d.html' % row[0],
+                  '/component/%d%s' % (row[0], args)) for row in c)
+    c.execute('SELECT DISTINCT imp_test_archs.id, imp_test_archs.name FROM '
+              + unit_result + ' imp_test_unit_result, imp_test_archs '
+              'WHERE imp_test_unit_result.date=%s AND '
+              'imp_test_unit_result.arch=imp_test_archs.id '
+              'ORDER BY imp_test_archs.id', (db.date,))
+    pages.extend(('platform/%d.html' % row[0],
+                  '/platform/%d%s' % (row[0], args))
+                 for row in c if row[1] in platforms_dict)
+    c.execute('SELECT imp_test.name, imp_test.arch FROM ' + test
+              + ' imp_test, imp_test_names, imp_test_units '
+              "WHERE imp_test.date=%s AND imp_test.detail<>'' AND "
+              'imp_test.name=imp_test_names.id AND '
+              'imp_test_names.unit=imp_test_units.id' + db.get_sql_lab_only()
+              + ' ORDER BY imp_test.name, imp_test.arch', (db.date,))
+    pages.extend(('detail/%d/%d.txt' % row, '/detail/%d/%d%s' % (row + (args,)))
+                 for row in c)
+    return pages
+
+
+def _write_file(fname, data):
+    """Write a file (and a gzip-compressed copy) atomically"""
+    dirname = os.path.dirname(fname)
+    try:
+        os.makedirs(dirname)
+    except OSError as err:
+        # Another worker may have made the directory
+        if err.errno != errno.EEXIST:
+            raise
+    with open(fname + '.tmp', 'wb') as fh:
+        fh.write(data)
+    os.rename(fname + '.tmp', fname)
+    # Use a fixed timestamp so that unchanged pages compress identically
+    with open(fname + '.gz.tmp', 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                           mtime=0) as fh:
+            fh.write(data)
+    os.rename(fname + '.gz.tmp', fname + '.gz')
+
+
+def _render_page(job):
+    """Render a single page through the Flask app and write it to disk.
+       This runs in a worker process."""
+    import results
+    fname, url, lab_only = job
+    # TestPage checks the environment to see if lab-only pages are allowed
+    if lab_only:
+        os.environ['HTTPS'] = 'on'
+        os.environ['REMOTE_USER'] = 'freeze'
+    else:
+        os.environ.pop('HTTPS', None)
+        os.environ.pop('REMOTE_USER', None)
+    rv = results.app.test_client().get(url,
+                                       environ_base={FREEZE_ENVIRON: True})
+    if rv.status_code == 200:
+        _write_file(fname, rv.get_data())
+    return url, rv.status_code
+
+
+def freeze_build(db, pool):
+    """Render every page for the given build, unless it is already frozen
+       and has not changed. Return True if pages were rendered."""
+    build_dir = get_build_dir(db.config, db.branch, db.date, db.lab_only)
+    stamp = os.path.join(build_dir, STAMP_FILE)
+    fingerprint = get_build_fingerprint(db)
+    if os.path.exists(stamp):
+        with open(stamp) as fh:
+            if fh.read().strip() == fingerprint:
+                return False
+    parent = os.path.dirname(build_dir)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    # Render into a new directory, so that any older version of the build
+    # can still be served until the new one is complete
+    tmpdir = tempfile.mkdtemp(dir=parent,
+                              prefix=os.path.basename(build_dir) + '.')
+    try:
+        jobs = [(os.path.join(tmpdir, fname), url, db.lab_only)
+                for fname, url in get_build_pages(db)]
+        failed = [(url, status) for url, status
+                  in pool.imap(_render_page, jobs) if status != 200]
+        if failed:
+            raise ValueError("Could not render %s (HTTP status %d)"
+                             % failed[0])
+        with open(os.path.join(tmpdir, STAMP_FILE), 'w') as fh:
+            fh.write(fingerprint + '\n')
+        os.chmod(tmpdir, 0o755)
+        if os.path.exists(build_dir):
+            old_dir = tmpdir + '.old'
+            os.rename(build_dir, old_dir)
+            os.rename(tmpdir, build_dir)
+            shutil.rmtree(old_dir)
+        else:
+            os.rename(tmpdir, build_dir)
+    except:  # noqa: E722
+        if os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+        raise
+    return True
+
+
+def freeze(conn, config, branch, dates, processes=None):
+    """Freeze every page for the builds on the given dates, on the given
+       branch, both public and (for the develop branch) lab-only. Return
+       the number of builds rendered."""
+    pool = multiprocessing.Pool(processes)
+    try:
+        rendered = 0
+        for date in dates:
+            for lab_only in (False, True) if branch == 'develop' else (False,):
+                db = BuildDatabase(conn, config, date, lab_only, branch)
+                if freeze_build(db, pool):
+                    rendered += 1
+        return rendered
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    import argparse
+    import datetime
+    import results
+    from build_calendar import get_build_calendar
+    parser = argparse.ArgumentParser(
+        description="Render pages for finished builds as static files")
+    parser.add_argument('branch')
+    parser.add_argument('dates', nargs='*',
+                        help="Build dates (YYYYMMDD); by default, "
+                             "every build on the branch")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="Number of processes to use")
+    args = parser.parse_args()
+    config = results.app.config
+    conn = results._connect_db()
+    if args.dates:
+        dates = [datetime.datetime.strptime(d, '%Y%m%d').date()
+                 for d in args.dates]
+    else:
+        db = BuildDatabase(conn, config, None, False, args.branch)
+        dates = get_build_calendar(
+            conn, db.get_branch_table('imp_test_reporev'),
+            os.path.join(config['TOPDIR'], args.branch),
+            with_versions=args.branch == 'master').dates
+    n = freeze(conn, config, args.branch, dates, args.processes)
+    print("%d builds rendered" % n)
+
+
+if __name__ == '__main__':
+    main()
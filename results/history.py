@@ -0,0 +1,184 @@
+"""In-memory index of the pass/fail history of each test on each platform.
+
+   Rather than scanning the entire imp_test history to find when a test last
+   passed or failed, we keep, for each (test, platform) pair, the list of
+   runs of consecutive failures. Since failures are rare compared to passes,
+   this is compact, and it is enough to answer the two questions the test
+   page asks: "when did this (passing) test last fail?" and "when did this
+   (failing) test last pass?". The index is built once per process and then
+   extended incrementally as new builds appear in the database. While it is
+   being built, the test page queries the database directly rather than
+   waiting for it.
+"""
+
+import bisect
+import threading
+import MySQLdb
+from imp_build_utils import OK_STATES
+
+
+class _FailRun(object):
+    """A maximal run of consecutive failures of a test on a platform"""
+    __slots__ = ('first', 'last', 'pass_before')
+
+    def __init__(self, first, last, pass_before):
+        self.first = first
+        self.last = last
+        # Date of the last successful run before this run started, or None
+        self.pass_before = pass_before
+
+
+class FailureHistory(object):
+    """Index of test failure runs for one branch's imp_test table."""
+
+    def __init__(self):
+        #: Date of the newest build included in the index
+        self.last_date = None
+        # All builds before this date are included in the index
+        self._upto = None
+        self._last_seen = {}
+        self._runs = {}
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def add_rows(self, rows):
+        """Add (name, arch, state, date) rows to the index. Rows must be
+           sorted by date, and be newer than any already in the index."""
+        for name, arch, state, date in rows:
+            key = (name, arch)
+            ok = state in OK_STATES
+            prev = self._last_seen.get(key)
+            if not ok:
+                if prev is not None and not prev[1]:
+                    # Continue the current run of failures
+                    self._runs[key][-1].last = date
+                else:
+                    run = _FailRun(date, date,
+                                   prev[0] if prev is not None else None)
+                    self._runs.setdefault(key, []).append(run)
+                    self._starts.setdefault(key, []).append(date)
+            self._last_seen[key] = (date, ok)
+            if self.last_date is None or date > self.last_date:
+                self.last_date = date
+
+    def update(self, conn, table, date, is_build_finished, wait=True):
+        """Make sure the index includes all builds before `date`, reading
+           only builds newer than those already indexed, so that it can
+           answer questions about `date`, which must be no later than the
+           last build (since builds before a later date could still be
+           added, but would never be read). The newest of those builds is
+           only indexed once `is_build_finished` returns True for its date,
+           since rows may still be being added for it. Return True if the
+           index covers `date`. If `wait` is False and another thread is
+           already updating the index (which can take a while the first
+           time), return False rather than waiting for it."""
+        if self._upto is not None and self._upto >= date:
+            return True
+        if not self._lock.acquire(wait):
+            return False
+        try:
+            if self._upto is None or self._upto < date:
+                self._read_builds(conn, table, date, is_build_finished)
+            return self._upto >= date
+        finally:
+            self._lock.release()
+
+    def _read_builds(self, conn, table, date, is_build_finished):
+        c = MySQLdb.cursors.SSCursor(conn)
+        query = 'SELECT name,arch,state,date FROM ' + table + ' WHERE date<%s'
+        args = (date,)
+        if self.last_date is not None:
+            query += ' AND date>%s'
+            args += (self.last_date,)
+        c.execute(query + ' ORDER BY date', args)
+        # Hold back the rows of each build until we know it is not the
+        # newest (every build before the newest has finished or was aborted)
+        build = []
+        for row in c:
+            if build and row[3] != build[0][3]:
+                self.add_rows(build)
+                build = []
+            build.append(row)
+        if build and not is_build_finished(build[0][3]):
+            self._upto = build[0][3]
+        else:
+            self.add_rows(build)
+            self._upto = date
+
+    def get_previous_date(self, name, arch, date, previous_success):
+        """Get the date before `date` on which the given test last passed
+           (if `previous_success` is True) or failed (otherwise), or None
+           if it never did.
+           Only the cases needed by the test page are handled, i.e. finding
+           the last failure of a test that passed on `date`, or the last
+           success of a test that failed on `date`; KeyError is raised
+           for anything else, in which case the caller should query
+           the database directly."""
+        key = (name, arch)
+        if self._upto is not None and date > self._upto:
+            raise KeyError(key)
+        if self.last_date is None or date > self.last_date:
+            # `date` is not in the index, but every build before it is
+            return self._get_next_previous_date(key, date, previous_success)
+        starts = self._starts.get(key, [])
+        runs = self._runs.get(key, [])
+        if previous_success:
+            # Find the failure run that includes `date`
+            i = bisect.bisect_right(starts, date)
+            if i > 0 and runs[i - 1].last >= date:
+                return runs[i - 1].pass_before
+            raise KeyError(key)
+        else:
+            # Find the last failure run that started before `date`
+            i = bisect.bisect_left(starts, date)
+            if i == 0:
+                return None
+            if runs[i - 1].last < date:
+                return runs[i - 1].last
+            raise KeyError(key)
+
+    def _get_next_previous_date(self, key, date, previous_success):
+        """Get the previous date for a test on `date`, which is newer than
+           any build in the index, as add_rows() would if it were added"""
+        last_seen = self._last_seen.get(key)
+        if last_seen is None:
+            return None
+        if last_seen[0] >= date:
+            # The index was updated past `date` in the meantime
+            raise KeyError(key)
+        if previous_success:
+            return last_seen[0] if last_seen[1] \
+                else self._runs[key][-1].pass_before
+        else:
+            runs = self._runs.get(key)
+            return runs[-1].last if runs else None
+
+    def get_failure_start(self, name, arch, date):
+        """Get the date on which the run of failures of the given test
+           that includes `date` started, or None if the test did not fail
+           on `date`. If `date` is newer than any build in the index,
+           the test is assumed to have failed on `date`."""
+        key = (name, arch)
+        if self.last_date is None or date > self.last_date:
+            last_seen = self._last_seen.get(key)
+            if last_seen is not None and not last_seen[1] \
+               and last_seen[0] < date:
+                return self._runs[key][-1].first
+            return None
+        starts = self._starts.get(key, [])
+        i = bisect.bisect_right(starts, date)
+        if i > 0 and self._runs[key][i - 1].last >= date:
+            return starts[i - 1]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_failure_history(table):
+    """Get the (shared) history index for the given imp_test table"""
+    with _indexes_lock:
+        index = _indexes.get(table)
+        if index is None:
+            index = _indexes[table] = FailureHistory()
+        return index
@@ -2,8 +2,11 @@ import glob
 import datetime
 import pickle
 import os
-import MySQLdb
 import collections
+from build_calendar import get_build_calendar, get_summary_calendar
+from snapshot import open_snapshot, dict_cursor, SnapshotConnection
+from cache import get_cache
+from details import resolve, ResolvedRows
 try:
     from email.Utils import formatdate  # python2
     from email.MIMEText import MIMEText
@@ -13,6 +16,9 @@ except ImportError:
 
 
 OK_STATES = ('OK', 'SKIP', 'EXPFAIL', 'SKIP_EXPFAIL')
+
+# Maximum number of values to put in a single SQL IN clause
+MAX_IN_BATCH = 500
 lab_only_results_url = 'https://salilab.org/internal/imp/nightly/results/'
 results_url = 'https://integrativemodeling.org/nightly/results/'
 
@@ -489,12 +495,30 @@ all_platforms = (
 platforms_dict = dict(all_platforms)
 
 
+_Log = collections.namedtuple('_Log', ['githash', 'author_name',
+                                       'author_email', 'title'])
+
+
+def set_query_time_limit(conn, seconds):
+    """Make the database abort any SELECT on the given connection that runs
+       for longer than the given time (MySQL 5.7 or later)"""
+    if not isinstance(conn, SnapshotConnection):
+        c = conn.cursor()
+        c.execute('SET SESSION max_execution_time=%d' % int(seconds * 1000))
+
+
 def date_to_directory(date):
     """Convert a datetime.date object into the convention used to name
        directories on our system (e.g. '20120825')"""
     return date.strftime('%Y%m%d')
 
 
+# States of a component on a platform that are not failures
+UNIT_OK_STATES = ('OK', 'SKIP', 'NOTEST', 'NOLOG', 'CMAKE_OK', 'CMAKE_SKIP',
+                  'CMAKE_FAILDEP', 'CMAKE_NOBUILD', 'CMAKE_NOTEST',
+                  'CMAKE_NOEX', 'CMAKE_NOBENCH')
+
+
 class _UnitSummary(object):
     def __init__(self, cur, test_fails, new_test_fails, build_info):
         self.data = summary = {}
@@ -518,10 +542,7 @@ class _UnitSummary(object):
                                        'numnewfails': ntf}
             if row['state'].startswith('CMAKE_'):
                 self.cmake_archs[row['arch_name']] = None
-            if row['state'] not in ('OK', 'SKIP', 'NOTEST', 'NOLOG',
-                                    'CMAKE_OK', 'CMAKE_SKIP', 'CMAKE_FAILDEP',
-                                    'CMAKE_NOBUILD', 'CMAKE_NOTEST',
-                                    'CMAKE_NOEX', 'CMAKE_NOBENCH'):
+            if row['state'] not in UNIT_OK_STATES:
                 failed_archs[row['arch_name']] = None
                 failed_units[row['unit_name']] = None
         self.all_units = self._sort_units(dict.fromkeys(summary.keys(), True),
@@ -557,9 +578,55 @@ class _UnitSummary(object):
         return sorted_units + list(unsorted_units.keys())
 
 
+# Columns that can be requested from BuildDatabase.query_tests(), as
+# SQL expressions plus the tables needed to get them
+TEST_COLUMNS = {
+    'name': ('imp_test.name', ()),
+    'arch': ('imp_test.arch', ()),
+    'date': ('imp_test.date', ()),
+    'state': ('imp_test.state', ()),
+    'delta': ('imp_test.delta', ()),
+    'runtime': ('imp_test.runtime', ()),
+    'detail': ('imp_test.detail', ()),
+    'has_detail': ("imp_test.detail<>''", ()),
+    'test_name': ('imp_test_names.name', ('imp_test_names',)),
+    'unit_id': ('imp_test_names.unit', ('imp_test_names',)),
+    'unit_name': ('imp_test_units.name',
+                  ('imp_test_names', 'imp_test_units')),
+    'arch_name': ('imp_test_archs.name', ('imp_test_archs',))}
+
+# Tables that can be joined to imp_test, in order, with the join condition
+_TEST_JOINS = (
+    ('imp_test_names', 'imp_test.name=imp_test_names.id'),
+    ('imp_test_units', 'imp_test_names.unit=imp_test_units.id'),
+    ('imp_test_archs', 'imp_test.arch=imp_test_archs.id'))
+
+# Columns needed to show a list of tests (see TestPage.display_tests)
+LIST_TEST_COLUMNS = ('test_name', 'name', 'arch', 'unit_name', 'unit_id',
+                     'arch_name', 'runtime', 'state', 'delta', 'has_detail')
+
+# Default orderings of lists of tests
+COMPONENT_TEST_ORDER = ('-state', 'unit_name', 'name')
+FAILED_TEST_ORDER = ('unit_name', 'name')
+LONG_TEST_ORDER = ('-runtime',)
+
+
+def unique_test_order(order_by):
+    """Add the test and platform ids to an ordering of test results
+       (see BuildDatabase.query_tests), if not already present, so that the
+       ordering is unique."""
+    order_by = list(order_by)
+    cols = [col.lstrip('-') for col in order_by]
+    for col in ('name', 'arch'):
+        if col not in cols:
+            order_by.append(col)
+    return order_by
+
+
 class BuildDatabase(object):
     def __init__(self, conn, config, date, lab_only, branch):
         self.conn = conn
+        self.config = config
         self.date = date
         self.lab_only = lab_only
         self.branch = branch
@@ -567,6 +634,16 @@ class BuildDatabase(object):
         self.public_topdir = os.path.join(config['TOPDIR'], branch)
         self.lab_only_topdir = os.path.join(config['LAB_ONLY_TOPDIR'], branch)
         self.topdir = self.lab_only_topdir if lab_only else self.public_topdir
+        # Connection used for queries about this build only; this is a
+        # snapshot of the build, if available, otherwise the MySQL database
+        self.build_conn = open_snapshot(config, branch, date) or conn
+
+    def get_build_conn(self, date):
+        """Get a connection to use for queries about the build on the
+           given date"""
+        if date == self.date:
+            return self.build_conn
+        return open_snapshot(self.config, self.branch, date) or self.conn
 
     def get_sql_lab_only(self):
         """Get a suitable SQL WHERE fragment to restrict a query to only
@@ -576,6 +653,45 @@ class BuildDatabase(object):
         else:
             return " AND imp_test_units.lab_only=false"
 
+    def _get_shared_rows(self, name, date, query):
+        """Get the rows from a query (which must not restrict to public
+           units, and must return a lab_only column) about the build on the
+           given date, projected to what we are allowed to see.
+
+           If the SHARED_LAB_ONLY_FETCH configuration option is set, the
+           rows for both public and lab-only units are fetched once and
+           cached, so that the public and lab-only sites share the work;
+           lab-only rows are removed here before they can be returned to a
+           public page. Otherwise the query is restricted in SQL, as usual.
+           """
+        if not self.config.get('SHARED_LAB_ONLY_FETCH'):
+            c = dict_cursor(self.get_build_conn(date))
+            c.execute(query + self.get_sql_lab_only(), (date,))
+            return list(c)
+        cache = get_cache(self.config, 'data').namespace(self.branch)
+        rows = cache.get((name, date))
+        if rows is None:
+            c = dict_cursor(self.get_build_conn(date))
+            c.execute(query, (date,))
+            rows = [dict(row) for row in c]
+            # Results can only be added to until the build has finished
+            if self.is_build_finished(date):
+                cache.set((name, date), rows)
+        if self.lab_only:
+            return rows
+        else:
+            return [row for row in rows if not row['lab_only']]
+
+    def is_build_finished(self, date):
+        """Return True if both the public and (for develop) lab-only builds
+           on the given date have finished"""
+        topdirs = [self.public_topdir]
+        if self.branch == 'develop':
+            topdirs.append(self.lab_only_topdir)
+        return all(glob.glob(os.path.join(t, date_to_directory(date) + '-*',
+                                          'build', 'build_info.pck'))
+                   for t in topdirs)
+
     def get_branch_table(self, name):
         if self.branch == 'develop':
             return name
@@ -588,18 +704,17 @@ class BuildDatabase(object):
             # Assume develop branch is built every day
             return self.date - datetime.timedelta(days=1)
         else:
-            # Query database to find last build date
-            c = self.conn.cursor()
-            table = self.get_branch_table('imp_test_reporev')
-            query = 'SELECT date FROM ' + table \
-                    + ' WHERE date<%s ORDER BY date DESC LIMIT 1'
-            c.execute(query, (self.date,))
-            row = c.fetchone()
-            if row:
-                return row[0]
+            return self.get_calendar().get_previous(self.date)
+
+    def get_calendar(self):
+        """Get the calendar of all builds on this branch"""
+        return get_build_calendar(self.conn,
+                                  self.get_branch_table('imp_test_reporev'),
+                                  self.public_topdir,
+                                  with_versions=self.branch == 'master')
 
     def get_unit_summary(self):
-        c = MySQLdb.cursors.DictCursor(self.conn)
+        c = dict_cursor(self.build_conn)
         table = self.get_branch_table('imp_test')
         query = 'SELECT arch,imp_test_names.unit,delta FROM ' + table \
                 + ' imp_test,imp_test_names WHERE date=%s AND state NOT IN ' \
@@ -623,15 +738,26 @@ class BuildDatabase(object):
                 'imp_test_unit_result.logline FROM imp_test_archs, ' \
                 'imp_test_units, ' + table + ' imp_test_unit_result WHERE ' \
                 'imp_test_archs.id=imp_test_unit_result.arch AND ' \
-                'imp_test_units.id=imp_test_unit_result.unit AND date=%s' \
-                + self.get_sql_lab_only()
-        c.execute(query, (self.date,))
-        return _UnitSummary(c, test_fails, new_test_fails,
-                            self.get_build_info())
+                'imp_test_units.id=imp_test_unit_result.unit AND date=%s'
+        return _UnitSummary(self._get_shared_rows('unit_results', self.date,
+                                                  query),
+                            test_fails, new_test_fails, self.get_build_info())
+
+    def get_cached_unit_summary(self):
+        """Like get_unit_summary(), but cached once the build has finished.
+           The returned object is shared, so must not be modified."""
+        cache = get_cache(self.config, 'data').namespace(self.branch,
+                                                         self.lab_only)
+        summary = cache.get(('unit_summary', self.date))
+        if summary is None:
+            summary = self.get_unit_summary()
+            if self.is_build_finished(self.date):
+                cache.set(('unit_summary', self.date), summary)
+        return summary
 
     def get_doc_summary(self):
         """Get a summary of the doc build"""
-        c = MySQLdb.cursors.DictCursor(self.conn)
+        c = dict_cursor(self.build_conn)
         table = self.get_branch_table('imp_doc')
         query = "SELECT * FROM " + table + " WHERE date=%s"
         c.execute(query, (self.date,))
@@ -639,7 +765,7 @@ class BuildDatabase(object):
 
     def get_build_summary(self):
         """Get a one-word summary of the build"""
-        c = self.conn.cursor()
+        c = self.build_conn.cursor()
         state_ind = 0
         # States ordered by severity
         states = ('OK', 'TEST', 'INCOMPLETE', 'BADLOG', 'BUILD')
@@ -656,33 +782,22 @@ class BuildDatabase(object):
     def get_last_build_with_summary(self, states):
         """Get the date of the last build with summary in the given state(s).
            Typically, states would be ('OK',) or ('OK','TEST').
-           If no such build exists, None is returned."""
-        sql = "(" + ",".join(repr(x) for x in states) + ")"
+           If no such build exists, None is returned.
+           If including lab-only stuff, *both* public and lab-only builds must
+           be in the given state."""
         sumtable = self.get_branch_table('imp_build_summary')
-        # If including lab-only stuff, *both* public and lab-only builds must
-        # be in the given state.
-        if self.lab_only:
-            query = "SELECT public.date FROM " + sumtable + " AS public, " \
-                    + sumtable + " AS lab WHERE public.lab_only=false " \
-                    "AND lab.lab_only=true AND public.date=lab.date AND " \
-                    "lab.date<%s AND public.state IN " + sql + \
-                    " AND lab.state IN " + sql
-        else:
-            query = "SELECT date FROM " + sumtable + " WHERE date<%s AND " \
-                    "lab_only=false AND state IN " + sql
-        query += " ORDER BY date DESC LIMIT 1"
-        c = self.conn.cursor()
-        c.execute(query, (self.date,))
-        r = c.fetchone()
-        if r:
-            return r[0]
+        cal = get_summary_calendar(sumtable)
+        cal.update(self.conn, sumtable, self.date,
+                   self.get_calendar().last_build_date)
+        return cal.get_last_build_with_summary(self.date, states,
+                                               self.lab_only)
 
-    def get_git_log(self):
+    def get_git_log(self, date=None):
         """Get the git log, as a list of objects, or None if no log exists."""
-        _Log = collections.namedtuple('_Log', ['githash', 'author_name',
-                                               'author_email', 'title'])
+        if date is None:
+            date = self.date
         g = os.path.join(self.topdir,
-                         date_to_directory(self.date) + '-*', 'build',
+                         date_to_directory(date) + '-*', 'build',
                          'imp-gitlog')
         g = glob.glob(g)
         if len(g) > 0:
@@ -692,6 +807,28 @@ class BuildDatabase(object):
                 data.append(_Log._make(fields))
             return data
 
+    def get_git_log_since(self, since):
+        """Get the combined git log of every build after `since`, up to and
+           including this one, newest first."""
+        data = []
+        for date in reversed(self.get_build_dates_on_disk()):
+            if since < date <= self.date:
+                data.extend(self.get_git_log(date) or [])
+        return data
+
+    def get_build_dates_on_disk(self):
+        """Get the dates of all builds that have a build directory,
+           in ascending order."""
+        dates = set()
+        for d in glob.glob(os.path.join(self.topdir, '*-*')):
+            d = os.path.basename(d)
+            try:
+                dates.add(datetime.date(year=int(d[:4]), month=int(d[4:6]),
+                                        day=int(d[6:8])))
+            except ValueError:
+                pass
+        return sorted(dates)
+
     def get_broken_links(self):
         """Get a filehandle to the broken links file."""
         g = os.path.join(self.topdir,
@@ -713,83 +850,130 @@ class BuildDatabase(object):
                 with open(g[0], 'rb') as fh:
                     return pickle.load(fh)
         if self.__build_info is None:
-            if self.lab_only:
-                self.__build_info = (get_pickle(self.public_topdir),
-                                     get_pickle(self.lab_only_topdir))
-            else:
-                self.__build_info = (get_pickle(self.public_topdir), None)
+            cache = get_cache(self.config, 'data').namespace(self.branch,
+                                                             self.lab_only)
+            info = cache.get(('build_info', self.date))
+            if info is None:
+                if self.lab_only:
+                    info = (get_pickle(self.public_topdir),
+                            get_pickle(self.lab_only_topdir))
+                else:
+                    info = (get_pickle(self.public_topdir), None)
+                # Only cache the info once the build has finished (both
+                # builds, if we read both, since they finish separately)
+                if info[0] is not None and (info[1] is not None
+                                            or not self.lab_only
+                                            or self.branch != 'develop'):
+                    cache.set(('build_info', self.date), info)
+            self.__build_info = info
         return self.__build_info
 
-    def get_all_component_tests(self, component, platform=None):
-        platform_where = ''
-        if platform:
-            platform_where = 'AND imp_test.arch=%s '
-        test = self.get_branch_table('imp_test')
-        query = "SELECT imp_test_names.name AS test_name, imp_test.name, " \
-                "imp_test.arch, imp_test_units.name AS unit_name, " \
-                "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
-                + test + " imp_test, " \
-                "imp_test_names, imp_test_units, imp_test_archs WHERE " \
-                "imp_test.date=%s AND imp_test_names.unit=%s " \
-                + platform_where + \
-                "AND imp_test.name=imp_test_names.id " \
-                "AND imp_test_names.unit=imp_test_units.id AND " \
-                "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only() \
-                + " ORDER BY imp_test.state DESC,imp_test_units.name," \
-                + "imp_test_names.id"
-        if platform:
-            return self._get_tests(query, (self.date, component, platform))
-        else:
-            return self._get_tests(query, (self.date, component))
-
-    def get_all_failed_tests(self):
-        test = self.get_branch_table('imp_test')
-        query = "SELECT imp_test_names.name AS test_name, imp_test.name, " \
-                "imp_test.arch, imp_test_units.name AS unit_name, " \
-                "imp_test_names.unit AS unit_id, " \
-                "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
-                + test + " imp_test, " \
-                "imp_test_names, imp_test_units, imp_test_archs WHERE " \
-                "imp_test.date=%s AND imp_test.state NOT IN " \
-                + str(OK_STATES) + " AND imp_test.name=imp_test_names.id " \
-                "AND imp_test_names.unit=imp_test_units.id AND " \
-                "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only() \
-                + " ORDER BY imp_test_units.name,imp_test_names.id"
-        return self._get_tests(query, (self.date,))
-
-    def get_new_failed_tests(self):
-        test = self.get_branch_table('imp_test')
-        query = "SELECT imp_test_names.name AS test_name, imp_test.name, " \
-                "imp_test.arch, imp_test_units.name AS unit_name, " \
-                "imp_test_names.unit AS unit_id, " \
-                "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
-                + test + " imp_test, " \
-                "imp_test_names, imp_test_units, imp_test_archs WHERE " \
-                "imp_test.date=%s AND imp_test.delta='NEWFAIL' " \
-                " AND imp_test.name=imp_test_names.id " \
-                "AND imp_test_names.unit=imp_test_units.id AND " \
-                "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only() \
-                + " ORDER BY imp_test_units.name,imp_test_names.id"
-        return self._get_tests(query, (self.date,))
-
-    def get_long_tests(self):
-        test = self.get_branch_table('imp_test')
-        query = "SELECT imp_test_names.name AS test_name, imp_test.name, " \
-                "imp_test.arch, imp_test_units.name AS unit_name, " \
-                "imp_test_names.unit AS unit_id, " \
-                "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
-                + test + " imp_test, " \
-                "imp_test_names, imp_test_units, imp_test_archs WHERE " \
-                "imp_test.date=%s AND imp_test.runtime>20.0 AND " \
-                "imp_test.name=imp_test_names.id AND " \
-                "imp_test_names.unit=imp_test_units.id AND " \
-                "imp_test.arch=imp_test_archs.id " + self.get_sql_lab_only() + \
-                " ORDER BY imp_test.runtime DESC"
-        return self._get_tests(query, (self.date,))
+    def query_tests(self, columns, states=None, failed=None, delta=None,
+                    min_runtime=None, max_runtime=None, unit=None, arch=None,
+                    name_like=None, order_by=(), limit=None, after=None):
+        """Get the day's test results, as a DictCursor.
+
+           Only the given columns (names from TEST_COLUMNS) are returned, and
+           only the tables needed to get those columns and apply the filters
+           are joined. Results can be filtered by a set of `states`, by
+           whether the test `failed`, by `delta` (e.g. 'NEWFAIL'), by a
+           runtime range (`min_runtime` is exclusive, `max_runtime`
+           inclusive), by `unit` (component id), `arch` (platform id) or by
+           an SQL LIKE pattern on the test name.
+
+           `order_by` is a list of column names, each optionally prefixed
+           with '-' for descending order. If `limit` or `after` is given,
+           the test and platform ids are added to the ordering (so that it
+           is unique), and `after` can be set to the values of the ordering
+           columns of the last row seen, to get the next page of results."""
+        tables = set()
+        where = ['imp_test.date=%s']
+        args = [self.date]
+
+        def add_filter(sql, values, column=None):
+            where.append(sql)
+            args.extend(values)
+            if column:
+                tables.update(TEST_COLUMNS[column][1])
+        if states is not None:
+            add_filter('imp_test.state IN (%s)'
+                       % ','.join(['%s'] * len(states)), states)
+        if failed is not None:
+            add_filter('imp_test.state %s (%s)'
+                       % ('NOT IN' if failed else 'IN',
+                          ','.join(['%s'] * len(OK_STATES))), OK_STATES)
+        if delta is not None:
+            add_filter('imp_test.delta=%s', [delta])
+        if min_runtime is not None:
+            add_filter('imp_test.runtime>%s', [min_runtime])
+        if max_runtime is not None:
+            add_filter('imp_test.runtime<=%s', [max_runtime])
+        if unit is not None:
+            add_filter('imp_test_names.unit=%s', [unit], 'unit_id')
+        if arch is not None:
+            add_filter('imp_test.arch=%s', [arch])
+        if name_like is not None:
+            add_filter('imp_test_names.name LIKE %s', [name_like],
+                       'test_name')
+        if not self.lab_only:
+            add_filter('imp_test_units.lab_only=false', [], 'unit_name')
+
+        if limit is not None or after is not None:
+            order_by = unique_test_order(order_by)
+        order = []
+        for col in order_by:
+            desc = col.startswith('-')
+            col = col.lstrip('-')
+            tables.update(TEST_COLUMNS[col][1])
+            order.append((TEST_COLUMNS[col][0], desc))
+        if after is not None:
+            # Keyset pagination: rows strictly after `after` in sort order
+            terms = []
+            for i, (sql, desc) in enumerate(order):
+                t = ['%s=%%s' % o[0] for o in order[:i]]
+                t.append('%s%s%%s' % (sql, '<' if desc else '>'))
+                terms.append('(' + ' AND '.join(t) + ')')
+                args.extend(after[:i + 1])
+            where.append('(' + ' OR '.join(terms) + ')')
+
+        for col in columns:
+            tables.update(TEST_COLUMNS[col][1])
+        query = 'SELECT ' + ', '.join('%s AS %s' % (TEST_COLUMNS[col][0], col)
+                                      for col in columns) \
+                + ' FROM ' + self.get_branch_table('imp_test') + ' imp_test'
+        for table, join in _TEST_JOINS:
+            if table in tables:
+                query += ', ' + table
+                where.append(join)
+        query += ' WHERE ' + ' AND '.join(where)
+        if order:
+            query += ' ORDER BY ' + ','.join(sql + (' DESC' if desc else '')
+                                             for sql, desc in order)
+        if limit is not None:
+            query += ' LIMIT %d' % limit
+        c = self._get_tests(query, tuple(args))
+        if 'detail' in columns:
+            # Replace any references to deduplicated output with the text
+            return ResolvedRows(self.build_conn, c)
+        return c
+
+    def get_all_component_tests(self, component, platform=None, **keys):
+        keys.setdefault('order_by', COMPONENT_TEST_ORDER)
+        return self.query_tests(LIST_TEST_COLUMNS, unit=component,
+                                arch=platform, **keys)
+
+    def get_all_failed_tests(self, platform=None, **keys):
+        keys.setdefault('order_by', FAILED_TEST_ORDER)
+        return self.query_tests(LIST_TEST_COLUMNS, failed=True,
+                                arch=platform, **keys)
+
+    def get_new_failed_tests(self, **keys):
+        keys.setdefault('order_by', FAILED_TEST_ORDER)
+        return self.query_tests(LIST_TEST_COLUMNS, delta='NEWFAIL', **keys)
+
+    def get_long_tests(self, **keys):
+        keys.setdefault('order_by', LONG_TEST_ORDER)
+        return self.query_tests(LIST_TEST_COLUMNS, min_runtime=20.0, **keys)
 
     def get_test_dict(self, date=None):
         """Get the state of every one of the day's tests, as a dict keyed by
@@ -797,7 +981,7 @@ class BuildDatabase(object):
         if date is None:
             date = self.date
         d = {}
-        c = MySQLdb.cursors.DictCursor(self.conn)
+        c = dict_cursor(self.get_build_conn(date))
         table = self.get_branch_table('imp_test')
         query = "SELECT name,arch,state FROM " + table + " WHERE date=%s"
         c.execute(query, (date,))
@@ -805,8 +989,158 @@ class BuildDatabase(object):
             d[(row['name'], row['arch'])] = row['state']
         return d
 
+    def get_test_details(self, tests):
+        """Get the detailed output of each of the given tests, as a dict
+           keyed by (test id, platform id). Only tests with output that
+           we are allowed to see are included."""
+        d = {}
+        table = self.get_branch_table('imp_test')
+        c = self.build_conn.cursor()
+        tests = list(tests)
+        # Don't make the SQL statement too long for the server
+        for i in range(0, len(tests), MAX_IN_BATCH):
+            batch = tests[i:i + MAX_IN_BATCH]
+            query = "SELECT imp_test.name, imp_test.arch, imp_test.detail " \
+                    "FROM " + table + " imp_test, imp_test_names, " \
+                    "imp_test_units WHERE imp_test.date=%s AND " \
+                    "imp_test.name=imp_test_names.id AND " \
+                    "imp_test_names.unit=imp_test_units.id AND " \
+                    "(imp_test.name, imp_test.arch) IN (" \
+                    + ",".join(["(%s,%s)"] * len(batch)) + ")" \
+                    + self.get_sql_lab_only()
+            args = [self.date]
+            for test in batch:
+                args.extend(test)
+            c.execute(query, tuple(args))
+            for row in c:
+                if row[2]:
+                    d[(row[0], row[1])] = row[2]
+        return resolve(self.build_conn, d)
+
+    def get_test_names(self, ids):
+        """Get the name and component of each of the given tests, as a dict
+           keyed by test id. Tests in lab-only components are omitted unless
+           we are including lab-only results.
+           The tests need not be in this build (a comparison also names
+           tests that were removed since an older build) so, unlike most
+           queries, this does not use the build's snapshot."""
+        d = {}
+        if not ids:
+            return d
+        query = "SELECT imp_test_names.id, imp_test_names.name AS test_name, " \
+                "imp_test_units.id AS unit_id, " \
+                "imp_test_units.name AS unit_name " \
+                "FROM imp_test_names, imp_test_units WHERE " \
+                "imp_test_names.unit=imp_test_units.id AND " \
+                "imp_test_names.id IN (" + ",".join(["%s"] * len(ids)) \
+                + ")" + self.get_sql_lab_only()
+        c = dict_cursor(self.conn)
+        c.execute(query, tuple(ids))
+        for row in c:
+            d[row['id']] = row
+        return d
+
+    def get_test_ids(self, names):
+        """Get the ids of the tests with each of the given names, as a dict
+           of lists keyed by name (the same name can be used by tests in
+           different components). Tests in lab-only components are omitted
+           unless we are including lab-only results."""
+        d = {}
+        names = sorted(set(names))
+        c = self.conn.cursor()
+        for i in range(0, len(names), MAX_IN_BATCH):
+            batch = names[i:i + MAX_IN_BATCH]
+            query = "SELECT imp_test_names.name, imp_test_names.id " \
+                    "FROM imp_test_names, imp_test_units WHERE " \
+                    "imp_test_names.unit=imp_test_units.id AND " \
+                    "imp_test_names.name IN (" \
+                    + ",".join(["%s"] * len(batch)) + ")" \
+                    + self.get_sql_lab_only() + " ORDER BY imp_test_names.id"
+            c.execute(query, tuple(batch))
+            for row in c:
+                d.setdefault(row[0], []).append(row[1])
+        return d
+
+    def get_platform_states(self, ids):
+        """Get the day's state of each of the given tests on every platform,
+           as a dict keyed by (test id, platform id). Only tests that we are
+           allowed to see are included."""
+        d = {}
+        table = self.get_branch_table('imp_test')
+        c = self.build_conn.cursor()
+        ids = sorted(set(ids))
+        for i in range(0, len(ids), MAX_IN_BATCH):
+            batch = ids[i:i + MAX_IN_BATCH]
+            query = "SELECT imp_test.name, imp_test.arch, imp_test.state " \
+                    "FROM " + table + " imp_test, imp_test_names, " \
+                    "imp_test_units WHERE imp_test.date=%s AND " \
+                    "imp_test.name=imp_test_names.id AND " \
+                    "imp_test_names.unit=imp_test_units.id AND " \
+                    "imp_test.name IN (" + ",".join(["%s"] * len(batch)) \
+                    + ")" + self.get_sql_lab_only()
+            c.execute(query, tuple([self.date] + batch))
+            for row in c:
+                d[(row[0], row[1])] = row[2]
+        return d
+
+    def get_test_states(self, tests):
+        """Get the state and runtime of each of the given tests, as a dict
+           of (state, runtime) tuples keyed by (test id, platform id, date).
+           Tests can be on any date, and only those that ran and that we
+           are allowed to see are included."""
+        d = {}
+        table = self.get_branch_table('imp_test')
+        c = self.conn.cursor()
+        tests = sorted(set(tests))
+        for i in range(0, len(tests), MAX_IN_BATCH):
+            batch = tests[i:i + MAX_IN_BATCH]
+            query = "SELECT imp_test.name, imp_test.arch, imp_test.date, " \
+                    "imp_test.state, imp_test.runtime FROM " + table \
+                    + " imp_test, imp_test_names, imp_test_units WHERE " \
+                    "imp_test.name=imp_test_names.id AND " \
+                    "imp_test_names.unit=imp_test_units.id AND " \
+                    "(imp_test.name, imp_test.arch, imp_test.date) IN (" \
+                    + ",".join(["(%s,%s,%s)"] * len(batch)) + ")" \
+                    + self.get_sql_lab_only()
+            args = []
+            for test in batch:
+                args.extend(test)
+            c.execute(query, tuple(args))
+            for row in c:
+                d[tuple(row[:3])] = tuple(row[3:])
+        return d
+
+    def get_arch_names(self):
+        """Get the name of every platform, as a dict keyed by id"""
+        c = self.build_conn.cursor()
+        c.execute("SELECT id,name FROM imp_test_archs")
+        return dict((row[0], row[1]) for row in c)
+
+    def get_benchmark_results(self, date=None):
+        """Get the runtime of every one of the day's benchmarks, as a dict
+           keyed by the benchmark id and platform."""
+        if date is None:
+            date = self.date
+        d = {}
+        table = self.get_branch_table('imp_benchmark')
+        query = 'SELECT imp_benchmark.name, imp_benchmark.platform, ' \
+                'imp_benchmark.runtime, imp_benchmark.checkval, ' \
+                'imp_benchmark_names.name AS bench_name, ' \
+                'imp_benchmark_names.algorithm, ' \
+                'imp_benchmark_files.id AS file_id, ' \
+                'imp_test_units.name AS unit_name, ' \
+                'imp_test_units.lab_only ' \
+                'FROM ' + table + ' imp_benchmark, imp_benchmark_names, ' \
+                'imp_benchmark_files, imp_test_units WHERE date=%s ' \
+                'AND imp_benchmark.name=imp_benchmark_names.id AND ' \
+                'imp_benchmark_names.file=imp_benchmark_files.id AND ' \
+                'imp_benchmark_files.unit=imp_test_units.id'
+        for row in self._get_shared_rows('benchmarks', date, query):
+            d[(row['name'], row['platform'])] = row
+        return d
+
     def _get_tests(self, query, args):
-        c = MySQLdb.cursors.DictCursor(self.conn)
+        c = dict_cursor(self.build_conn)
         c.execute(query, args)
         return c
 
@@ -1,20 +1,80 @@
-from flask import request, render_template
+from flask import request, render_template, current_app, url_for
+from flask import abort, jsonify, Response, stream_with_context, g
 import sys
 import re
 import os
 import glob
+import calendar
 import MySQLdb
 import time
 import datetime
+import json
+import base64
+import urllib
+import copy
+from StringIO import StringIO
 from imp_build_utils import BuildDatabase
-from imp_build_utils import platforms_dict, OK_STATES
+from imp_build_utils import platforms_dict, OK_STATES, UNIT_OK_STATES
 from imp_build_utils import results_url, lab_only_results_url
-from imp_build_utils import SPECIAL_COMPONENTS
+from imp_build_utils import SPECIAL_COMPONENTS, unique_test_order
+from imp_build_utils import COMPONENT_TEST_ORDER, FAILED_TEST_ORDER
+from imp_build_utils import LONG_TEST_ORDER, MAX_IN_BATCH
+from history import get_failure_history
+from archive import get_column_archive
+from compare import get_build_comparison, BENCHMARK_THRESHOLD
+from clusters import get_build_clusters
+from details import get_text
+from commits import get_commit_index
+from coalesce import coalesce
+import admission
+import export
+import search
+from cache import get_cache
+from build_calendar import get_build_calendar
+from snapshot import open_snapshot, dict_cursor
 
 imp_github = 'https://github.com/salilab/imp'
 rmf_github = 'https://github.com/salilab/rmf'
 pmi_github = 'https://github.com/salilab/pmi'
 
+# Time (in seconds) to keep cached fragments of pages
+FRAGMENT_TTL = 24 * 60 * 60
+
+# Time (in seconds) that badges for unfinished builds are cached
+BADGE_TTL = 300
+
+# Maximum number of tests that can be looked up at once
+MAX_STATUS_TESTS = 2000
+
+# Maximum number of names to suggest when autocompleting a search
+AUTOCOMPLETE_RESULTS = 10
+
+# Maximum number of tests to list for each cluster of failures
+MAX_CLUSTER_TESTS = 20
+
+# Fields that can be requested from the JSON build summary
+SUMMARY_FIELDS = ['state', 'revision', 'grid', 'failures', 'new_failures',
+                  'coverage']
+
+# Maximum number of test outputs that can be requested at once
+MAX_DETAILS = 2000
+
+# Number of tests to show on each page of a list of tests, by default
+# and at most
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+# WSGI environment key set when pages are rendered to be frozen as static
+# files (see freeze.py); lists of tests are then shown whole, sorted in
+# the browser, since links to other pages of the list would not work
+FREEZE_ENVIRON = 'results.freeze'
+
+# Columns lists of tests can be sorted by, by the name used in the
+# 'sort' argument
+TEST_SORT_COLUMNS = {'component': 'unit_name', 'platform': 'arch_name',
+                     'name': 'test_name', 'runtime': 'runtime',
+                     'state': 'state'}
+
 
 def get_cache_headers():
     """Cache results for 1 hour"""
@@ -73,6 +133,90 @@ def get_date_link(date):
     return date.strftime('%Y%m%d')
 
 
+def is_freezing():
+    """Return True if the page is being rendered to be frozen"""
+    return bool(request.environ.get(FREEZE_ENVIRON))
+
+
+def get_lab_only():
+    """Return True if the user is authenticated to see lab-only results"""
+    return os.environ.get('HTTPS', 'off') == 'on' \
+        and os.environ.get('REMOTE_USER', None) is not None
+
+
+def display_search_complete(get_conn):
+    """Return names of tests and components matching the 'q' argument,
+       as a JSON object, for autocompletion. This is called as the user
+       types, so a database connection is made (with get_conn()) only if
+       the search index needs updating."""
+    matches = search.search(get_conn, request.args.get('q', ''),
+                            get_lab_only(), limit=AUTOCOMPLETE_RESULTS)
+    return jsonify(results=[{'kind': m.kind, 'id': m.id, 'name': m.name,
+                             'component': m.unit_name} for m in matches])
+
+
+def lookup_commits():
+    """Look up the 'q' argument (a commit hash prefix, author or issue
+       number) in the commit index, and return the kind of query and a
+       list of dicts, one per matching commit and build"""
+    index = get_commit_index(current_app.config, TestPage.all_branches)
+    if index is None:
+        abort(404)
+    kind, commits = index.lookup(request.args.get('q', ''))
+    results = []
+    for c in commits:
+        args = [('p', 'build'), ('date', get_date_link(c.date))]
+        if c.branch != 'develop':
+            args.append(('branch', c.branch))
+        results.append({'hash': c.githash, 'author': c.author_name,
+                        'email': c.author_email, 'title': c.title,
+                        'branch': c.branch, 'date': str(c.date),
+                        'build_url': url_for('summary') + '?'
+                        + urllib.urlencode(args),
+                        'commit_url': '%s/commit/%s' % (imp_github,
+                                                        c.githash)})
+    return kind, results
+
+
+def display_commits():
+    """Show the builds that include the commits matching the 'q' argument"""
+    kind, results = lookup_commits()
+    return render_template('commits.html', query=request.args.get('q', ''),
+                           kind=kind, results=results)
+
+
+def display_commits_json():
+    """Return the builds that include the commits matching the 'q'
+       argument, as a JSON object"""
+    kind, results = lookup_commits()
+    return jsonify(query=request.args.get('q', ''), kind=kind,
+                   results=results)
+
+
+def parse_date(date):
+    """Parse a date in the form used in links (e.g. '20120825'), or return
+       None if it is not valid."""
+    if date:
+        m = re.match(r'(\d{4})(\d{2})(\d{2})$', date)
+        if m:
+            try:
+                return datetime.date(year=int(m.group(1)),
+                                     month=int(m.group(2)),
+                                     day=int(m.group(3)))
+            except ValueError:
+                pass
+
+
+def stream_template(template_name, **context):
+    """Like render_template, but render the page piece by piece, so that
+       it can be streamed to the client as it is generated."""
+    current_app.update_template_context(context)
+    t = current_app.jinja_env.get_template(template_name)
+    rv = t.stream(context)
+    rv.enable_buffering(5)
+    return rv
+
+
 def print_footer():
     print "</body></html>"
 
@@ -96,6 +240,30 @@ def get_coverage_link(date, covtyp, component, pct, lab_only, branch,
            % (cls, prefix, branch, get_date_link(date), covtyp, component, pct)
 
 
+def get_coverage(build_info):
+    """Get the Python and C++ coverage of each module from the build_info
+       pickles, as a dict of (pycov, cppcov, lab_only) keyed by module"""
+    coverage = {}
+    if build_info[0]:
+        for m in build_info[0]['modules']:
+            coverage[m['name']] = (m['pycov'], m['cppcov'], False)
+        if build_info[1]:
+            for m in build_info[1]['modules']:
+                if 'pycov' in m:
+                    coverage[m['name']] = (m['pycov'], m['cppcov'], True)
+    return coverage
+
+
+def get_coverage_subdir(unit):
+    """Get the name used for the coverage of the given component"""
+    if unit.startswith('IMP.'):
+        return unit[4:]
+    elif unit == 'IMP':
+        return 'kernel'
+    else:
+        return unit
+
+
 class TestPage(object):
     all_branches = ['develop', 'master', 'release/2.0.1', 'release/2.1',
                     'release/2.3.0', 'release/2.3.1', 'release/2.4.0',
@@ -107,13 +275,14 @@ class TestPage(object):
     def __init__(self, db, config):
         self.db = db
         self.config = config
-        self.lab_only = os.environ.get('HTTPS', 'off') == 'on' \
-                        and os.environ.get('REMOTE_USER', None) is not None
+        self.lab_only = get_lab_only()
         self.script_name = os.environ.get('SCRIPT_NAME', '')
         if '/imp' in self.script_name:
             self.nightly_url = '/imp/nightly'
         else:
             self.nightly_url = '/nightly'
+        self.page = self.test = self.platform = None
+        self.component = self.bench = None
         self.branch = request.args.get('branch', 'develop')
         if self.branch not in self.all_branches:
             self.branch = 'develop'
@@ -121,7 +290,12 @@ class TestPage(object):
             self.lab_only = False
         self.date, self.last_build_date, self.version, self.last_build_version \
                   = self.get_date_and_version()
+        # Let keep_pages check which build the page was made for
+        g.last_build_date = self.last_build_date
         self.revision = self.get_revision()
+        # Use a snapshot of this build for queries about it, if available
+        self.build_db = open_snapshot(config, self.branch, self.date) \
+            or self.db
 
     def get_branch_table(self, name):
         if self.branch == 'develop':
@@ -217,19 +391,13 @@ window.onload = linkEmail;
             return 0
 
     def get_revision(self):
-        query = 'SELECT rev from ' + self.get_branch_table('imp_test_reporev') \
-                + ' where date=%s'
-        c = self.db.cursor()
-        c.execute(query, (self.date,))
-        res = c.fetchone()
-        if res:
-            return res[0]
+        return self.get_calendar().get_revision(self.date)
 
     def get_other_repo_revs(self):
         query = 'SELECT repo,rev from ' \
                 + self.get_branch_table('imp_test_other_reporev') \
                 + ' where date=%s'
-        c = self.db.cursor()
+        c = self.build_db.cursor()
         c.execute(query, (self.date,))
         revs = {}
         for res in c:
@@ -240,23 +408,35 @@ window.onload = linkEmail;
         k = 'LAB_ONLY_TOPDIR' if lab_only else 'TOPDIR'
         return os.path.join(self.config[k], branch)
 
+    def get_archive(self):
+        """Get the columnar archive of this branch's history, or None if
+           there is no archive or it does not yet include the current
+           build"""
+        archive = get_column_archive(self.config, self.branch)
+        if archive is not None:
+            last = archive.get_last_date()
+            if last is not None and last >= self.date:
+                return archive
+
+    def get_calendar(self):
+        """Get the calendar of all builds on the current branch"""
+        return get_build_calendar(self.db,
+                                  self.get_branch_table('imp_test_reporev'),
+                                  self.get_topdir(self.branch),
+                                  with_versions=self.branch == 'master')
+
     def get_last_build_date(self):
         """Get date of most recent nightly build"""
-        s = os.readlink(os.path.join(self.get_topdir(self.branch), 'lastbuild'))
-        s = os.path.basename(os.path.normpath(s))
-        return datetime.date(year=int(s[:4]), month=int(s[4:6]),
-                             day=int(s[6:8]))
+        return self.get_calendar().last_build_date
 
     def get_version(self, date):
         """Map date to version"""
         if self.branch == 'master':
-            c = self.db.cursor()
-            table = self.get_branch_table('imp_test_reporev')
-            query = 'SELECT version FROM ' + table + ' WHERE date=%s'
-            c.execute(query, (date,))
-            res = c.fetchone()
-            if res:
-                return res[0]
+            return self.get_calendar().get_version(date)
+
+    def get_version_date(self, version):
+        """Map version to date, or None"""
+        return self.get_calendar().get_version_date(version)
 
     def get_date_and_version(self):
         # Map version to date, if given
@@ -264,25 +444,16 @@ window.onload = linkEmail;
         if version:
             self.branch = 'master'
             last_build_date = self.get_last_build_date()
-            c = self.db.cursor()
-            table = self.get_branch_table('imp_test_reporev')
-            query = 'SELECT date FROM ' + table + ' WHERE version=%s'
-            c.execute(query, (version,))
-            res = c.fetchone()
-            if res:
-                return (res[0], last_build_date, version,
+            date = self.get_version_date(version)
+            if date:
+                return (date, last_build_date, version,
                         self.get_version(last_build_date))
 
         last_build_date = self.get_last_build_date()
-        date = request.args.get('date', None)
+        date = parse_date(request.args.get('date', None))
         if date:
-            m = re.match(r'(\d{4})(\d{2})(\d{2})$', date)
-            if m:
-                date = datetime.date(year=int(m.group(1)),
-                                     month=int(m.group(2)),
-                                     day=int(m.group(3)))
-                return (date, last_build_date, self.get_version(date),
-                        self.get_version(last_build_date))
+            return (date, last_build_date, self.get_version(date),
+                    self.get_version(last_build_date))
         last_build_version = self.get_version(last_build_date)
         return (last_build_date, last_build_date,
                 last_build_version, last_build_version)
@@ -349,12 +520,12 @@ window.onload = linkEmail;
                                             lab_only, "The build log file",
                                             remove_prefix=False)
             return link
-        component_name, lab_only = self.get_component_from_id(self.db,
+        component_name, lab_only = self.get_component_from_id(self.build_db,
                                                               self.component)
         if not component_name:
             print "<p><b>Unknown component.</b></p>"
             return
-        platform_name = self.get_platform_name_from_id(self.db, self.platform)
+        platform_name = self.get_platform_name_from_id(self.build_db, self.platform)
         if not platform_name:
             print "<p><b>Unknown platform.</b></p>"
             return
@@ -378,21 +549,20 @@ window.onload = linkEmail;
                            include_component=False, include_platform=False)
 
     def display_component(self, component_id):
-        component_name, lab_only = self.get_component_from_id(self.db,
+        component_name, lab_only = self.get_component_from_id(self.build_db,
                                                               component_id)
         if not component_name:
             raise ValueError("Unknown component")
 
         db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
                            self.branch)
-        tests = db.get_all_component_tests(component_id)
         # Set default component for all test links
         self.component = component_id
         self.bench = None
-        return render_template('component.html', component=component_name,
-            build_id=self.get_build_id(),
-            test_table="\n".join(
-                self.display_tests(tests, include_component=False)))
+        return self.display_test_list(
+            lambda **keys: db.get_all_component_tests(component_id, **keys),
+            COMPONENT_TEST_ORDER, 'component.html', include_component=False,
+            component=component_name)
 
     def display_build_status_badge(self):
         imgroot = "https://img.shields.io/badge/"
@@ -408,11 +578,186 @@ window.onload = linkEmail;
         print "Location: %s" % imgurl
         print
 
+    def display_badge(self, component=None, platform=None):
+        """Return an SVG badge showing whether the build passed, or (if
+           `component` or `platform` ids are given) whether that component
+           and/or platform passed. Badges are cached per build, and clients
+           that already have the current badge get a 304 response."""
+        badges = get_cache(self.config, 'data').namespace(self.branch,
+                                                          self.lab_only)
+        key = ('badge', self.date, component, platform)
+        svg = badges.get(key)
+        if svg is None:
+            db = BuildDatabase(self.build_db, self.config, self.date,
+                               self.lab_only, self.branch)
+            svg = self.render_badge(db, component, platform)
+            # The badge can still change until the build has finished
+            badges.set(key, svg, ttl=None if db.is_build_finished(self.date)
+                       else BADGE_TTL)
+        rv = Response(svg, mimetype='image/svg+xml')
+        rv.cache_control.public = True
+        rv.cache_control.max_age = BADGE_TTL
+        rv.add_etag()
+        return rv.make_conditional(request)
+
+    def render_badge(self, db, component, platform):
+        if component is None and platform is None:
+            label = 'nightly build'
+            passed = db.get_build_summary() in ('OK', 'TEST')
+        else:
+            summary = db.get_cached_unit_summary()
+            labels = []
+            unit = arch = None
+            # Components we are not allowed to see are not in the summary
+            if component is not None:
+                unit = self.get_summary_name(summary.unit_ids, component)
+                labels.append(unit)
+            if platform is not None:
+                arch = self.get_summary_name(summary.arch_ids, platform)
+                plat = platforms_dict.get(arch)
+                labels.append(plat.short if plat else arch)
+            label = ' '.join(labels)
+            passed = all(
+                result['state'] in UNIT_OK_STATES
+                for u, archs in summary.data.items() if unit in (None, u)
+                for a, result in archs.items() if arch in (None, a))
+        message, color = ('passing', '#4c1') if passed else ('failing',
+                                                             '#e05d44')
+        # Approximate text widths for an 11px sans-serif font
+        return render_template('badge.svg', label=label, message=message,
+                               color=color, label_width=len(label) * 7 + 10,
+                               message_width=len(message) * 7 + 10)
+
+    def display_summary_json(self):
+        """Return a summary of the build, as a JSON object, for use by bots
+           and dashboards. The `fields` argument is a comma-separated list of
+           the SUMMARY_FIELDS to include (by default, all of them), and the
+           `units` and `archs` arguments restrict the grid to the given
+           component and platform names. The grid, failures and new_failures
+           fields are lists (one per component in `units`) of lists (one
+           per platform in `archs`). The response has an ETag, so that
+           conditional requests can be answered without sending it again."""
+        def get_list_arg(name, default):
+            arg = request.args.get(name)
+            return arg.split(',') if arg else default
+        fields = get_list_arg('fields', SUMMARY_FIELDS)
+        if any(f not in SUMMARY_FIELDS for f in fields):
+            abort(400)
+        db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
+                           self.branch)
+        summary = db.get_cached_unit_summary()
+        units = [u for u in get_list_arg('units', summary.all_units)
+                 if u in summary.data]
+        archs = [a for a in get_list_arg('archs', summary.all_archs)
+                 if a in summary.arch_ids]
+        d = {'branch': self.branch, 'date': str(self.date),
+             'units': units, 'archs': archs}
+
+        def get_grid(key):
+            return [[summary.data[u][a][key] if a in summary.data[u] else None
+                     for a in archs] for u in units]
+        if 'state' in fields:
+            d['state'] = db.get_build_summary()
+        if 'revision' in fields:
+            d['revision'] = self.revision
+        if 'grid' in fields:
+            d['grid'] = get_grid('state')
+        if 'failures' in fields:
+            d['failures'] = get_grid('numfails')
+        if 'new_failures' in fields:
+            d['new_failures'] = get_grid('numnewfails')
+        if 'coverage' in fields:
+            coverage = get_coverage(db.get_build_info())
+            d['coverage'] = []
+            for u in units:
+                cov = coverage.get(get_coverage_subdir(u))
+                d['coverage'].append(cov[:2] if cov else None)
+        rv = jsonify(d)
+        rv.add_etag()
+        return rv
+
+    def display_export(self, kind, fmt):
+        """Return raw results of the given kind ('tests' or 'benchmarks') in
+           the given format ('csv' or 'ndjson'), for builds between the
+           'since' and 'until' dates (by default, just the current build),
+           optionally only for a component ('comp') and/or platform
+           ('plat'). The output is streamed, and compressed if the client
+           accepts it."""
+        if kind not in ('tests', 'benchmarks') or fmt not in export.FORMATS:
+            abort(404)
+        until = parse_date(request.args.get('until')) or self.date
+        since = parse_date(request.args.get('since')) or until
+        db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
+                           self.branch)
+        columns, rows = export.get_rows(
+            db, kind, since, until, unit=request.args.get('comp', type=int),
+            arch=request.args.get('plat', type=int))
+        chunks = export.format_rows(columns, rows, fmt)
+        headers = {'Content-Disposition': 'attachment; filename=%s-%s-%s.%s'
+                   % (kind, since.strftime('%Y%m%d'),
+                      until.strftime('%Y%m%d'), fmt),
+                   'Vary': 'Accept-Encoding'}
+        if 'gzip' in request.accept_encodings:
+            chunks = export.gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(chunks),
+                        mimetype=export.FORMATS[fmt], headers=headers)
+
+    def display_search(self):
+        """Show tests and components matching the 'q' argument, with the
+           state of each test on every platform in the current build"""
+        query = request.args.get('q', '')
+        matches = search.search(lambda: self.db, query, self.lab_only)
+        units = [m for m in matches if m.kind == 'unit']
+        tests = [m for m in matches if m.kind == 'test']
+        db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
+                           self.branch)
+        states = db.get_platform_states(m.id for m in tests)
+        arch_names = db.get_arch_names()
+        archs = sorted(set(k[1] for k in states), key=lambda a: arch_names[a])
+        root = url_for('summary')
+
+        def get_test_row(m):
+            cells = []
+            for arch in archs:
+                state = states.get((m.id, arch))
+                if state is None:
+                    cells.append('<td></td>')
+                else:
+                    cells.append('<td class="%s"><a href="%s%s">%s</a></td>'
+                                 % ('testok' if state in OK_STATES
+                                    else 'testfail', root,
+                                    self.get_link(page='results', test=m.id,
+                                                  platform=arch), state))
+            return '<tr><td>%s</td><td>%s</td>%s</tr>' \
+                % (html_escape(m.name), self.get_search_component_link(m),
+                   ''.join(cells))
+        return render_template(
+            'search.html', query=query, build_id=self.get_build_id(),
+            units=[self.get_search_component_link(m) for m in units],
+            archs=[get_platform_td(arch_names[a]) for a in archs],
+            test_rows=[get_test_row(m) for m in tests])
+
+    def get_search_component_link(self, match):
+        return '<a href="%s">%s</a>' \
+            % (url_for('component', component_id=match.unit_id,
+                       branch=self.branch, date=get_date_link(self.date)),
+               html_escape(match.unit_name))
+
+    def get_summary_name(self, ids, id):
+        """Get the name of a component or platform in a unit summary from
+           its id, or return a 404 error if it is not in the summary"""
+        for name, i in ids.items():
+            if i == id:
+                return name
+        abort(404)
+
     def display_all_failures(self):
-        print "<h1>All test failures for build on %s</h1>" % self.get_build_id()
         db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
                            self.branch)
-        self.display_tests(db.get_all_failed_tests())
+        return self.display_test_list(db.get_all_failed_tests,
+                                      FAILED_TEST_ORDER, 'tests.html',
+                                      title='All test failures')
 
     def display_new_failures(self):
         print "<h1>New test failures for build on %s</h1>" % self.get_build_id()
@@ -428,12 +773,13 @@ window.onload = linkEmail;
             self.display_tests(db.get_new_failed_tests())
 
     def display_long_tests(self):
-        print "<h1>Long-running tests for build on %s</h1>" \
-              % self.get_build_id()
-        print "<p>All tests that ran for more than 20 seconds are shown.</p>"
         db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
                            self.branch)
-        self.display_tests(db.get_long_tests())
+        return self.display_test_list(
+            db.get_long_tests, LONG_TEST_ORDER, 'tests.html',
+            title='Long-running tests',
+            description='All tests that ran for more than 20 seconds '
+                        'are shown.')
 
     def display_benchmark_file(self):
         c = MySQLdb.cursors.DictCursor(self.db)
@@ -463,17 +809,7 @@ window.onload = linkEmail;
         print "<p><i>Click and drag on a plot to zoom in; double click " \
               "to reset the zoom.</i></p>"
 
-        table = self.get_branch_table('imp_benchmark')
-        query = 'SELECT imp_benchmark_names.name, ' \
-                'imp_benchmark_names.id, ' \
-                'imp_benchmark_names.algorithm, imp_benchmark.date, ' \
-                'imp_benchmark.runtime, imp_benchmark.checkval ' \
-                'FROM ' + table + ' imp_benchmark, imp_benchmark_names ' \
-                'WHERE imp_benchmark_names.file=%s AND ' \
-                'imp_benchmark.name=imp_benchmark_names.id AND ' \
-                'imp_benchmark.platform=%s ' \
-                'AND date<=%s ORDER BY imp_benchmark_names.id,date'
-        c.execute(query, (self.bench, self.platform, self.date))
+        rows = self.get_benchmark_file_history(c)
         print '<script type="text/javascript">'
         print """function plot_bench(chartid, values) {
   return $.jqplot(chartid, values, {
@@ -513,7 +849,7 @@ window.onload = linkEmail;
         print '</script>'
         print "<ul>"
         bench = {'id': None}
-        for row in c:
+        for row in rows:
             if row['id'] != bench['id']:
                 if bench['id'] is not None:
                     self.display_benchmark(bench)
@@ -530,6 +866,39 @@ window.onload = linkEmail;
             self.display_benchmark(bench)
         print "</ul>"
 
+    def get_benchmark_file_history(self, c):
+        """Get the history of every benchmark in the current file on the
+           current platform, up to the current date, ordered by benchmark
+           and date"""
+        archive = self.get_archive()
+        if archive is None:
+            table = self.get_branch_table('imp_benchmark')
+            query = 'SELECT imp_benchmark_names.name, ' \
+                    'imp_benchmark_names.id, ' \
+                    'imp_benchmark_names.algorithm, imp_benchmark.date, ' \
+                    'imp_benchmark.runtime, imp_benchmark.checkval ' \
+                    'FROM ' + table + ' imp_benchmark, imp_benchmark_names ' \
+                    'WHERE imp_benchmark_names.file=%s AND ' \
+                    'imp_benchmark.name=imp_benchmark_names.id AND ' \
+                    'imp_benchmark.platform=%s ' \
+                    'AND date<=%s ORDER BY imp_benchmark_names.id,date'
+            c.execute(query, (self.bench, self.platform, self.date))
+            return c
+        c.execute('SELECT id,name,algorithm FROM imp_benchmark_names '
+                  'WHERE file=%s', (self.bench,))
+        names = dict((row['id'], row) for row in c)
+        r = archive.query_benchmarks(
+            ['name', 'date', 'runtime', 'checkval'], until=self.date,
+            name=frozenset(names.keys()), platform=self.platform)
+        rows = [{'name': names[n]['name'], 'id': n,
+                 'algorithm': names[n]['algorithm'], 'date': d,
+                 'runtime': runtime, 'checkval': checkval}
+                for n, d, runtime, checkval in zip(r['name'], r['date'],
+                                                   r['runtime'],
+                                                   r['checkval'])]
+        rows.sort(key=lambda x: (x['id'], x['date']))
+        return rows
+
     def display_benchmark(self, bench):
         def get_check(val):
             if val[1] is None:
@@ -593,7 +962,7 @@ window.onload = linkEmail;
             print "<p>No information available for this build.</p>"
 
     def display_platform(self, platform_id):
-        plat_name = self.get_platform_name_from_id(self.db, platform_id)
+        plat_name = self.get_platform_name_from_id(self.build_db, platform_id)
         p = platforms_dict[plat_name]
         if self.lab_only:
             log_links = [
@@ -611,7 +980,7 @@ window.onload = linkEmail;
         return render_template('platform.html', platform=p, log_links=log_links)
 
     def display_benchmarks(self):
-        c = MySQLdb.cursors.DictCursor(self.db)
+        c = dict_cursor(self.build_db)
         plats = self.get_benchmark_platforms(c)
         if self.platform is None and len(plats) > 0:
             self.platform = plats[0]['id']
@@ -867,13 +1236,30 @@ window.onload = linkEmail;
         else:
             raise ValueError("Unknown state %s" % s['state'])
 
+    def print_fragment(self, key, func, *args):
+        """Print the output of func(out, *args), which writes to the
+           file-like object `out`; this is a fragment of the page that is
+           completely determined by `key` (plus the branch). The fragment is
+           cached, so that it can be reused by other pages, or the public
+           and lab-only variants of the same page."""
+        fragments = get_cache(self.config, 'fragments').namespace(self.branch)
+        html = fragments.get(key)
+        if html is None:
+            # func writes to the stream it is given, not sys.stdout, so that
+            # output from other threads never ends up in the fragment
+            out = StringIO()
+            func(out, *args)
+            html = out.getvalue()
+            fragments.set(key, html, ttl=FRAGMENT_TTL)
+        sys.stdout.write(html)
+
     def print_last_ok_build(self, db):
         last_ok = db.get_last_build_with_summary(('OK', 'TEST'))
         if last_ok is not None:
             print '<p>IMP last built successfully on <a href="%s">%s</a>.</p>' \
                   % (self.get_link(date=last_ok), last_ok)
 
-    def print_doc_summary(self, db):
+    def print_doc_summary(self, out, db):
         def fmt_msg(title, nbroken):
             if nbroken > 0:
                 if nbroken == 1:
@@ -891,7 +1277,7 @@ window.onload = linkEmail;
                   + fmt_msg('reference guide', s['nbroken_tutorial']) \
                   + fmt_msg('RMF manual', s['nbroken_rmf_manual'])
             if msg:
-                print "<p>%s</p>" % msg
+                print >>out, "<p>%s</p>" % msg
 
     def print_build_summary(self, db):
         s = db.get_build_summary()
@@ -939,7 +1325,7 @@ window.onload = linkEmail;
     def display_build_summary(self):
         db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
                            self.branch)
-        summary = db.get_unit_summary()
+        summary = db.get_cached_unit_summary()
         build_info = db.get_build_info()
 
         print "<div class=\"linkspacer\"></div>"
@@ -962,7 +1348,9 @@ window.onload = linkEmail;
                   'mailing list.</p>' % (listname.lower(), listname)
 
         self.print_build_summary(db)
-        self.print_doc_summary(db)
+        # The doc summary is the same for public and lab-only builds
+        self.print_fragment(('doc', self.date, self.get_link(page='doc')),
+                            self.print_doc_summary, db)
 
         if self.revision:
             git = len(self.revision) > 20
@@ -1030,68 +1418,90 @@ window.onload = linkEmail;
                     print '<li><a href="%s">%s</a>%s</li>' % (url, comp, rev)
                 print '</ul>'
 
-        print '<div id="fullmap" style="display:none">'
-        self.print_summary_table(summary, build_info,
+        self.print_fragment(('grid', self.date, self.lab_only,
+                             self.get_link()),
+                            self.print_summary_grid, summary, build_info)
+        self.print_fragment(('misc_errors', self.date, False,
+                             self.nightly_url),
+                            self.print_misc_errors, build_info[0], False)
+        if self.lab_only:
+            self.print_fragment(('misc_errors', self.date, True,
+                                 self.nightly_url),
+                                self.print_misc_errors, build_info[1], True)
+        # The log is read from the build directory, which differs between
+        # the public and lab-only builds
+        self.print_fragment(('git_log', self.date, db.topdir),
+                            self.print_git_log, db)
+
+    def print_summary_grid(self, out, summary, build_info):
+        """Print the grid of all components and platforms, and the
+           grid of only those that failed"""
+        print >>out, '<div id="fullmap" style="display:none">'
+        self.print_summary_table(out, summary, build_info,
                                  'All components and platforms are shown',
                                  show_failures=True)
-        print "</div>"
+        print >>out, "</div>"
 
-        print '<div id="failmap" style="display:block">'
+        print >>out, '<div id="failmap" style="display:block">'
+        # The summary may be shared (cached), so don't modify it
+        summary = copy.copy(summary)
         summary.make_only_failed()
-        self.print_summary_table(summary, build_info,
+        self.print_summary_table(out, summary, build_info,
                                  'Only components or platforms that have at '
                                  'least one failure are shown',
                                  show_failures=False)
-        print "</div>"
-        self.print_misc_errors(build_info[0], False)
-        if self.lab_only:
-            self.print_misc_errors(build_info[1], True)
-        self.print_git_log(db)
+        print >>out, "</div>"
 
-    def print_git_log(self, db):
+    def print_git_log(self, out, db):
         log = db.get_git_log()
         if log:
-            print '<div class="gitlog">'
-            print '<h2>Log</h2>'
-            print '<table>'
-            for lm in log:
-                title = lm.title
-                if len(title) > 100:
-                    title = title[:100] + '...'
-                # Link to RMF or PMI commits
-                title = re.sub("salilab/rmf@([a-z0-f]{7})([a-z0-f]+)",
-                               r'<a href="' + rmf_github +
-                               r'/commit/\1\2">salilab/rmf@\1</a>', title)
-                title = re.sub("salilab/pmi@([a-z0-f]{7})([a-z0-f]+)",
-                               r'<a href="' + pmi_github +
-                               r'/commit/\1\2">salilab/pmi@\1</a>', title)
-                # Link to issues
-                title = re.sub(r" #(\d+)",
-                               r' <a href="' + imp_github +
-                               r'/issues/\1">#\1</a>', title)
-                print '<tr><td><a href="%s/commit/%s">%s</a></td> ' \
-                      '<td>%s</td> <td>%s</td></tr>' \
-                      % (imp_github, lm.githash, lm.githash[:10],
-                         lm.author_email.split('@')[0], title)
-            print '</table>'
-            print '</div>'
-
-    def print_misc_errors(self, build_info, lab_only):
+            print >>out, '<div class="gitlog">'
+            print >>out, '<h2>Log</h2>'
+            print >>out, '<table>'
+            for row in self.format_git_log(log):
+                print >>out, row
+            print >>out, '</table>'
+            print >>out, '</div>'
+
+    def format_git_log(self, log):
+        """Yield a table row for each commit in the git log"""
+        for lm in log:
+            title = lm.title
+            if len(title) > 100:
+                title = title[:100] + '...'
+            # Link to RMF or PMI commits
+            title = re.sub("salilab/rmf@([a-z0-f]{7})([a-z0-f]+)",
+                           r'<a href="' + rmf_github +
+                           r'/commit/\1\2">salilab/rmf@\1</a>', title)
+            title = re.sub("salilab/pmi@([a-z0-f]{7})([a-z0-f]+)",
+                           r'<a href="' + pmi_github +
+                           r'/commit/\1\2">salilab/pmi@\1</a>', title)
+            # Link to issues
+            title = re.sub(r" #(\d+)",
+                           r' <a href="' + imp_github +
+                           r'/issues/\1">#\1</a>', title)
+            yield '<tr><td><a href="%s/commit/%s">%s</a></td> ' \
+                  '<td>%s</td> <td>%s</td></tr>' \
+                  % (imp_github, lm.githash, lm.githash[:10],
+                     lm.author_email.split('@')[0], title)
+
+    def print_misc_errors(self, out, build_info, lab_only):
         if build_info is None:
             return
         errs = build_info.get('misc_errors', [])
         if len(errs) == 0:
             return
-        print '<div class="comperrors">'
+        print >>out, '<div class="comperrors">'
         if lab_only:
-            print '<h2>Miscellaneous log errors for lab-only components</h2>'
+            print >>out, '<h2>Miscellaneous log errors for lab-only ' \
+                         'components</h2>'
         else:
-            print '<h2>Miscellaneous log errors</h2>'
-        print '<ul class="comperrors">'
+            print >>out, '<h2>Miscellaneous log errors</h2>'
+        print >>out, '<ul class="comperrors">'
         for e in errs:
-            self.print_misc_error(e, lab_only)
-        print '</ul>'
-        print '</div>'
+            self.print_misc_error(out, e, lab_only)
+        print >>out, '</ul>'
+        print >>out, '</div>'
 
     def get_raw_log_link(self, logfile, lab_only, caption=None,
                          remove_prefix=True, tags=''):
@@ -1119,7 +1529,7 @@ window.onload = linkEmail;
         dest = prefix + get_date_link(self.date) + '/' + platname + '/'
         return '<a href="%s">%s</a>' % (dest, caption)
 
-    def print_misc_error(self, err, lab_only):
+    def print_misc_error(self, out, err, lab_only):
         if err['type'] == 'unexplog':
             txt = 'Unexpected log file generated: ' \
                   + self.get_raw_log_link(err['log'], lab_only)
@@ -1128,9 +1538,10 @@ window.onload = linkEmail;
         else:
             txt = (self.get_raw_log_link(err['log'], lab_only, err['type'])
                    + ': ' + err['text'])
-        print '<li>%s</li>' % txt
+        print >>out, '<li>%s</li>' % txt
 
-    def print_summary_table(self, summary, build_info, caption, show_failures):
+    def print_summary_table(self, out, summary, build_info, caption,
+                            show_failures):
         def get_row_header(component, component_id):
             special = SPECIAL_COMPONENTS.get(component, None)
             if special:
@@ -1139,69 +1550,58 @@ window.onload = linkEmail;
             else:
                 return '<td class="comptype">%s</td>' \
                        % self.get_component_link(row, summary.unit_ids[row])
-        print "<table class=\"modules\">"
-        print('<caption>%s; '
-              'mouseover or click for more details. %s</caption>'
-              % (caption, self.toggle_failmap(
-                  show_failures,
-                  "[show only failures]" if show_failures else "[show all]")))
-        print "<thead><tr><th></th>"
+        print >>out, "<table class=\"modules\">"
+        print >>out, ('<caption>%s; '
+                      'mouseover or click for more details. %s</caption>'
+                      % (caption, self.toggle_failmap(
+                          show_failures,
+                          "[show only failures]" if show_failures
+                          else "[show all]")))
+        print >>out, "<thead><tr><th></th>"
         for x in summary.all_archs:
             p = platforms_dict[x]
             if x in summary.cmake_archs:
-                print '<th title="%s"><a href="%s">%s</a></th>' \
-                      % (p.long,
-                         self.get_link(page='platform',
-                                       platform=summary.arch_ids[x]),
-                         p.short)
+                print >>out, '<th title="%s"><a href="%s">%s</a></th>' \
+                    % (p.long,
+                       self.get_link(page='platform',
+                                     platform=summary.arch_ids[x]),
+                       p.short)
             else:
-                print '<th title="%s"><a href="%s">%s</a></th>' \
-                      % (p.long,
-                         self.get_link(page='log',
-                                       platform=summary.arch_ids[x]),
-                         p.short)
+                print >>out, '<th title="%s"><a href="%s">%s</a></th>' \
+                    % (p.long,
+                       self.get_link(page='log',
+                                     platform=summary.arch_ids[x]),
+                       p.short)
         if build_info[0]:
-            print '<th title="Percentage of all executable lines of Python ' \
-                  'code in this component that were executed by its ' \
-                  'own regular (non-expensive) tests">Python coverage</th>'
-            print '<th title="Percentage of all executable lines of C++ ' \
-                  'code in this component that were executed by its own ' \
-                  'regular (non-expensive) tests">C++ coverage</th>'
-        print "</tr></thead><tbody>"
-        if build_info[0]:
-            coverage = {}
-            for m in build_info[0]['modules']:
-                coverage[m['name']] = (m['pycov'], m['cppcov'], False)
-            if build_info[1]:
-                for m in build_info[1]['modules']:
-                    if 'pycov' in m:
-                        coverage[m['name']] = (m['pycov'], m['cppcov'], True)
+            print >>out, '<th title="Percentage of all executable lines ' \
+                'of Python code in this component that were executed by ' \
+                'its own regular (non-expensive) tests">Python coverage</th>'
+            print >>out, '<th title="Percentage of all executable lines ' \
+                'of C++ code in this component that were executed by its ' \
+                'own regular (non-expensive) tests">C++ coverage</th>'
+        print >>out, "</tr></thead><tbody>"
+        coverage = get_coverage(build_info)
         for row in summary.all_units:
             unit_id = summary.unit_ids[row]
-            print "<tr>" + get_row_header(row, unit_id)
+            print >>out, "<tr>" + get_row_header(row, unit_id)
             for col in summary.all_archs:
-                print self.format_build_summary(summary.data, row, col,
-                                                summary.arch_ids[col], unit_id)
+                print >>out, self.format_build_summary(
+                    summary.data, row, col, summary.arch_ids[col], unit_id)
             if build_info[0]:
-                if row.startswith('IMP.'):
-                    subdir = row[4:]
-                elif row == 'IMP':
-                    subdir = 'kernel'
-                else:
-                    subdir = row
+                subdir = get_coverage_subdir(row)
                 cov = coverage.get(subdir, None)
                 if cov:
                     for dir, key in (('python', 0), ('cpp', 1)):
                         if cov[key] is None:
-                            print "<td></td>"
+                            print >>out, "<td></td>"
                         else:
-                            print "<td>%s</td>" \
+                            print >>out, "<td>%s</td>" \
                                   % get_coverage_link(self.date, dir, subdir,
                                                       cov[key], cov[2],
                                                       self.branch,
                                                       self.nightly_url)
-            print "</tr>"
-        print "</tbody></table>"
+            print >>out, "</tr>"
+        print >>out, "</tbody></table>"
 
     def get_logfile(self, arch_name, lab_only):
         if lab_only and not self.lab_only:
@@ -1219,8 +1619,8 @@ window.onload = linkEmail;
             return g[0]
 
     def display_log(self):
-        c = MySQLdb.cursors.DictCursor(self.db)
-        arch_name = self.get_platform_name_from_id(self.db, self.platform)
+        c = dict_cursor(self.build_db)
+        arch_name = self.get_platform_name_from_id(self.build_db, self.platform)
         if not arch_name:
             print "<p><b>Invalid platform requested</b></p>"
             return
@@ -1316,49 +1716,166 @@ window.onload = linkEmail;
               % (prefix, sql['logline'], sql['unit_name'],
                  state_msg[sql['state']])
 
+    def get_page_key(self):
+        """Get a key identifying the requested page, such that requests with
+           the same key get the same response"""
+        return (request.path, tuple(sorted(request.args.items(multi=True))),
+                self.branch, self.lab_only, self.date, is_freezing())
+
+    def coalesced(self, func, *args):
+        """Get the response for the current page from func(*args), sharing
+           it with any identical requests made at the same time"""
+        def make_response():
+            # Only the request that renders the page needs to be admitted
+            rv = admission.admit(
+                self.config, g.get('page_class'),
+                lambda: current_app.make_response(func(*args)))
+            try:
+                return (rv.get_data(), rv.status_code,
+                        rv.headers.to_wsgi_list())
+            finally:
+                rv.close()
+        data, status, headers = coalesce(self.config, self.get_page_key(),
+                                         make_response)
+        return Response(data, status, headers)
+
+    def get_list_url(self, **args):
+        """Get a link to the current page, with the given arguments changed
+           (or removed, if None)"""
+        a = request.args.to_dict()
+        a.update(request.view_args)
+        a.update(args)
+        return url_for(request.endpoint,
+                       **dict((k, v) for k, v in a.items() if v is not None))
+
+    def display_test_list(self, get_tests, default_order, template,
+                          include_component=True, include_platform=True,
+                          **context):
+        """Show a single page of a list of tests, sorted by the 'sort'
+           argument and starting after the 'after' cursor. If the 'format'
+           argument is 'json', return just the table rows and a link to the
+           next page, for incremental loading."""
+        if is_freezing():
+            return render_template(
+                template, build_id=self.get_build_id(), next_url=None,
+                test_table="\n".join(self.display_tests(
+                    get_tests(order_by=default_order), include_component,
+                    include_platform)), **context)
+        sort = request.args.get('sort', '')
+        if sort.lstrip('-') in TEST_SORT_COLUMNS:
+            col = TEST_SORT_COLUMNS[sort.lstrip('-')]
+            order = ['-' + col if sort.startswith('-') else col]
+        else:
+            sort = ''
+            order = default_order
+        keys = {'order_by': unique_test_order(order)}
+        try:
+            after = request.args.get('after', None)
+            if after:
+                keys['after'] = json.loads(base64.urlsafe_b64decode(
+                    str(after)))
+        except (TypeError, ValueError):
+            abort(400)
+        # The cursor must have a value for each ordering column
+        if 'after' in keys and (
+                not isinstance(keys['after'], list)
+                or len(keys['after']) != len(keys['order_by'])
+                or not all(v is None or isinstance(v, (basestring, int, float))
+                           for v in keys['after'])):
+            abort(400)
+        n = max(min(request.args.get('n', PAGE_SIZE, type=int),
+                    MAX_PAGE_SIZE), 1)
+        start = request.args.get('start', 0, type=int)
+        cur = get_tests(limit=n + 1, **keys)
+        rows = cur.fetchall()
+        next_url = None
+        if len(rows) > n:
+            rows = rows[:n]
+            # Cursor is the values of the ordering columns of the last row
+            last = [rows[-1][c.lstrip('-')] for c in keys['order_by']]
+            next_url = self.get_list_url(
+                after=base64.urlsafe_b64encode(json.dumps(last)),
+                start=start + n, format=None)
+        if request.args.get('format') == 'json':
+            return jsonify(rows="\n".join(self.display_test_rows(
+                               rows, include_component, include_platform,
+                               start)),
+                           next=next_url)
+        return render_template(
+            template, build_id=self.get_build_id(), next_url=next_url,
+            test_table="\n".join(self.display_tests(
+                rows, include_component, include_platform, sort=sort,
+                start=start)), **context)
+
     def display_tests(self, cur, include_component=True,
-                      include_platform=True):
-        yield "<table class=\"sortable\">\n<thead>"
+                      include_platform=True, sort=None, start=0):
+        """Show a table of tests. If `sort` is given, the table is sorted
+           on the server (and `sort` gives the current sort order, if any),
+           otherwise in the browser."""
+        def header(key, title, caption):
+            if sort is None:
+                return '<th title="%s">%s</th>' % (title, caption)
+            newsort = '-' + key if sort == key else key
+            if sort.lstrip('-') == key:
+                caption += ' &darr;' if sort.startswith('-') else ' &uarr;'
+            return '<th title="%s"><a href="%s">%s</a></th>' \
+                   % (title, html_escape(self.get_list_url(
+                       sort=newsort, after=None, start=None)), caption)
+        # Test output is not included in the page, but fetched on demand
+        yield '<table class="%s" data-details="%s">\n<thead>' \
+              % ('sortable' if sort is None else 'tests',
+                 html_escape(url_for('test_details', branch=self.branch,
+                                     date=get_date_link(self.date))))
         yield "<tr>"
         if include_component:
-            yield "<th>Component</th>"
+            yield header('component', 'Component or module', 'Component')
         if include_platform:
-            yield "<th>Platform</th>"
+            yield header('platform', 'Platform the test was run on',
+                         'Platform')
         yield '<th class="sorttable_nosort"><a title="Show/hide all output" ' \
               'onclick="toggle_all_detail(); return false;" ' \
               'id="dettog" class="dettog" href="#">[+]</a></th>'
-        yield '<th title="Name of the Python or C++ file containing test ' \
-              'cases">Name</th>'
-        yield '<th title="Time (in seconds) that all tests in this file ' \
-              'took to run">Runtime (s)</th>'
-        yield '<th title="OK: all tests ran successfully; FAIL: at least ' \
-              'one test failed; SEGFAULT: the test program crashed with a ' \
-              'segmentation fault; TIMEOUT: the test program ran out of ' \
-              'time; SKIP: at least one test was deliberately skipped; ' \
-              'EXPFAIL: at least one test failed, but the failure was ' \
-              'expected; SKIP_EXPFAIL: this file contains both skipped ' \
-              'tests and expected failures">State</th>'
+        yield header('name', 'Name of the Python or C++ file containing '
+                     'test cases', 'Name')
+        yield header('runtime', 'Time (in seconds) that all tests in this '
+                     'file took to run', 'Runtime (s)')
+        yield header('state', 'OK: all tests ran successfully; FAIL: at '
+                     'least one test failed; SEGFAULT: the test program '
+                     'crashed with a segmentation fault; TIMEOUT: the test '
+                     'program ran out of time; SKIP: at least one test was '
+                     'deliberately skipped; EXPFAIL: at least one test '
+                     'failed, but the failure was expected; SKIP_EXPFAIL: '
+                     'this file contains both skipped tests and expected '
+                     'failures', 'State')
         yield '<th title="Difference between this test and the same test ' \
               'run in the previous build">Delta</th></tr>'
         yield "<tbody>"
-        for n, row in enumerate(cur):
+        for row in self.display_test_rows(cur, include_component,
+                                          include_platform, start):
+            yield row
+        yield "</tbody>\n</table>"
+
+    def display_test_rows(self, cur, include_component=True,
+                          include_platform=True, start=0):
+        """Yield table rows for a list of tests, numbered from `start`"""
+        for n, row in enumerate(cur, start):
             yield "<tr>"
             if include_component:
                 yield "<td>%s</td>" \
                     % self.get_component_link(row['unit_name'], row['unit_id'])
             if include_platform:
                 yield get_platform_td(row['arch_name'])
-            detail = row['detail']
-            if detail is None or detail == '':
-                detail = ''
-                yield "<td></td>"
-            else:
+            if row['has_detail']:
                 yield '<td><a title="Show/hide output" ' \
                       'onclick="toggle_detail(%d); return false;" ' \
                       'id="dettog%d" class="dettog" ' \
                       'href="#">[+]</a></td>' % (n, n)
-                detail = ' <div id="detail%d" class="detail">' \
-                         '<pre>%s</pre></div>' % (n, html_escape(detail))
+                detail = ' <div id="detail%d" class="detail" ' \
+                         'data-test="%d:%d"><pre></pre></div>' \
+                         % (n, row['name'], row['arch'])
+            else:
+                detail = ''
+                yield "<td></td>"
             testlink = self.get_link(page='results', test=row['name'],
                                      platform=row['arch'])
             test_name = row['test_name']
@@ -1370,7 +1887,104 @@ window.onload = linkEmail;
             yield "<td>%.2f</td> %s %s</tr>" \
                   % (row['runtime'], get_state_td(row['state']),
                      get_delta_td(row['delta']))
-        yield "</tbody>\n</table>"
+
+    def display_compare(self):
+        """Show everything that changed between an earlier build (given by
+           the 'since' or 'since_version' arguments) and this one."""
+        since = request.args.get('since_version', None)
+        if since:
+            since = self.get_version_date(since)
+        else:
+            since = parse_date(request.args.get('since', None))
+        if since is None:
+            # Missing or unknown build to compare against
+            abort(400)
+        # Only finished builds can be compared (and cached)
+        date = min(self.date, self.last_build_date)
+        since = min(since, self.last_build_date)
+        if since > date:
+            since, date = date, since
+        comp = get_build_comparison(self.db, self.config, since, date,
+                                    self.lab_only, self.branch)
+        return stream_template(
+            'compare.html', comparison=comp, build_id=self.get_build_id(),
+            counts=comp.get_counts(),
+            benchmark_threshold=BENCHMARK_THRESHOLD,
+            test_table=self.display_test_changes(comp.tests),
+            git_log=self.format_git_log(comp.git_log),
+            get_link=self.get_link)
+
+    def display_clusters(self):
+        """Show the build's test failures, grouped by cause"""
+        clusters = get_build_clusters(self.db, self.config, self.date,
+                                      self.lab_only, self.branch)
+        root = url_for('summary')
+
+        def get_test_url(failure):
+            return root + self.get_link(page='results', test=failure.name,
+                                        platform=failure.arch)
+        return render_template(
+            'clusters.html', clusters=clusters, build_id=self.get_build_id(),
+            nfailures=sum(len(c.failures) for c in clusters),
+            max_tests=MAX_CLUSTER_TESTS, get_test_url=get_test_url)
+
+    def display_test_changes(self, changes):
+        """Yield a table of tests that changed between two builds"""
+        kind_title = {'NEWFAIL': 'Passed before, but now fails',
+                      'NEWOK': 'Failed before, but now passes',
+                      'CHANGED': 'Failed (or passed) differently',
+                      'ADDED': 'New test',
+                      'REMOVED': 'Test no longer run'}
+        yield '<table class="sortable">\n<thead>'
+        yield '<tr><th>Component</th><th>Platform</th><th>Name</th>'
+        yield '<th>Change</th><th>Old state</th><th>New state</th></tr>'
+        yield '</thead><tbody>'
+        for t in changes:
+            test_name = t.test_name
+            if len(test_name) > 80:
+                test_name = test_name[:80] + '[...]'
+            yield '<tr><td>%s</td>%s' \
+                  % (self.get_component_link(t.unit_name, t.unit_id),
+                     get_platform_td(t.arch_name))
+            yield '<td><a href="%s">%s</a></td>' \
+                  % (self.get_link(page='results', test=t.name,
+                                   platform=t.arch), test_name)
+            yield '<td title="%s">%s</td>%s%s</tr>' \
+                  % (kind_title[t.kind], t.kind,
+                     '<td></td>' if t.old_state is None
+                     else get_state_td(t.old_state),
+                     '<td></td>' if t.new_state is None
+                     else get_state_td(t.new_state))
+        yield '</tbody>\n</table>'
+
+    def get_test_details(self, tests):
+        """Get the output of the given (test id, platform id) pairs"""
+        db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
+                           self.branch)
+        return db.get_test_details(tests)
+
+    def display_test_detail(self, test_id, platform_id):
+        """Return the output of a single test, as plain text"""
+        detail = self.get_test_details([(test_id, platform_id)])
+        if not detail:
+            abort(404)
+        return Response(detail[(test_id, platform_id)],
+                        mimetype='text/plain')
+
+    def display_test_details(self):
+        """Return the output of many tests at once, as a JSON object.
+           Tests are given as a comma-separated list of test:platform ids
+           in the 'tests' argument."""
+        tests = []
+        for t in request.values.get('tests', '').split(',')[:MAX_DETAILS]:
+            try:
+                test, platform = t.split(':')
+                tests.append((int(test), int(platform)))
+            except ValueError:
+                pass
+        details = self.get_test_details(tests)
+        return jsonify(dict(('%d:%d' % key, detail)
+                            for key, detail in details.items()))
 
     def get_contiguous_dates(self):
         """Get a contiguous set of dates either side of the current date.
@@ -1380,33 +1994,35 @@ window.onload = linkEmail;
 
     def get_dates_from_db(self):
         """Get a set of dates either side of the current date.
-           This queries the database, so days with no builds are skipped."""
-        dates = []
-        versions = []
-        c = self.db.cursor()
-        table = self.get_branch_table('imp_test_reporev')
-        if self.branch == 'master':
-            to_select = 'date,version'
-        else:
-            to_select = 'date'
-        prev = 'SELECT ' + to_select + ' FROM ' + table \
-               + ' WHERE date<%s ORDER BY date DESC LIMIT 1'
-        next = 'SELECT ' + to_select + ' FROM ' + table \
-               + ' WHERE date>=%s ORDER BY date LIMIT 2'
-        for q in (prev, next):
-            c.execute(q, (self.date,))
-            if self.branch == 'master':
-                for row in c:
-                    dates.append(row[0])
-                    versions.append(row[1])
-            else:
-                for row in c:
-                    dates.append(row[0])
-                versions = [None] * len(dates)
-        return dates, versions
-
-    def display_date_navigation(self):
-        print "<ul>"
+           This uses the build calendar, so days with no builds are skipped."""
+        return self.get_calendar().get_neighbors(self.date)
+
+    def display_calendar(self):
+        """Show every build on the current branch, a month at a time"""
+        def get_day(day, month, builds):
+            if day.month != month:
+                return '<td></td>'
+            if day not in builds:
+                return '<td>%d</td>' % day.day
+            version = builds[day]
+            cls = ' class="thispage"' if day == self.date else ''
+            return '<td%s><a href="%s" title="%s">%d</a></td>' \
+                   % (cls, self.get_link(page='build', date=day),
+                      '%s (%s)' % (day, version) if version else day, day.day)
+        cal = calendar.Calendar()
+        months = []
+        for (year, month), builds in self.get_calendar().get_months():
+            weeks = [[get_day(day, month, builds) for day in week]
+                     for week in cal.monthdatescalendar(year, month)]
+            months.append((datetime.date(year, month, 1).strftime('%B %Y'),
+                           weeks))
+        return render_template('calendar.html', branch=self.branch,
+                               day_names=[calendar.day_abbr[d]
+                                          for d in cal.iterweekdays()],
+                               months=months)
+
+    def display_date_navigation(self, out):
+        print >>out, "<ul>"
         if self.branch == 'develop':
             dates = self.get_contiguous_dates()
             versions = [None] * len(dates)
@@ -1426,9 +2042,9 @@ window.onload = linkEmail;
                     txt = str(date)
                 if version:
                     txt += ' (%s)' % version
-                print "<li%s><a href=\"%s\">%s</a></li> " \
-                      % (cls, self.get_link(date=date), txt)
-        print "</ul>"
+                print >>out, "<li%s><a href=\"%s\">%s</a></li> " \
+                    % (cls, self.get_link(date=date), txt)
+        print >>out, "</ul>"
 
     def get_component_link(self, component, component_id):
         # Hack to map 'IMP' to kernel
@@ -1480,10 +2096,20 @@ window.onload = linkEmail;
 
         arch_id_map = self.get_arch_id_map(c)
 
-        query = "SELECT runtime, date, arch FROM " + table \
-                + " WHERE date<=%s AND name=%s AND state='OK' " \
-                "ORDER BY arch, date"
-        c.execute(query, (self.date, self.test))
+        archive = self.get_archive()
+        if archive:
+            r = archive.query_tests(['runtime', 'date', 'arch'],
+                                    until=self.date, name=self.test,
+                                    state='OK')
+            rows = sorted((dict(zip(('runtime', 'date', 'arch'), x))
+                           for x in zip(r['runtime'], r['date'], r['arch'])),
+                          key=lambda x: (x['arch'], x['date']))
+        else:
+            query = "SELECT runtime, date, arch FROM " + table \
+                    + " WHERE date<=%s AND name=%s AND state='OK' " \
+                    "ORDER BY arch, date"
+            c.execute(query, (self.date, self.test))
+            rows = c
         arch = None
         data = []
         arch_ids = []
@@ -1494,7 +2120,7 @@ $(document).ready(function() {
         def print_series(d, suffix=''):
             print "[" + ",".join("['%s', %f]" % x for x in d) + "]" + suffix
 
-        for row in c:
+        for row in rows:
             if arch != row['arch']:
                 if arch is not None and data:
                     print_series(data, suffix=',')
@@ -1550,7 +2176,7 @@ $(document).ready(function() {
                  "and imp_test.arch=%s and imp_test.name=imp_test_names.id "
                  "and imp_test_names.unit=imp_test_units.id and "
                  "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only())
-        c = MySQLdb.cursors.DictCursor(self.db)
+        c = dict_cursor(self.build_db)
         c.execute(query, (self.date, self.test, self.platform))
         row = c.fetchone()
         if row is None:
@@ -1560,7 +2186,7 @@ $(document).ready(function() {
         print "<tr><td>Name</td> <td>%s</td></tr>" % row['test_name']
         print "<tr><td>State</td> %s</tr>" % get_state_td(row['state'])
         print "<tr><td>Detail</td> <td><pre>%s</pre></td></tr>" \
-              % html_escape(row['detail'])
+              % html_escape(get_text(self.build_db, row['detail']))
         print "<tr><td>Component</td> <td>%s</td></tr>" \
               % self.get_component_link(row['unit_name'], row['unit'])
         print "<tr><td>Platform</td> %s</tr>" \
@@ -1577,10 +2203,10 @@ $(document).ready(function() {
                                                 False)
         else:
             print "<tr><td>Previously passed on</td> <td>%s</td></tr>" \
-                  % self.get_previous_test_link(conn, self.test, self.platform,
-                                                True)
+                  % self.get_previous_test_link(self.db, self.test,
+                                                self.platform, True)
         print "</tbody></table>"
-        self.display_test_other_platforms(conn, self.test, self.platform)
+        self.display_test_other_platforms(self.build_db, self.test, self.platform)
 
     def display_test_other_platforms(self, conn, test, arch):
         print "<h2>Summary of results on all platforms</h2>"
@@ -1592,7 +2218,7 @@ $(document).ready(function() {
                  "imp_test.name=imp_test_names.id and "
                  "imp_test_names.unit=imp_test_units.id and "
                  "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only())
-        c = MySQLdb.cursors.DictCursor(conn)
+        c = dict_cursor(conn)
         c.execute(query, (self.date, test))
         print "<table class=\"sortable\"><thead><tr><th>Platform</th>"
         print "<th>State</th><th>Runtime (s)</th></tr></thead><tbody>"
@@ -1605,12 +2231,30 @@ $(document).ready(function() {
                   % (get_state_td(row['state']), row['runtime'])
         print "</tbody></table>"
 
-    def get_previous_test_link(self, conn, test, arch, previous_success):
+    def get_previous_test_date(self, conn, test, arch, previous_success):
+        """Get the date the given test last passed or failed before the
+           current date, or None. This uses the in-memory test history
+           index where possible (if it is not being updated by another
+           request), rather than scanning the history table."""
+        table = self.get_branch_table('imp_test')
+        index = get_failure_history(table)
+        db = BuildDatabase(conn, self.config, self.date, self.lab_only,
+                           self.branch)
+        try:
+            # Don't move the index past the last build, as later builds
+            # could still appear before the requested date
+            if self.last_build_date is not None \
+               and self.date <= self.last_build_date \
+               and index.update(conn, table, self.date, db.is_build_finished,
+                                wait=False):
+                return index.get_previous_date(test, arch, self.date,
+                                               previous_success)
+        except KeyError:
+            pass
         if previous_success:
             state_op = 'in'
         else:
             state_op = 'not in'
-        table = self.get_branch_table('imp_test')
         query = "SELECT date from " + table + " where name=%s and arch=%s " \
                 "and state " + state_op + " " + str(OK_STATES) \
                 + " and date<%s order by date desc limit 1"
@@ -1618,10 +2262,125 @@ $(document).ready(function() {
         c.execute(query, (test, arch, self.date))
         row = c.fetchone()
         if row:
+            return row['date']
+
+    def get_previous_test_dates(self, conn, tests):
+        """Like get_previous_test_date(), but for many tests at once, given
+           as (test id, platform id, date, previous_success) tuples. Return
+           a dict of dates (or None) keyed by the tuples."""
+        table = self.get_branch_table('imp_test')
+        index = get_failure_history(table)
+        db = BuildDatabase(conn, self.config, self.date, self.lab_only,
+                           self.branch)
+        # Tests on dates the index does not cover raise KeyError below
+        indexed = tests and self.last_build_date is not None \
+            and index.update(conn, table,
+                             min(max(t[2] for t in tests),
+                                 self.last_build_date),
+                             db.is_build_finished, wait=False)
+        d = {}
+        unindexed = {}
+        for t in tests:
+            try:
+                if not indexed:
+                    raise KeyError(t)
+                d[t] = index.get_previous_date(*t)
+            except KeyError:
+                unindexed.setdefault(t[2:], []).append(t)
+        # Query the database for anything not in the index, with one query
+        # per date (and kind of previous result)
+        c = conn.cursor()
+        for (date, previous_success), group in unindexed.items():
+            keys = sorted(set(t[:2] for t in group))
+            found = {}
+            for i in range(0, len(keys), MAX_IN_BATCH):
+                batch = keys[i:i + MAX_IN_BATCH]
+                query = "SELECT name, arch, MAX(date) FROM " + table \
+                        + " WHERE state " \
+                        + ("in " if previous_success else "not in ") \
+                        + str(OK_STATES) + " AND date<%s AND (name, arch) " \
+                        "IN (" + ",".join(["(%s,%s)"] * len(batch)) + ")" \
+                        " GROUP BY name, arch"
+                args = [date]
+                for key in batch:
+                    args.extend(key)
+                c.execute(query, tuple(args))
+                for row in c:
+                    found[(row[0], row[1])] = row[2]
+            for t in group:
+                d[t] = found.get(t[:2])
+        return d
+
+    def display_test_status(self):
+        """Return the state of many tests at once, as a JSON object.
+           The request body is a JSON object with a 'tests' key listing
+           [test, platform, date] triples, where the test is given by id or
+           name, the platform by id or name, and the date as YYYYMMDD (or
+           null for the current build). For each triple, the state and
+           runtime of the test are returned, plus the date it previously
+           failed (if it passed) or passed (if it failed), or null if it
+           never did. At most MAX_STATUS_TESTS tests can be requested."""
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) \
+           or not isinstance(body.get('tests'), list):
+            abort(400)
+        if len(body['tests']) > MAX_STATUS_TESTS:
+            abort(413)
+        db = BuildDatabase(self.db, self.config, self.date, self.lab_only,
+                           self.branch)
+        arch_names = db.get_arch_names()
+        arch_ids = dict((name, i) for i, name in arch_names.items())
+        tests = []
+        for t in body['tests']:
+            try:
+                test, arch, date = t
+                date = parse_date(date) if date else self.date
+                arch = arch_ids.get(arch, arch)
+                if date is None or arch not in arch_names \
+                   or not isinstance(test, (int, basestring)):
+                    abort(400)
+            except (TypeError, ValueError):
+                abort(400)
+            tests.append((test, arch, date))
+        test_ids = db.get_test_ids([t[0] for t in tests
+                                    if not isinstance(t[0], int)])
+
+        def get_ids(test):
+            return [test] if isinstance(test, int) else test_ids.get(test, [])
+        states = db.get_test_states((i, arch, date)
+                                    for test, arch, date in tests
+                                    for i in get_ids(test))
+        results = []
+        keys = []
+        for test, arch, date in tests:
+            r = {'test': test, 'platform': arch_names[arch],
+                 'date': date.strftime('%Y%m%d'), 'state': None,
+                 'runtime': None}
+            key = None
+            for i in get_ids(test):
+                state = states.get((i, arch, date))
+                if state:
+                    r['id'] = i
+                    r['state'], r['runtime'] = state
+                    key = (i, arch, date, state[0] not in OK_STATES)
+                    break
+            results.append(r)
+            keys.append(key)
+        previous = self.get_previous_test_dates(self.db,
+                                                [k for k in keys if k])
+        for r, key in zip(results, keys):
+            if key:
+                date = previous[key]
+                r['previous_success' if key[3] else 'previous_failure'] \
+                    = date.strftime('%Y%m%d') if date else None
+        return jsonify(results=results)
+
+    def get_previous_test_link(self, conn, test, arch, previous_success):
+        date = self.get_previous_test_date(conn, test, arch, previous_success)
+        if date:
             return "<a href=\"%s\">%s</a>" \
                    % (self.get_link(page='results', test=test, platform=arch,
-                                    date=row['date']),
-                      row['date'])
+                                    date=date), date)
         else:
             return "never"
 
@@ -1629,25 +2388,25 @@ $(document).ready(function() {
         self.display_navigation()
         self.pages[self.page]()
 
-    def display_branch_link(self):
+    def display_branch_link(self, out):
         branch_links = [self.get_link(branch=x) for x in self.all_branches]
-        print '<script type="text/javascript">'
-        print 'function change_branch()'
-        print '{'
-        print 'var sel=document.getElementById("branchlist");'
-        print 'var branches=' + repr(branch_links) + ';'
-        print 'window.location.assign(branches[sel.selectedIndex]);'
-        print '}'
-        print '</script>'
-        print '<div class="branchlink">'
-        print '<select id="branchlist" onchange="change_branch()">'
+        print >>out, '<script type="text/javascript">'
+        print >>out, 'function change_branch()'
+        print >>out, '{'
+        print >>out, 'var sel=document.getElementById("branchlist");'
+        print >>out, 'var branches=' + repr(branch_links) + ';'
+        print >>out, 'window.location.assign(branches[sel.selectedIndex]);'
+        print >>out, '}'
+        print >>out, '</script>'
+        print >>out, '<div class="branchlink">'
+        print >>out, '<select id="branchlist" onchange="change_branch()">'
         for branch in self.all_branches:
             if branch == self.branch:
                 sel = ' selected="selected"'
             else:
                 sel = ''
-            print '<option%s>Branch: %s</option>' % (sel, branch)
-        print '</select></div>'
+            print >>out, '<option%s>Branch: %s</option>' % (sel, branch)
+        print >>out, '</select></div>'
 
     def display_lab_only_link(self):
         if self.branch != 'develop':
@@ -1703,6 +2462,11 @@ $(document).ready(function() {
         print '  </ul>\n</div>'
         print "<div class=\"linkspacer\"></div>"
         print "<div class=\"implinks\">"
-        self.display_branch_link()
-        self.display_date_navigation()
+        # Both depend only on the current page's link (and the date of the
+        # last build), not on whether lab-only results are shown
+        self.print_fragment(('branch_link', self.get_link()),
+                            self.display_branch_link)
+        self.print_fragment(('date_navigation', self.get_link(), self.date,
+                             self.last_build_date),
+                            self.display_date_navigation)
         print "</div></div>"
@@ -0,0 +1,161 @@
+"""Prepare for the rush of visitors after a nightly build finishes.
+
+   When a new build appears (its branch's 'lastbuild' link changes), the
+   announcement email sends many people to the same few pages at once.
+   This watches the lastbuild links and, for each new build, does the
+   expensive work up front: exports the build's snapshot, appends it to the
+   columnar archive, freezes its static pages (each only if configured),
+   and requests the most-visited pages from the live site so that the
+   web server's in-memory indexes are up to date.
+
+   Run it from the nightly build script before the email goes out, e.g.
+   python -m results.prewarm --once --url https://.../nightly/results/
+   or leave it running (without --once) to poll for new builds.
+"""
+
+import os
+import sys
+import time
+import traceback
+import urllib2
+from multiprocessing.pool import ThreadPool
+from imp_build_utils import BuildDatabase
+from build_calendar import get_link_date
+from snapshot import export_snapshot, get_snapshot_path
+from archive import ColumnArchive
+from freeze import freeze
+
+# How often (in seconds) to check the lastbuild links when polling
+POLL_INTERVAL = 60
+
+# Maximum number of simultaneous requests or rendering processes
+MAX_PARALLEL = 4
+
+# Time (in seconds) to wait for the live site to return each page
+FETCH_TIMEOUT = 300
+
+
+class BuildWatcher(object):
+    """Notice when the lastbuild link of any of a set of branches changes"""
+
+    def __init__(self, topdir, branches):
+        self.topdir = topdir
+        self.branches = branches
+        self._links = {}
+
+    def check(self):
+        """Return the (branch, date) of every new build since the last
+           check. On the first check, the current build of every
+           branch is returned."""
+        new_builds = []
+        for branch in self.branches:
+            try:
+                link = os.readlink(os.path.join(self.topdir, branch,
+                                                'lastbuild'))
+            except OSError:
+                continue
+            if link != self._links.get(branch):
+                self._links[branch] = link
+                new_builds.append((branch, get_link_date(link)))
+        return new_builds
+
+    def retry(self, branch):
+        """Return the current build of the branch again on the next check,
+           e.g. if preparing for it failed"""
+        self._links.pop(branch, None)
+
+
+def get_prewarm_urls(db):
+    """Get the pages most visited after a build that are generated from
+       its results: the list of all failures, the longest tests, and each
+       failing component"""
+    args = '' if db.branch == 'develop' else '?branch=' + db.branch
+    urls = ['/failures' + args, '/long' + args]
+    summary = db.get_unit_summary()
+    urls.extend('/component/%d%s' % (summary.unit_ids[unit], args)
+                for unit in sorted(summary.failed_units))
+    return urls
+
+
+def _fetch_url(url):
+    """Fetch a page, so that the live site prepares it. Failure to fetch
+       one page should not stop the others, so errors are only reported."""
+    try:
+        urllib2.urlopen(url, timeout=FETCH_TIMEOUT).read()
+    except Exception as err:
+        sys.stderr.write("Could not fetch %s: %s\n" % (url, err))
+
+
+def prewarm_build(conn, config, branch, date, base_url=None,
+                  processes=MAX_PARALLEL, fetch=_fetch_url):
+    """Do all configured preparation for a new build. If `base_url` is
+       given, also fetch the most visited pages, at most `processes` at
+       once, from the live site. Nothing is done (and False is returned)
+       if the build has not finished yet, since anything prepared from
+       its partial results would be out of date."""
+    db = BuildDatabase(conn, config, date, True, branch)
+    if not db.is_build_finished(date):
+        return False
+    snapshot = get_snapshot_path(config, branch, date)
+    if snapshot and not os.path.exists(snapshot):
+        export_snapshot(db)
+    if config.get('ARCHIVE_DIR'):
+        ColumnArchive(config['ARCHIVE_DIR'], branch).sync(db)
+    if config.get('FREEZE_DIR'):
+        freeze(conn, config, branch, [date], processes)
+    if base_url:
+        db = BuildDatabase(conn, config, date, False, branch)
+        pool = ThreadPool(processes)
+        try:
+            pool.map(fetch, [base_url.rstrip('/') + url
+                             for url in get_prewarm_urls(db)])
+        finally:
+            pool.close()
+            pool.join()
+    return True
+
+
+def main():
+    import argparse
+    import results
+    parser = argparse.ArgumentParser(
+        description="Prepare caches when a new nightly build appears")
+    parser.add_argument('branches', nargs='*', default=['develop'])
+    parser.add_argument('--once', action='store_true',
+                        help="Prepare the current builds and exit (with a "
+                             "non-zero status if any could not be prepared, "
+                             "e.g. because it has not finished) rather "
+                             "than waiting for new builds")
+    parser.add_argument('--url', help="Base URL of the live site")
+    parser.add_argument('-j', '--processes', type=int, default=MAX_PARALLEL,
+                        help="Maximum number of simultaneous requests")
+    args = parser.parse_args()
+    config = results.app.config
+    watcher = BuildWatcher(config['LAB_ONLY_TOPDIR'], args.branches)
+    while True:
+        failed = False
+        for branch, date in watcher.check():
+            # Keep watching (and preparing other branches) if this fails
+            try:
+                conn = results._connect_db()
+                try:
+                    ok = prewarm_build(conn, config, branch, date, args.url,
+                                       args.processes)
+                finally:
+                    conn.close()
+                if not ok:
+                    sys.stderr.write("Build %s of %s has not finished yet\n"
+                                     % (date, branch))
+            except Exception:
+                traceback.print_exc()
+                ok = False
+            if not ok:
+                failed = True
+                watcher.retry(branch)
+        if args.once:
+            sys.exit(1 if failed else 0)
+        time.sleep(POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()
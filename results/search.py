@@ -0,0 +1,133 @@
+"""In-memory search index of test and component names.
+
+   Every test name (imp_test_names) and component name (imp_test_units) is
+   indexed by its trigrams (three-character substrings, ignoring case), and
+   kept in a sorted list for prefix searches. A query finds names that
+   contain it: the candidates are those having every trigram of the query,
+   and are then checked directly. Queries shorter than three characters
+   only match name prefixes.
+
+   The index is built once per process, on first use, and then refreshed
+   at most every REFRESH_INTERVAL seconds, reading only the tests added
+   since (test ids only increase). Each entry records whether it is in a
+   lab-only component, so that searches can exclude them.
+"""
+
+import bisect
+import collections
+import threading
+import time
+
+# Minimum time (in seconds) between checks for new tests and components
+REFRESH_INTERVAL = 300
+
+# Maximum number of results for a search
+MAX_RESULTS = 100
+
+# A test or component that matched a search
+Match = collections.namedtuple('Match', ['kind', 'id', 'name', 'unit_id',
+                                         'unit_name'])
+
+
+def get_trigrams(text):
+    """Get the set of trigrams of a string, ignoring case"""
+    text = text.lower()
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class SearchIndex(object):
+    """Index of the names of tests and components"""
+
+    def __init__(self):
+        self.last_update = None
+        self._max_test_id = 0
+        self._units = {}
+        self._entries = []
+        self._trigrams = collections.defaultdict(set)
+        self._sorted = []
+        self._lock = threading.Lock()
+
+    def _add(self, kind, id, name, unit_id):
+        """Add a test or component (kind 'test' or 'unit') to the index;
+           the caller must sort self._sorted afterwards"""
+        n = len(self._entries)
+        self._entries.append((kind, id, name, unit_id))
+        for t in get_trigrams(name):
+            self._trigrams[t].add(n)
+        self._sorted.append((name.lower(), n))
+
+    def update(self, get_conn, interval=REFRESH_INTERVAL):
+        """Add any tests and components added to the database since the
+           last update, if it was more than `interval` seconds ago.
+           get_conn() is called to get a database connection only if
+           an update is needed."""
+        with self._lock:
+            now = time.time()
+            if self.last_update is not None \
+               and now - self.last_update < interval:
+                return
+            c = get_conn().cursor()
+            # Components are few, so reread them all, in case any changed
+            # between public and lab-only
+            c.execute('SELECT id, name, lab_only FROM imp_test_units')
+            for id, name, lab_only in c:
+                if id not in self._units:
+                    self._add('unit', id, name, id)
+                self._units[id] = (name, bool(lab_only))
+            c.execute('SELECT id, name, unit FROM imp_test_names WHERE id>%s '
+                      'ORDER BY id', (self._max_test_id,))
+            for id, name, unit in c:
+                self._add('test', id, name, unit)
+                self._max_test_id = id
+            self._sorted.sort()
+            self.last_update = now
+
+    def _get_candidates(self, query):
+        q = query.lower()
+        if len(q) < 3:
+            i = bisect.bisect_left(self._sorted, (q,))
+            while i < len(self._sorted) and self._sorted[i][0].startswith(q):
+                yield self._sorted[i][1]
+                i += 1
+        else:
+            # Intersect the rarest trigrams first, to keep the sets small
+            sets = sorted((self._trigrams.get(t, set())
+                           for t in get_trigrams(q)), key=len)
+            candidates = sets[0]
+            for s in sets[1:]:
+                candidates = candidates & s
+            for n in candidates:
+                if q in self._entries[n][2].lower():
+                    yield n
+
+    def search(self, query, lab_only, limit=MAX_RESULTS):
+        """Get the components and tests (in that order) whose names contain
+           `query`, as a list of Match objects. Names starting with the
+           query come first; then names are sorted alphabetically.
+           Lab-only components and their tests are omitted unless
+           `lab_only` is True."""
+        if not query:
+            return []
+        with self._lock:
+            matches = []
+            for n in self._get_candidates(query):
+                kind, id, name, unit_id = self._entries[n]
+                unit_name, unit_lab_only = self._units.get(unit_id,
+                                                           (None, True))
+                if lab_only or not unit_lab_only:
+                    matches.append(Match(kind, id, name, unit_id, unit_name))
+        q = query.lower()
+        matches.sort(key=lambda m: (m.kind != 'unit',
+                                    not m.name.lower().startswith(q),
+                                    m.name.lower(), m.unit_name, m.id))
+        return matches[:limit]
+
+
+_index = SearchIndex()
+
+
+def search(get_conn, query, lab_only, limit=MAX_RESULTS):
+    """Search the (shared) index, updating it first (using a database
+       connection from get_conn()) if necessary"""
+    _index.update(get_conn)
+    return _index.search(query, lab_only, limit)
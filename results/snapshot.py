@@ -0,0 +1,240 @@
+"""Read-only SQLite snapshots of finished builds.
+
+   Once a nightly build has finished, its results never change. A snapshot
+   is a small SQLite file containing every row for a single build (and the
+   component, platform, test and benchmark names it refers to), using the
+   same table names as the MySQL database, so the same queries can be run
+   against it. If the SNAPSHOT_DIR configuration option is set and a
+   snapshot exists for a build, queries about that build are served from
+   the snapshot rather than from MySQL.
+
+   Snapshots are made with the 'export' command, e.g.
+   python snapshot.py export /path/to/imp-results.cfg develop 20191113
+"""
+
+import collections
+import os
+import sqlite3
+import tempfile
+import threading
+import MySQLdb
+
+# Per-build tables (with a branch suffix on branches other than develop)
+# that are copied into snapshots, with the indexes to build on each
+BUILD_TABLES = (
+    ('imp_test', (('name', 'arch'), ('state',), ('runtime',))),
+    ('imp_test_unit_result', (('unit', 'arch'),)),
+    ('imp_benchmark', (('name', 'platform'),)),
+    ('imp_build_summary', ()),
+    ('imp_doc', ()),
+    ('imp_test_reporev', ()),
+    ('imp_test_other_reporev', ()))
+
+# Size of the memory map used to read snapshots
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Maximum number of snapshots to keep open
+MAX_OPEN_SNAPSHOTS = 32
+
+
+def get_snapshot_path(config, branch, date):
+    """Get the name of the snapshot file for the given build, or None
+       if snapshots are not configured"""
+    topdir = config.get('SNAPSHOT_DIR')
+    if topdir:
+        return os.path.join(topdir, branch.replace('/', '_'),
+                            date.strftime('%Y%m%d') + '.sqlite')
+
+
+class _SnapshotCursor(object):
+    """Cursor on a snapshot that accepts MySQLdb-style %s placeholders"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, args=()):
+        self._cursor.execute(query.replace('%s', '?'), args)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+def _dict_factory(cursor, row):
+    return dict((d[0], v) for d, v in zip(cursor.description, row))
+
+
+class SnapshotConnection(object):
+    """Read-only connection to a snapshot, which can be used like a
+       MySQLdb connection (use dict_cursor() rather than
+       MySQLdb.cursors.DictCursor to get rows as dicts)"""
+
+    def __init__(self, fname):
+        try:
+            self._conn = sqlite3.connect('file:%s?mode=ro' % fname, uri=True,
+                                         detect_types=sqlite3.PARSE_DECLTYPES,
+                                         check_same_thread=False)
+        except TypeError:
+            # Python 2 can't open read-only, but we enforce it below anyway
+            self._conn = sqlite3.connect(fname,
+                                         detect_types=sqlite3.PARSE_DECLTYPES,
+                                         check_same_thread=False)
+        self._conn.execute('PRAGMA query_only=1')
+        self._conn.execute('PRAGMA mmap_size=%d' % MMAP_SIZE)
+
+    def cursor(self):
+        return _SnapshotCursor(self._conn.cursor())
+
+    def dict_cursor(self):
+        c = self._conn.cursor()
+        c.row_factory = _dict_factory
+        return _SnapshotCursor(c)
+
+    def close(self):
+        self._conn.close()
+
+
+def dict_cursor(conn):
+    """Get a cursor that returns rows as dicts, for either a MySQLdb
+       connection or a snapshot"""
+    if isinstance(conn, SnapshotConnection):
+        return conn.dict_cursor()
+    else:
+        return MySQLdb.cursors.DictCursor(conn)
+
+
+# Open snapshots, as (modification time, SnapshotConnection), by filename,
+# least recently used first
+_open_snapshots = collections.OrderedDict()
+_open_snapshots_lock = threading.Lock()
+
+
+def open_snapshot(config, branch, date):
+    """Get a connection to the snapshot of the given build, or return None
+       if there is no snapshot (or no date is given). Connections are
+       shared, and kept open for reuse; the least recently used are
+       dropped (and so closed once no longer in use) if too many are
+       open."""
+    fname = date and get_snapshot_path(config, branch, date)
+    if not fname:
+        return None
+    try:
+        mtime = os.stat(fname).st_mtime
+    except OSError:
+        return None
+    with _open_snapshots_lock:
+        snapshot = _open_snapshots.pop(fname, None)
+        # Reopen the snapshot if it has been replaced
+        if snapshot is None or snapshot[0] != mtime:
+            snapshot = (mtime, SnapshotConnection(fname))
+        _open_snapshots[fname] = snapshot
+        while len(_open_snapshots) > MAX_OPEN_SNAPSHOTS:
+            _open_snapshots.popitem(last=False)
+        return snapshot[1]
+
+
+def _copy_rows(src, dest, table, query, args, indexes=(), blobs=()):
+    """Copy the rows returned by `query` from MySQL into a new snapshot
+       table, and index it. Columns named in `blobs` hold binary data."""
+    c = src.cursor()
+    c.execute(query, args)
+    cols = [d[0] for d in c.description]
+    dest.execute('CREATE TABLE %s (%s)'
+                 % (table, ', '.join(col + (' DATE' if col == 'date' else '')
+                                     for col in cols)))
+    rows = c
+    if blobs:
+        blob_cols = [n for n, col in enumerate(cols) if col in blobs]
+        rows = ([sqlite3.Binary(v) if n in blob_cols and v is not None
+                 else v for n, v in enumerate(row)] for row in c)
+    dest.executemany('INSERT INTO %s VALUES (%s)'
+                     % (table, ','.join('?' * len(cols))), rows)
+    for n, index in enumerate(indexes):
+        dest.execute('CREATE INDEX %s_%d ON %s (%s)'
+                     % (table, n, table, ','.join(index)))
+
+
+def export_snapshot(db):
+    """Write a snapshot of the build described by the given BuildDatabase
+       (which must include lab-only results), and return its filename"""
+    fname = get_snapshot_path(db.config, db.branch, db.date)
+    dirname = os.path.dirname(fname)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    # Write to a temporary file, so that readers never see a partial snapshot
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    os.close(fd)
+    try:
+        dest = sqlite3.connect(tmpname)
+        test = db.get_branch_table('imp_test')
+        bench = db.get_branch_table('imp_benchmark')
+        for table, indexes in BUILD_TABLES:
+            t = db.get_branch_table(table)
+            _copy_rows(db.conn, dest, t, 'SELECT * FROM ' + t
+                       + ' WHERE date=%s', (db.date,), indexes)
+        # Only the test and benchmark names used by this build are needed;
+        # component and platform tables are small so are copied entirely
+        _copy_rows(db.conn, dest, 'imp_test_units',
+                   'SELECT * FROM imp_test_units', (), [('id',)])
+        _copy_rows(db.conn, dest, 'imp_test_archs',
+                   'SELECT * FROM imp_test_archs', (), [('id',)])
+        _copy_rows(db.conn, dest, 'imp_test_names',
+                   'SELECT * FROM imp_test_names WHERE id IN '
+                   '(SELECT DISTINCT name FROM ' + test + ' WHERE date=%s)',
+                   (db.date,), [('id',), ('unit',)])
+        _copy_rows(db.conn, dest, 'imp_benchmark_names',
+                   'SELECT * FROM imp_benchmark_names WHERE id IN '
+                   '(SELECT DISTINCT name FROM ' + bench + ' WHERE date=%s)',
+                   (db.date,), [('id',), ('file',)])
+        _copy_rows(db.conn, dest, 'imp_benchmark_files',
+                   'SELECT imp_benchmark_files.* FROM imp_benchmark_files '
+                   'WHERE id IN (SELECT DISTINCT imp_benchmark_names.file '
+                   'FROM ' + bench + ' imp_benchmark, imp_benchmark_names '
+                   'WHERE imp_benchmark.name=imp_benchmark_names.id '
+                   'AND date=%s)', (db.date,), [('id',)])
+        if db.config.get('DETAIL_STORE'):
+            # Include any deduplicated test output (see details.py)
+            _copy_rows(db.conn, dest, 'imp_test_detail',
+                       'SELECT * FROM imp_test_detail WHERE hash IN '
+                       '(SELECT DISTINCT SUBSTR(detail, 6) FROM ' + test
+                       + " WHERE date=%s AND detail LIKE 'sha1:%%')",
+                       (db.date,), [('hash',)], blobs=('body',))
+        dest.commit()
+        dest.execute('VACUUM')
+        dest.close()
+        os.chmod(tmpname, 0o444)
+        os.rename(tmpname, fname)
+    except:  # noqa: E722
+        os.unlink(tmpname)
+        raise
+    return fname
+
+
+def main():
+    import argparse
+    import datetime
+    import flask
+    from imp_build_utils import BuildDatabase
+    parser = argparse.ArgumentParser(
+        description="Export a snapshot of a finished build")
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('config', help="Application configuration file")
+    parser.add_argument('branch')
+    parser.add_argument('date', help="Build date (YYYYMMDD)")
+    args = parser.parse_args()
+    config = flask.Config(os.path.dirname(os.path.abspath(args.config)))
+    config.from_pyfile(os.path.abspath(args.config))
+    date = datetime.datetime.strptime(args.date, '%Y%m%d').date()
+    conn = MySQLdb.connect(host=config['HOST'], user=config['USER'],
+                           passwd=config['PASSWORD'], db=config['DATABASE'])
+    db = BuildDatabase(conn, config, date, True, args.branch)
+    print(export_snapshot(db))
+
+
+if __name__ == '__main__':
+    main()
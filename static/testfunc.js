@@ -18,6 +18,56 @@ function show_conda() {
   }
 }
 
+/* Get the URL to fetch test output from for the given detail div */
+function get_details_url(detail) {
+  var e = detail;
+  while (e && e.tagName != 'TABLE') {
+    e = e.parentNode;
+  }
+  return e ? e.getAttribute('data-details') : null;
+}
+
+/* Fetch the output of every given detail div not already loaded, in a
+   single request, then call callback */
+function fetch_details(details, callback) {
+  var keys = [];
+  var bykey = {};
+  var url = null;
+  for (var i = 0; i < details.length; ++i) {
+    var d = details[i];
+    var key = d.getAttribute('data-test');
+    if (!key || d.getAttribute('data-loaded')) continue;
+    if (!bykey[key]) {
+      keys.push(key);
+      bykey[key] = [];
+    }
+    bykey[key].push(d);
+    if (!url) url = get_details_url(d);
+  }
+  if (keys.length == 0 || !url) {
+    callback();
+    return;
+  }
+  var req = new XMLHttpRequest();
+  req.open('POST', url);
+  req.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+  req.onload = function() {
+    if (req.status == 200) {
+      var data = JSON.parse(req.responseText);
+      for (var key in bykey) {
+        for (var i = 0; i < bykey[key].length; ++i) {
+          var d = bykey[key][i];
+          d.firstChild.textContent = data[key] || '';
+          d.setAttribute('data-loaded', '1');
+        }
+      }
+    }
+    callback();
+  };
+  req.onerror = callback;
+  req.send('tests=' + encodeURIComponent(keys.join(',')));
+}
+
 function toggle_detail(num) {
   var detail = document.getElementById("detail" + num);
   var dettog = document.getElementById("dettog" + num);
@@ -25,8 +75,10 @@ function toggle_detail(num) {
     detail.style.display = 'none';
     dettog.innerHTML = '[+]';
   } else {
-    detail.style.display = 'block';
-    dettog.innerHTML = '[-]';
+    fetch_details([detail], function() {
+      detail.style.display = 'block';
+      dettog.innerHTML = '[-]';
+    });
   }
 }
 
@@ -44,14 +96,43 @@ function toggle_all_detail() {
     disp = 'none';
     newtog = '[+]'
   }
-  for (var i = 0; i < details.length; ++i) {
-    details[i].style.display = disp;
-  }
-  for (var i = 0; i < dettogs.length; ++i) {
-    dettogs[i].innerHTML = newtog;
+  var show = function() {
+    for (var i = 0; i < details.length; ++i) {
+      details[i].style.display = disp;
+    }
+    for (var i = 0; i < dettogs.length; ++i) {
+      dettogs[i].innerHTML = newtog;
+    }
+  };
+  if (disp == 'block') {
+    fetch_details(details, show);
+  } else {
+    show();
   }
 }
 
+/* Append the next page of tests to the table preceding the given link */
+function load_more_tests(link) {
+  var para = link.parentNode;
+  var table = para.previousElementSibling;
+  var req = new XMLHttpRequest();
+  req.open('GET', link.href + '&format=json');
+  req.onload = function() {
+    if (req.status != 200) {
+      window.location.assign(link.href);
+      return;
+    }
+    var data = JSON.parse(req.responseText);
+    table.tBodies[0].insertAdjacentHTML('beforeend', data.rows);
+    if (data.next) {
+      link.href = data.next;
+    } else {
+      para.parentNode.removeChild(para);
+    }
+  };
+  req.send();
+}
+
 /* e-mail obfuscation adapted from code by Jason Johnston:
    http://lojjic.net/blog/20030828-142754.rdf.html
 */
@@ -77,3 +158,26 @@ function linkEmail() {
     }
   }
 }
+
+/* Suggest test and component names as a search is typed */
+function complete_search(input) {
+  var list = document.getElementById(input.getAttribute("list"));
+  var req = new XMLHttpRequest();
+  req.open("GET", input.form.action + "/complete?q="
+           + encodeURIComponent(input.value));
+  req.onload = function() {
+    if (req.status != 200) {
+      return;
+    }
+    var data = JSON.parse(req.responseText);
+    while (list.firstChild) {
+      list.removeChild(list.firstChild);
+    }
+    for (var i = 0; i < data.results.length; i++) {
+      var opt = document.createElement("option");
+      opt.value = data.results[i].name;
+      list.appendChild(opt);
+    }
+  };
+  req.send();
+}
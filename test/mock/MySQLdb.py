@@ -3,6 +3,14 @@
 import sqlite3
 
 
+class Error(Exception):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
 class MockCursor(object):
     def __init__(self, conn):
         self.sql, self.db = conn.sql, conn.db
@@ -10,14 +18,32 @@ class MockCursor(object):
 
     def execute(self, statement, args=()):
         self.sql.append(statement)
+        # sqlite has no session variables
+        if statement.startswith('SET SESSION '):
+            return
         # sqlite uses ? as a placeholder; MySQL uses %s
         self.dbcursor.execute(statement.replace('%s', '?'), args)
 
+    @property
+    def description(self):
+        return self.dbcursor.description
+
+    def fetchone(self):
+        return self.dbcursor.fetchone()
+
+    def fetchall(self):
+        return self.dbcursor.fetchall()
+
     def __iter__(self):
         fa = self.dbcursor.fetchall()
         return fa.__iter__()
 
 
+class SSCursor(MockCursor):
+    def __init__(self, conn):
+        super(SSCursor, self).__init__(conn)
+
+
 class DictCursor(MockCursor):
     def __init__(self, conn):
         self._oldrf = conn.db.row_factory
@@ -33,7 +59,8 @@ class MockConnection(object):
     def __init__(self, db, *args, **keys):
         self.args = args
         self.keys = keys
-        self.db = sqlite3.connect(":memory:")
+        self.db = sqlite3.connect(":memory:",
+                                  detect_types=sqlite3.PARSE_DECLTYPES)
         self.sql = []
         # Use the database 'name' argument as a set of sqlite3 statements
         # to initialize it
@@ -44,10 +71,16 @@ class MockConnection(object):
     def cursor(self):
         return MockCursor(self)
 
+    def commit(self):
+        self.db.commit()
+
     def close(self):
         self.db.close()
 
 
+Binary = sqlite3.Binary
+
+
 def connect(*args, **keys):
     return MockConnection(*args, **keys)
 
@@ -58,3 +91,4 @@ class cursors(object):
 
 
 cursors.DictCursor = DictCursor
+cursors.SSCursor = SSCursor
@@ -0,0 +1,107 @@
+import threading
+import time
+import utils
+
+utils.set_search_paths(__file__)
+import results
+from results.admission import Limiter
+
+
+def test_limiter():
+    """Test limiting the number of concurrent holders"""
+    lim = Limiter(2, max_queued=1)
+    assert lim.acquire(0)
+    assert lim.acquire(0)
+    assert not lim.acquire(0.01)
+    # A waiting request gets in when another finishes
+    t = threading.Timer(0.05, lim.release)
+    t.start()
+    assert lim.acquire(5)
+    t.join()
+    assert lim.active == 2
+    assert lim.waiting == 0
+
+
+def test_limiter_queue_full():
+    """Test that requests are rejected when too many are waiting"""
+    lim = Limiter(1, max_queued=1)
+    assert lim.acquire(0)
+    waiter = threading.Thread(target=lambda: lim.acquire(5))
+    waiter.start()
+    while lim.waiting == 0:
+        pass
+    assert not lim.acquire(5)
+    lim.release()
+    waiter.join()
+    assert lim.active == 1
+
+
+def test_busy(tmpdir):
+    """Test that a busy class of page returns 503, without affecting
+       other pages"""
+    topdir = str(tmpdir)
+    utils.make_build_dirs(topdir, ['20191113'])
+    utils.configure_app(results.app, topdir)
+    results.app.config.update({'PAGE_CONCURRENCY': {'lists': 0},
+                               'ADMISSION_TIMEOUT': 0})
+    try:
+        c = results.app.test_client()
+        rv = c.get('/long')
+        assert rv.status_code == 503
+        assert rv.headers['Retry-After'] == '1'
+        assert c.get('/calendar').status_code == 200
+    finally:
+        del results.app.config['PAGE_CONCURRENCY']
+        del results.app.config['ADMISSION_TIMEOUT']
+
+
+def test_coalesced(tmpdir, monkeypatch):
+    """Test that requests sharing a coalesced page don't each need to be
+       admitted, and that the renderer's admission is released"""
+    utils.setup_app(results.app, tmpdir, monkeypatch)
+    display = results.index.TestPage.display_long_tests
+
+    def slow_display(self):
+        # Give the other requests time to arrive
+        time.sleep(0.2)
+        return display(self)
+    monkeypatch.setattr(results.index.TestPage, 'display_long_tests',
+                        slow_display)
+    monkeypatch.setitem(results.app.config, 'PAGE_CONCURRENCY',
+                        {'lists': 1})
+    monkeypatch.setitem(results.app.config, 'ADMISSION_TIMEOUT', 0)
+    codes = []
+
+    def worker():
+        codes.append(results.app.test_client().get('/long').status_code)
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert codes == [200] * 3
+    assert results.admission.get_limiter(results.app.config,
+                                         'lists').active == 0
+
+
+def test_query_time_limit(tmpdir, monkeypatch):
+    """Test setting a time limit on queries for a class of page"""
+    topdir = str(tmpdir)
+    utils.make_build_dirs(topdir, ['20191113'])
+    utils.configure_app(results.app, topdir)
+    conns = []
+    connect = results._connect_db
+
+    def _connect_db():
+        conns.append(connect())
+        return conns[-1]
+    monkeypatch.setattr(results, '_connect_db', _connect_db)
+    results.app.config['QUERY_TIME_LIMITS'] = {'lists': 2.5}
+    try:
+        c = results.app.test_client()
+        assert c.get('/long').status_code == 200
+        assert conns[-1].sql[0] == 'SET SESSION max_execution_time=2500'
+        assert c.get('/calendar').status_code == 200
+        assert not any(s.startswith('SET') for s in conns[-1].sql)
+    finally:
+        del results.app.config['QUERY_TIME_LIMITS']
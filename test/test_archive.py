@@ -0,0 +1,126 @@
+import datetime
+import os
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results.archive import ColumnArchive
+from results.imp_build_utils import BuildDatabase
+
+
+def _d(day):
+    return datetime.date(2019, 11, day)
+
+
+def _make_db(tmpdir, sql, date):
+    config = {'TOPDIR': str(tmpdir), 'LAB_ONLY_TOPDIR': str(tmpdir)}
+    conn = MySQLdb.connect(utils.SCHEMA + sql)
+    return BuildDatabase(conn, config, date, True, 'develop')
+
+
+def test_sync_and_query(tmpdir):
+    """Test syncing builds into the archive and querying them"""
+    db = _make_db(tmpdir, [
+        "INSERT INTO imp_test VALUES (1, 1, '2019-10-31', 'OK', 1., NULL, '')",
+        "INSERT INTO imp_test VALUES (1, 1, '2019-11-01', 'FAIL', NULL, "
+        "NULL, '')",
+        "INSERT INTO imp_test VALUES (2, 1, '2019-11-01', 'OK', 2., NULL, '')",
+        "INSERT INTO imp_test VALUES (1, 2, '2019-11-02', 'OK', 3., NULL, '')",
+        "INSERT INTO imp_benchmark VALUES (5, 1, '2019-11-01', 4., NULL)"],
+        _d(1))
+    bdir = utils.make_build_dirs(str(tmpdir), ['20191031', '20191101',
+                                               '20191102'], build_info={})
+    info = os.path.join(bdir, '20191102-abcdef', 'build', 'build_info.pck')
+    os.rename(info, info + '.new')
+    a = ColumnArchive(str(tmpdir.join('archive')), 'develop')
+    assert a.get_last_date() is None
+    a.sync(db)
+    assert a.get_last_date() == _d(1)
+    assert sorted(os.listdir(a.tests.topdir)) == ['201910', '201911']
+    r = a.query_tests(['date', 'runtime', 'state'], name=1)
+    assert r == {'date': [datetime.date(2019, 10, 31), _d(1)],
+                 'runtime': [1., None], 'state': ['OK', 'FAIL']}
+    r = a.query_tests(['name'], since=_d(1), state='OK')
+    assert r == {'name': [2]}
+    r = a.query_tests(['name'], state='TIMEOUT')
+    assert r == {'name': []}
+    r = a.query_benchmarks(['runtime', 'checkval'], name=set([5, 6]))
+    assert r == {'runtime': [4.], 'checkval': [None]}
+
+    # Builds that have not finished are not archived
+    db.date = _d(2)
+    a.sync(db)
+    assert a.get_last_date() == _d(1)
+    # Only newer builds should be read on the next sync
+    os.rename(info + '.new', info)
+    a.sync(db)
+    assert db.conn.sql[-1].endswith('WHERE date>%s AND date<=%s '
+                                    'ORDER BY date')
+    r = a.query_tests(['date', 'arch'], until=_d(2), name=1)
+    assert r['arch'] == [1, 1, 2]
+    # A new archive object sees the same data
+    a = ColumnArchive(str(tmpdir.join('archive')), 'develop')
+    assert a.get_last_date() == _d(2)
+    assert a.states == ['OK', 'FAIL']
+
+
+def test_interrupted_append(tmpdir):
+    """Test that a partially-written build is ignored and overwritten"""
+    a = ColumnArchive(str(tmpdir), 'develop')
+    a.tests.append([(_d(1), 1, 1, 0, 1.)])
+    part = tmpdir.join('develop', 'test', '201911')
+    # Simulate an append interrupted before the row count was updated
+    with open(str(part.join('name')), 'ab') as fh:
+        fh.write(b'garbage!')
+    assert a.query_tests(['name']) == {'name': [1]}
+    a.tests.append([(_d(2), 2, 1, 0, 1.)])
+    assert a.query_tests(['name']) == {'name': [1, 2]}
+
+
+def test_name_index(tmpdir):
+    """Test looking up rows by name with the per-month index"""
+    a = ColumnArchive(str(tmpdir), 'develop')
+    a.tests.append([(_d(1), 2, 1, 0, 1.), (_d(1), 1, 1, 0, 2.)])
+    a.tests.append([(_d(2), 1, 1, 0, 3.), (_d(2), 2, 2, 0, 4.)])
+    part = tmpdir.join('develop', 'test', '201911')
+    assert a.tests._get_partition('201911').lookup(frozenset((1,)), 0, 4) \
+        == [1, 2]
+    r = a.query_tests(['runtime'], since=_d(2), name=2)
+    assert r == {'runtime': [4.]}
+    r = a.query_tests(['runtime'], name=set([1, 2]), arch=2)
+    assert r == {'runtime': [4.]}
+    # Without an up-to-date index, the name column is scanned instead
+    part.join('name.idx').remove()
+    assert a.query_tests(['runtime'], name=1) == {'runtime': [2., 3.]}
+    # Missing indexes are added by the next sync
+    a.tests.write_indexes()
+    assert part.join('name.idx').check()
+    # Once indexed, the name column itself is not read
+    part.join('name').write(b'\0' * 16)
+    assert a.query_tests(['runtime'], name=1) == {'runtime': [2., 3.]}
+
+
+def test_runtime_page(tmpdir, capsys):
+    """Test the runtime page using the archive"""
+    topdir = str(tmpdir)
+    utils.make_build_dirs(topdir, ['20191113'])
+    utils.configure_app(results.app, topdir, [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+        "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'OK', 42., "
+        "NULL, '')"])
+    a = ColumnArchive(str(tmpdir.join('archive')), 'develop')
+    a.tests.append([(_d(12), 1, 1, 0, 37.), (_d(13), 1, 1, 0, 42.)])
+    with open(os.path.join(a.topdir, 'states'), 'w') as fh:
+        fh.write('OK\n')
+    config = dict(results.app.config)
+    config['ARCHIVE_DIR'] = str(tmpdir.join('archive'))
+    with results.app.test_request_context('/?date=20191113'):
+        p = results.index.TestPage(results.get_db(), config)
+        p.test = 1
+        p.display_test_runtime()
+    out = capsys.readouterr()[0]
+    assert "['2019-11-12', 37.000000]" in out
+    assert "['2019-11-13', 42.000000]" in out
@@ -0,0 +1,56 @@
+import utils
+
+utils.set_search_paths(__file__)
+import results
+
+
+def _setup(tmpdir, monkeypatch):
+    utils.setup_app(results.app, tmpdir, monkeypatch, [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+        "INSERT INTO imp_test_units VALUES (3, 'IMP.em', 0)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_archs VALUES (2, 'mac10v4-intel')",
+        "INSERT INTO imp_build_summary VALUES ('2019-11-13', 0, 'TEST')",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 1, 1, "
+        "'OK', 0)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 1, 2, "
+        "'OK', 0)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 2, 1, "
+        "'BUILD', 0)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 3, 2, "
+        "'TEST', 0)"], build_info={'modules': []})
+
+
+def test_build_badge(tmpdir, monkeypatch):
+    """Test the badge for the whole build"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/badge.svg')
+    assert rv.status_code == 200
+    assert rv.mimetype == 'image/svg+xml'
+    assert b'nightly build: passing' in rv.data
+    etag = rv.headers['ETag']
+    rv = c.get('/badge.svg', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    assert rv.data == b''
+
+
+def test_unit_badges(tmpdir, monkeypatch):
+    """Test badges for components and platforms"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/badge.svg?comp=1')
+    assert b'IMP.core: passing' in rv.data
+    rv = c.get('/badge.svg?comp=3')
+    assert b'IMP.em: failing' in rv.data
+    # The failing component was only built on the Mac
+    rv = c.get('/badge.svg?plat=1')
+    assert b': passing' in rv.data
+    rv = c.get('/badge.svg?plat=2')
+    assert b': failing' in rv.data
+    rv = c.get('/badge.svg?comp=3&plat=1')
+    assert b'passing' in rv.data
+    # Lab-only components are not shown to the public
+    assert c.get('/badge.svg?comp=2').status_code == 404
+    assert c.get('/badge.svg?plat=99').status_code == 404
@@ -0,0 +1,111 @@
+import datetime
+import sys
+import utils
+
+utils.set_search_paths(__file__)
+import results
+import MySQLdb
+from results.build_calendar import BuildCalendar, SummaryCalendar
+
+build_calendar = sys.modules['results.build_calendar']
+
+
+def _d(month, day):
+    return datetime.date(2019, month, day)
+
+
+def test_lookups():
+    """Test build calendar lookups"""
+    cal = BuildCalendar()
+    cal.set_builds([(_d(10, 30), 'abc', '2.11.0'), (_d(11, 2), 'def', None),
+                    (_d(11, 5), 'ghi', '2.11.1'), (_d(11, 6), 'jkl', None)])
+    assert cal.get_revision(_d(11, 2)) == 'def'
+    assert cal.get_revision(_d(11, 3)) is None
+    assert cal.get_version(_d(11, 5)) == '2.11.1'
+    assert cal.get_version_date('2.11.0') == _d(10, 30)
+    assert cal.get_version_date('2.12.0') is None
+    assert cal.get_previous(_d(11, 5)) == _d(11, 2)
+    assert cal.get_previous(_d(10, 30)) is None
+    assert cal.get_neighbors(_d(11, 3)) == ([_d(11, 2), _d(11, 5),
+                                             _d(11, 6)],
+                                            [None, '2.11.1', None])
+    assert cal.get_neighbors(_d(10, 1)) == ([_d(10, 30), _d(11, 2)],
+                                            ['2.11.0', None])
+    months = cal.get_months()
+    assert [m[0] for m in months] == [(2019, 11), (2019, 10)]
+    assert months[1][1] == {_d(10, 30): '2.11.0'}
+
+
+def test_reload_missing_build(tmpdir, monkeypatch):
+    """Test reloading until the last build is in the database"""
+    topdir = str(tmpdir)
+    bdir = utils.make_build_dirs(topdir, ['20191112', '20191113'])
+    conn = MySQLdb.connect(utils.SCHEMA + [
+        "INSERT INTO imp_test_reporev VALUES ('2019-11-12', 'abc', NULL)"])
+    cal = BuildCalendar()
+    cal.update(conn, 'imp_test_reporev', bdir, False)
+    assert cal.last_build_date == _d(11, 13)
+    assert cal.dates == [_d(11, 12)]
+    conn.db.execute("INSERT INTO imp_test_reporev VALUES "
+                    "('2019-11-13', 'def', NULL)")
+    # Checks are still throttled
+    cal.update(conn, 'imp_test_reporev', bdir, False)
+    assert cal.dates == [_d(11, 12)]
+    monkeypatch.setattr(build_calendar, 'CHECK_INTERVAL', 0)
+    cal.update(conn, 'imp_test_reporev', bdir, False)
+    assert cal.dates == [_d(11, 12), _d(11, 13)]
+    # Once the build is loaded, the database is not queried again
+    nsql = len(conn.sql)
+    cal.update(conn, 'imp_test_reporev', bdir, False)
+    assert len(conn.sql) == nsql
+
+
+def test_calendar_page(tmpdir):
+    """Test the build calendar page"""
+    topdir = str(tmpdir)
+    utils.make_build_dirs(topdir, ['20191112', '20191113'], branch='master')
+    utils.configure_app(results.app, topdir, [
+        "CREATE TABLE imp_test_reporev_master (date DATE, rev TEXT, "
+        "version TEXT)",
+        "INSERT INTO imp_test_reporev_master VALUES "
+        "('2019-11-12', 'abc', '2.12.0')",
+        "INSERT INTO imp_test_reporev_master VALUES "
+        "('2019-11-13', 'def', NULL)"])
+    c = results.app.test_client()
+    rv = c.get('/calendar?branch=master&version=2.12.0')
+    assert rv.status_code == 200
+    assert b'November 2019' in rv.data
+    assert b'class="thispage"><a href="?p=build&amp;date=20191112' \
+           b'&amp;branch=master" title="2019-11-12 (2.12.0)">12</a>' in rv.data
+
+
+def test_last_build_with_summary():
+    """Test finding the last build in a given state"""
+    conn = MySQLdb.connect([
+        "CREATE TABLE imp_build_summary (date DATE, lab_only BOOLEAN, "
+        "state TEXT)"] + [
+        "INSERT INTO imp_build_summary VALUES ('2019-11-%02d', %d, '%s')"
+        % row for row in [(1, 0, 'OK'), (1, 1, 'OK'),
+                          (2, 0, 'TEST'), (2, 1, 'BUILD'),
+                          (3, 0, 'BUILD'), (3, 1, 'OK'),
+                          (4, 0, 'OK')]])
+    cal = SummaryCalendar()
+    cal.update(conn, 'imp_build_summary', _d(11, 3), _d(11, 5))
+    assert cal.dates == [_d(11, 1), _d(11, 2)]
+
+    def last(date, states, lab_only):
+        cal.update(conn, 'imp_build_summary', date, _d(11, 5))
+        return cal.get_last_build_with_summary(date, states, lab_only)
+    assert last(_d(11, 3), ('OK',), False) == _d(11, 1)
+    assert last(_d(11, 3), ('OK', 'TEST'), False) == _d(11, 2)
+    assert last(_d(11, 3), ('OK', 'TEST'), True) == _d(11, 1)
+    assert last(_d(11, 1), ('OK', 'TEST'), False) is None
+    assert last(_d(11, 5), ('OK', 'TEST'), False) == _d(11, 4)
+    # No lab-only build on the 4th
+    assert last(_d(11, 5), ('OK', 'TEST'), True) == _d(11, 1)
+    assert cal.dates == [_d(11, 1), _d(11, 2), _d(11, 3), _d(11, 4)]
+    assert 'date>=%s' in conn.sql[-1]
+    # Builds are only loaded up to the last build, which may not be finished
+    cal = SummaryCalendar()
+    cal.update(conn, 'imp_build_summary', _d(11, 30), _d(11, 4))
+    assert cal.dates == [_d(11, 1), _d(11, 2), _d(11, 3)]
@@ -0,0 +1,135 @@
+import datetime
+import pickle
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+from results import cache
+from results.imp_build_utils import BuildDatabase
+
+
+def _get_db(lab_only=False):
+    conn = MySQLdb.connect(utils.SCHEMA + [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_archs VALUES (2, 'i386-intel8')"]
+        + ["INSERT INTO imp_test_names VALUES (%d, 'test_%d.py', %d)"
+           % (i, i, 2 if i == 5 else 1) for i in range(1, 6)]
+        + ["INSERT INTO imp_test VALUES (%d, %d, '2019-11-13', '%s', %f, "
+           "NULL, NULL)" % (i, arch, 'FAIL' if i % 2 else 'OK', i * 10.)
+           for i in range(1, 6) for arch in (1, 2)])
+    config = {'TOPDIR': '/', 'LAB_ONLY_TOPDIR': '/'}
+    return conn, BuildDatabase(conn, config, datetime.date(2019, 11, 13),
+                               lab_only, 'develop')
+
+
+def test_query_tests_joins():
+    """Test that query_tests only joins the tables it needs"""
+    conn, db = _get_db(lab_only=True)
+    rows = list(db.query_tests(['name', 'arch', 'state'], failed=True))
+    assert len(rows) == 6
+    assert 'imp_test_names' not in conn.sql[-1]
+    rows = list(db.query_tests(['name', 'arch_name'], arch=2))
+    assert sorted(r['name'] for r in rows) == [1, 2, 3, 4, 5]
+    assert 'imp_test_names' not in conn.sql[-1]
+    assert 'imp_test_archs' in conn.sql[-1]
+    # Lab-only components need to be filtered out
+    conn, db = _get_db(lab_only=False)
+    rows = list(db.query_tests(['name', 'arch', 'state'], failed=True))
+    assert len(rows) == 4
+    assert 'imp_test_units' in conn.sql[-1]
+
+
+def test_query_tests_keyset():
+    """Test paging through query_tests results"""
+    conn, db = _get_db(lab_only=True)
+    order = ('-runtime', 'arch')
+    seen = []
+    after = None
+    while True:
+        rows = list(db.query_tests(['name', 'arch', 'runtime'],
+                                   order_by=order, limit=3, after=after))
+        if not rows:
+            break
+        seen.extend((r['name'], r['arch']) for r in rows)
+        after = (rows[-1]['runtime'], rows[-1]['arch'], rows[-1]['name'])
+    assert seen == [(i, arch) for i in range(5, 0, -1) for arch in (1, 2)]
+    rows = list(db.query_tests(['test_name'], name_like='test_1%',
+                               min_runtime=5., max_runtime=10.))
+    assert [r['test_name'] for r in rows] == ['test_1.py', 'test_1.py']
+
+
+def test_shared_lab_only_fetch(tmpdir, monkeypatch):
+    """Test sharing lab-only results between public and lab-only pages"""
+    monkeypatch.setattr(cache, '_caches', {})
+    conn = MySQLdb.connect(utils.SCHEMA + [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 1, 1, "
+        "'OK', 0)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 2, 1, "
+        "'BUILD', 0)",
+        "INSERT INTO imp_benchmark_files VALUES (1, 'bench1.py', 1)",
+        "INSERT INTO imp_benchmark_files VALUES (2, 'bench2.py', 2)",
+        "INSERT INTO imp_benchmark_names VALUES (1, 'foo', 'alg', 1)",
+        "INSERT INTO imp_benchmark_names VALUES (2, 'bar', 'alg', 2)",
+        "INSERT INTO imp_benchmark VALUES (1, 1, '2019-11-13', 1., 0.)",
+        "INSERT INTO imp_benchmark VALUES (2, 1, '2019-11-13', 2., 0.)"])
+    config = {'TOPDIR': str(tmpdir.join('public')),
+              'LAB_ONLY_TOPDIR': str(tmpdir.join('lab')),
+              'SHARED_LAB_ONLY_FETCH': True}
+    date = datetime.date(2019, 11, 13)
+
+    def get_db(lab_only):
+        return BuildDatabase(conn, config, date, lab_only, 'develop')
+
+    def check_views():
+        s = get_db(True).get_unit_summary()
+        assert sorted(s.all_units) == ['IMP.core', 'IMP.secret']
+        assert sorted(get_db(True).get_benchmark_results()) \
+            == [(1, 1), (2, 1)]
+        s = get_db(False).get_unit_summary()
+        assert s.all_units == ['IMP.core']
+        assert list(get_db(False).get_benchmark_results()) == [(1, 1)]
+    # Nothing is cached until both builds have finished
+    check_views()
+    assert len([q for q in conn.sql if 'imp_test_unit_result' in q]) == 2
+    for topdir in ('public', 'lab'):
+        d = tmpdir.join(topdir, 'develop', '20191113-abcdef', 'build')
+        d.ensure(dir=True)
+        with open(str(d.join('build_info.pck')), 'wb') as fh:
+            pickle.dump({'modules': []}, fh)
+    del conn.sql[:]
+    check_views()
+    check_views()
+    # Both views were made from a single query of each kind
+    assert len([q for q in conn.sql if 'imp_test_unit_result' in q]) == 1
+    assert len([q for q in conn.sql if 'imp_benchmark ' in q]) == 1
+    assert not any('lab_only=false' in q for q in conn.sql)
+
+
+def test_build_info_cache(tmpdir, monkeypatch):
+    """Test that build info is not cached until both builds have finished"""
+    monkeypatch.setattr(cache, '_caches', {})
+    config = {'TOPDIR': str(tmpdir.join('public')),
+              'LAB_ONLY_TOPDIR': str(tmpdir.join('lab'))}
+    date = datetime.date(2019, 11, 13)
+
+    def get_build_info():
+        return BuildDatabase(None, config, date, True,
+                             'develop').get_build_info()
+
+    def make_pickle(topdir, info):
+        d = tmpdir.join(topdir, 'develop', '20191113-abcdef', 'build')
+        d.ensure(dir=True)
+        with open(str(d.join('build_info.pck')), 'wb') as fh:
+            pickle.dump(info, fh)
+    make_pickle('public', {'modules': []})
+    assert get_build_info() == ({'modules': []}, None)
+    make_pickle('lab', {'modules': ['secret']})
+    assert get_build_info() == ({'modules': []}, {'modules': ['secret']})
+    # Now cached, so changes are not seen
+    make_pickle('lab', {'modules': []})
+    assert get_build_info() == ({'modules': []}, {'modules': ['secret']})
@@ -0,0 +1,129 @@
+import SocketServer
+import threading
+import time
+import utils
+
+utils.set_search_paths(__file__)
+from results.cache import LRUCache, SQLiteCache, MemcachedCache, get_cache
+from results.cache import MEMCACHED_MAX_TTL
+
+
+class _MemcachedHandler(SocketServer.StreamRequestHandler):
+    """Minimal stand-in for a memcached server"""
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.split()
+            if cmd[0] == 'get':
+                value = data.get(cmd[1])
+                if value is not None and (value[1] == 0
+                                          or value[1] > time.time()):
+                    self.wfile.write('VALUE %s 0 %d\r\n%s\r\n'
+                                     % (cmd[1], len(value[0]), value[0]))
+                self.wfile.write('END\r\n')
+            elif cmd[0] == 'set':
+                value = self.rfile.read(int(cmd[4]) + 2)[:-2]
+                exptime = int(cmd[3])
+                if 0 < exptime <= MEMCACHED_MAX_TTL or exptime < 0:
+                    exptime += time.time()
+                data[cmd[1]] = (value, exptime)
+                self.wfile.write('STORED\r\n')
+            elif cmd[0] == 'delete':
+                data.pop(cmd[1], None)
+                self.wfile.write('DELETED\r\n')
+
+
+class _MemcachedServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0),
+                                        _MemcachedHandler)
+        self.data = {}
+
+
+def _check_cache(c):
+    """Check basic operations that every cache should support"""
+    assert c.get(('foo', 1)) is None
+    c.set(('foo', 1), {'a': [1, 2]})
+    assert c.get(('foo', 1)) == {'a': [1, 2]}
+    c.delete(('foo', 1))
+    assert c.get(('foo', 1)) is None
+    # Namespaces are kept separate
+    c.namespace('develop', False).set('x', 'public')
+    c.namespace('develop', True).set('x', 'lab')
+    assert c.namespace('develop', False).get('x') == 'public'
+    assert c.namespace('develop').namespace(True).get('x') == 'lab'
+    # Expiry
+    c.set('ttl', 'value', ttl=-1)
+    assert c.get('ttl') is None
+
+
+def test_lru():
+    """Test the in-process cache"""
+    c = LRUCache(max_items=10)
+    _check_cache(c)
+    c = LRUCache(max_items=2)
+    c.set('a', 1)
+    c.set('b', 2)
+    c.get('a')
+    c.set('c', 3)
+    # 'b' is least recently used
+    assert (c.get('a'), c.get('b'), c.get('c')) == (1, None, 3)
+
+
+def test_sqlite(tmpdir):
+    """Test the on-disk cache"""
+    fname = str(tmpdir.join('test.sqlite'))
+    c = SQLiteCache(fname)
+    _check_cache(c)
+    # Other processes see the same data
+    c.set('shared', 42)
+    assert SQLiteCache(fname).get('shared') == 42
+    c = SQLiteCache(str(tmpdir.join('small.sqlite')), max_bytes=100)
+    c.set('a', 'x' * 40)
+    c.set('b', 'y' * 40)
+    c.get('a')
+    c.set('c', 'z' * 40)
+    assert c.get('a') == 'x' * 40
+    assert c.get('b') is None
+    assert c.get('c') == 'z' * 40
+
+
+def test_memcached():
+    """Test the memcached client"""
+    server = _MemcachedServer()
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    servers = ['127.0.0.1:%d' % server.server_address[1]]
+    try:
+        c = MemcachedCache(servers)
+        _check_cache(c)
+        # Long expiry times are sent as absolute times
+        c.set('long', 'value', ttl=60 * 86400)
+        assert c.get('long') == 'value'
+        exptime = server.data[c._get_key('long')][1]
+        assert abs(exptime - (time.time() + 60 * 86400)) < 10
+    finally:
+        server.shutdown()
+        server.server_close()
+    # A server that is down just means a cache miss
+    c = MemcachedCache(servers)
+    c.set('foo', 'bar')
+    assert c.get('foo') is None
+
+
+def test_get_cache(tmpdir):
+    """Test getting caches with the configured backend"""
+    assert isinstance(get_cache({}, 'pages'), LRUCache)
+    assert get_cache({}, 'pages') is get_cache({}, 'pages')
+    assert get_cache({}, 'pages') is not get_cache({}, 'data')
+    c = get_cache({'CACHE_BACKEND': 'sqlite', 'CACHE_DIR': str(tmpdir)},
+                  'data')
+    assert c.fname == str(tmpdir.join('data.sqlite'))
@@ -0,0 +1,109 @@
+import datetime
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results import cache, history
+from results.clusters import get_signature, get_failure_clusters
+from results.clusters import get_build_clusters
+from results.clusters import _get_summary
+from results.imp_build_utils import BuildDatabase
+
+TRACEBACK = """Traceback (most recent call last):
+  File "%s/IMP/core/test_foo.py", line %d, in test_foo
+    self.assertAlmostEqual(x, 1.0)
+AssertionError: %f != 1.0 within 7 places (object at 0x%x)
+"""
+
+SQL = [
+    "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+    "INSERT INTO imp_test_units VALUES (2, 'IMP.em', 0)",
+    "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+    "INSERT INTO imp_test_archs VALUES (2, 'mac10v4-intel')",
+    "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+    "INSERT INTO imp_test_names VALUES (2, 'test_bar.py', 2)",
+    "INSERT INTO imp_test_names VALUES (3, 'test_baz.py', 2)",
+    "INSERT INTO imp_test VALUES (1, 1, '2019-11-12', 'FAIL', 1., "
+    "'NEWFAIL', '%s')" % (TRACEBACK % ('/home/x/build', 12, 0.5, 0xdead)),
+    "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'FAIL', 1., "
+    "NULL, '%s')" % (TRACEBACK % ('/home/x/build', 14, 0.5, 0xbeef)),
+    "INSERT INTO imp_test VALUES (1, 2, '2019-11-13', 'FAIL', 1., "
+    "'NEWFAIL', '%s')" % (TRACEBACK % ('C:\\build', 14, 0.25, 0x1234)),
+    "INSERT INTO imp_test VALUES (2, 1, '2019-11-13', 'TIMEOUT', 1., "
+    "'NEWFAIL', 'Timed out')",
+    "INSERT INTO imp_test VALUES (3, 1, '2019-11-13', 'OK', 1., NULL, '')"]
+
+
+def test_signature():
+    """Test signatures of test output"""
+    sig = get_signature(TRACEBACK % ('/home/x/build', 12, 0.5, 0xdead))
+    assert sig == get_signature(TRACEBACK % ('/tmp/y', 99, 1.5, 0xbeef))
+    assert sig == get_signature(TRACEBACK % ('C:\\build', 12, 0.5, 0x1))
+    assert sig != get_signature('Timed out')
+    assert len(sig) == 12
+    assert get_signature(None) == get_signature('')
+    # Non-ASCII output, as bytes or unicode
+    sig = get_signature('\xe2\x80\x98foo\xe2\x80\x99 at line 3')
+    assert sig == get_signature(u'\u2018foo\u2019 at line 4')
+
+
+def test_summary():
+    """Test summaries of test output"""
+    assert _get_summary('Traceback\n  \n\xe2\x80\x98foo\xe2\x80\x99\n') \
+        == u'\u2018foo\u2019'
+    assert _get_summary(None) == u''
+
+
+def test_clusters(tmpdir, monkeypatch):
+    """Test grouping failures by signature"""
+    monkeypatch.setattr(history, '_indexes', {})
+    utils.make_build_dirs(str(tmpdir), ['20191112', '20191113'],
+                          build_info={})
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    db = BuildDatabase(conn, {'TOPDIR': str(tmpdir),
+                              'LAB_ONLY_TOPDIR': str(tmpdir)},
+                       datetime.date(2019, 11, 13), False, 'develop')
+    c1, c2 = get_failure_clusters(db)
+    assert len(c1.failures) == 2
+    assert c1.arch_names == ['mac10v4-intel', 'x86_64-intel8']
+    assert c1.units == ['IMP.core']
+    assert c1.summary.startswith('AssertionError: 0.')
+    # The failure on x86_64 started the day before
+    assert c1.first_seen == datetime.date(2019, 11, 12)
+    assert [f.test_name for f in c2.failures] == ['test_bar.py']
+    assert c2.first_seen == datetime.date(2019, 11, 13)
+    assert c2.summary == 'Timed out'
+
+
+def test_clusters_page(tmpdir, monkeypatch):
+    """Test the page showing failure clusters"""
+    utils.setup_app(results.app, tmpdir, monkeypatch, SQL,
+                    dates=['20191112', '20191113'], build_info={})
+    c = results.app.test_client()
+    rv = c.get('/clusters')
+    assert rv.status_code == 200
+    assert b'3 test failures, with 2 different' in rv.data
+    assert b'<a href="/?test=1&amp;plat=2">test_foo.py</a>' in rv.data
+    assert b'First seen</td><td>2019-11-12' in rv.data
+
+
+def test_clusters_unindexed(tmpdir, monkeypatch):
+    """Test clusters while the failure history is being built elsewhere"""
+    monkeypatch.setattr(history, '_indexes', {})
+    monkeypatch.setattr(cache, '_caches', {})
+    utils.make_build_dirs(str(tmpdir), ['20191112', '20191113'],
+                          build_info={})
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    config = {'TOPDIR': str(tmpdir), 'LAB_ONLY_TOPDIR': str(tmpdir)}
+    date = datetime.date(2019, 11, 13)
+    with history.get_failure_history('imp_test')._lock:
+        c1, c2 = get_build_clusters(conn, config, date, False, 'develop')
+    assert c1.first_seen is None
+    # Incomplete clusters are not cached
+    c1, c2 = get_build_clusters(conn, config, date, False, 'develop')
+    assert c1.first_seen == datetime.date(2019, 11, 12)
+    # Builds after the last one are not indexed
+    get_build_clusters(conn, config, datetime.date(2999, 1, 1), False,
+                       'develop')
+    assert history.get_failure_history('imp_test')._upto == date
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+import utils
+
+utils.set_search_paths(__file__)
+from results import coalesce as coalesce_module
+from results.coalesce import SingleFlight, FileSingleFlight, coalesce
+
+
+def _run_concurrently(do, nthreads=4):
+    """Call do(func) from several threads at once, and return the results
+       and the number of times func was actually called"""
+    calls = []
+    results = []
+
+    def func():
+        calls.append(None)
+        # Give the other threads time to arrive
+        time.sleep(0.2)
+        return 'result'
+
+    def worker():
+        results.append(do(func))
+    threads = [threading.Thread(target=worker) for _ in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, len(calls)
+
+
+def test_single_flight():
+    """Test coalescing calls within a process"""
+    s = SingleFlight()
+    results, ncalls = _run_concurrently(lambda func: s.do('key', func))
+    assert results == ['result'] * 4
+    assert ncalls == 1
+    # Once the call is done, the next one computes afresh
+    assert s.do('key', lambda: 'new') == 'new'
+
+
+def test_single_flight_exception():
+    """Test that exceptions are raised in every waiting caller"""
+    s = SingleFlight()
+
+    def func():
+        time.sleep(0.2)
+        raise ValueError("failed")
+    errors = []
+
+    def worker():
+        try:
+            s.do('key', func)
+        except ValueError:
+            errors.append(None)
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 3
+
+
+def test_file_single_flight(tmpdir):
+    """Test coalescing calls using lock files"""
+    # Each call opens its own lock file, so this behaves like separate
+    # processes even though threads are used
+    s = FileSingleFlight(str(tmpdir))
+    results, ncalls = _run_concurrently(lambda func: s.do('key', func))
+    assert results == ['result'] * 4
+    assert ncalls == 1
+    # A later call does not reuse the old result
+    assert s.do('key', lambda: 'new') == 'new'
+    config = {'COALESCE_DIR': str(tmpdir)}
+    results, ncalls = _run_concurrently(
+        lambda func: coalesce(config, 'key2', func))
+    assert results == ['result'] * 4
+    assert ncalls == 1
+
+
+def test_lock_files(tmpdir, monkeypatch):
+    """Test that the number of lock files is bounded"""
+    monkeypatch.setattr(coalesce_module, 'LOCK_FILES', 2)
+    s = FileSingleFlight(str(tmpdir))
+    for i in range(10):
+        assert s.do(i, lambda: i) == i
+    assert len([f for f in os.listdir(str(tmpdir))
+                if f.endswith('.lock')]) <= 2
@@ -0,0 +1,140 @@
+import datetime
+import json
+import os
+import utils
+
+utils.set_search_paths(__file__)
+import results
+from results import commits
+from results.imp_build_utils import BuildDatabase
+
+LOGS = {
+    ('develop', '20191111'): [('abcdef1234567', 'Me', 'me@example.com',
+                               'Fix #42 and salilab/rmf#7')],
+    ('develop', '20191112'): [('1234abcd99999', 'You', 'you@example.com',
+                               'Add feature, see #42'),
+                              ('abce000000000', 'Me', 'me@example.com',
+                               'Tidy up')],
+    ('master', '20191112'): [('abcdef1234567', 'Me', 'me@example.com',
+                              'Fix #42 and salilab/rmf#7')]}
+
+
+def _make_builds(topdir):
+    for branch, dates in (('develop', ['20191110', '20191111', '20191112']),
+                          ('master', ['20191112'])):
+        bdir = utils.make_build_dirs(topdir, dates, branch=branch)
+        for date in dates:
+            build = os.path.join(bdir, date + '-abcdef', 'build')
+            with open(os.path.join(build, 'build_info.pck'), 'w'):
+                pass
+            with open(os.path.join(build, 'imp-gitlog'), 'w') as fh:
+                for log in LOGS.get((branch, date), []):
+                    fh.write('\0'.join(log) + '\n')
+
+
+def _sync(topdir, index, branch, day):
+    config = {'TOPDIR': topdir, 'LAB_ONLY_TOPDIR': topdir}
+    index.sync(BuildDatabase(None, config, datetime.date(2019, 11, day),
+                             False, branch))
+
+
+def _lookup(index, query):
+    kind, found = index.lookup(query)
+    return kind, [(c.githash, c.branch, c.date.day) for c in found]
+
+
+def test_index(tmpdir):
+    """Test building and querying the commit index"""
+    topdir = str(tmpdir)
+    _make_builds(topdir)
+    index = commits.CommitIndex(str(tmpdir.join('index')),
+                                ['develop', 'master'])
+    _sync(topdir, index, 'develop', 12)
+    _sync(topdir, index, 'master', 12)
+    assert _lookup(index, 'ABCDEF') \
+        == ('commit', [('abcdef1234567', 'master', 12),
+                       ('abcdef1234567', 'develop', 11)])
+    assert _lookup(index, 'abc')[1] == []
+    assert _lookup(index, '#42') \
+        == ('issue', [('abcdef1234567', 'master', 12),
+                      ('1234abcd99999', 'develop', 12),
+                      ('abcdef1234567', 'develop', 11)])
+    # Issues in other repositories are not included
+    assert _lookup(index, '#7')[1] == []
+    assert _lookup(index, 'you')[1] == [('1234abcd99999', 'develop', 12)]
+    assert _lookup(index, 'Me@example.com')[1] \
+        == [('abcdef1234567', 'master', 12), ('abce000000000', 'develop', 12),
+            ('abcdef1234567', 'develop', 11)]
+    assert _lookup(index, '')[1] == []
+
+
+def test_incremental(tmpdir):
+    """Test adding new builds to the commit index"""
+    topdir = str(tmpdir)
+    _make_builds(topdir)
+    os.unlink(os.path.join(topdir, 'develop', '20191112-abcdef', 'build',
+                           'build_info.pck'))
+    indexdir = str(tmpdir.join('index'))
+    index = commits.CommitIndex(indexdir, ['develop'])
+    _sync(topdir, index, 'develop', 12)
+    # Unfinished builds are not indexed
+    assert index.get_last_date('develop') == datetime.date(2019, 11, 11)
+    assert _lookup(index, '#42')[1] == [('abcdef1234567', 'develop', 11)]
+    with open(os.path.join(topdir, 'develop', '20191112-abcdef', 'build',
+                           'build_info.pck'), 'w'):
+        pass
+    # A separate writer (e.g. the sync command) appends the new build,
+    # which is then read by the existing index
+    _sync(topdir, commits.CommitIndex(indexdir, ['develop']), 'develop', 12)
+    assert index.get_last_date('develop') == datetime.date(2019, 11, 12)
+    assert len(_lookup(index, '#42')[1]) == 2
+    # Syncing again adds nothing
+    size = os.stat(commits.get_index_path(indexdir, 'develop')).st_size
+    _sync(topdir, index, 'develop', 12)
+    assert os.stat(commits.get_index_path(indexdir, 'develop')).st_size \
+        == size
+
+
+def test_pages(tmpdir, monkeypatch):
+    """Test the commit lookup page and API"""
+    topdir = str(tmpdir)
+    _make_builds(topdir)
+    indexdir = str(tmpdir.join('index'))
+    index = commits.CommitIndex(indexdir, ['develop', 'master'])
+    _sync(topdir, index, 'develop', 12)
+    _sync(topdir, index, 'master', 12)
+    utils.configure_app(results.app, topdir)
+    monkeypatch.setattr(commits, '_indexes', {})
+    c = results.app.test_client()
+    rv = c.get('/commits.json?q=abcdef1')
+    assert rv.status_code == 404
+    results.app.config['COMMIT_INDEX_DIR'] = indexdir
+    try:
+        rv = c.get('/commits.json?q=abcdef1')
+        d = json.loads(rv.data)
+        assert d['kind'] == 'commit'
+        assert [(r['branch'], r['date']) for r in d['results']] \
+            == [('master', '2019-11-12'), ('develop', '2019-11-11')]
+        assert d['results'][0]['build_url'] \
+            == '/?p=build&date=20191112&branch=master'
+        rv = c.get('/commits?q=%2342')
+        assert rv.status_code == 200
+        assert b'Add feature, see #42' in rv.data
+        assert b'href="/?p=build&amp;date=20191111">2019-11-11</a>' \
+            in rv.data
+        rv = c.get('/commits?q=nobody')
+        assert b'No builds include commits matching' in rv.data
+    finally:
+        del results.app.config['COMMIT_INDEX_DIR']
+
+
+def test_aborted_build(tmpdir):
+    """Test that an aborted build does not stop later builds being indexed"""
+    topdir = str(tmpdir)
+    _make_builds(topdir)
+    os.unlink(os.path.join(topdir, 'develop', '20191111-abcdef', 'build',
+                           'build_info.pck'))
+    index = commits.CommitIndex(str(tmpdir.join('index')), ['develop'])
+    _sync(topdir, index, 'develop', 12)
+    assert index.get_last_date('develop') == datetime.date(2019, 11, 12)
+    assert _lookup(index, '#42')[1] == [('1234abcd99999', 'develop', 12)]
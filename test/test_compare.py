@@ -0,0 +1,107 @@
+import datetime
+import os
+import pickle
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results import cache
+from results.compare import diff_test_dicts, diff_benchmarks
+from results.compare import get_build_comparison
+
+
+def test_diff_test_dicts():
+    """Test comparison of the states of two days' tests"""
+    old = {(1, 1): 'OK', (2, 1): 'FAIL', (3, 1): 'FAIL', (4, 1): 'OK',
+           (5, 1): 'OK'}
+    new = {(1, 1): 'FAIL', (2, 1): 'SKIP', (3, 1): 'TIMEOUT', (4, 1): 'OK',
+           (6, 1): 'OK'}
+    assert diff_test_dicts(old, new) == {
+        (1, 1): ('NEWFAIL', 'OK', 'FAIL'),
+        (2, 1): ('NEWOK', 'FAIL', 'SKIP'),
+        (3, 1): ('CHANGED', 'FAIL', 'TIMEOUT'),
+        (5, 1): ('REMOVED', 'OK', None),
+        (6, 1): ('ADDED', None, 'OK')}
+
+
+def test_diff_benchmarks():
+    """Test comparison of two days' benchmark runtimes"""
+    def row(runtime):
+        return {'runtime': runtime, 'unit_name': 'IMP.core',
+                'bench_name': 'b', 'algorithm': 'a', 'file_id': 1}
+    old = {(1, 1): row(10.), (2, 1): row(10.), (3, 1): row(10.),
+           (4, 1): row(0.)}
+    new = {(1, 1): row(10.5), (2, 1): row(20.), (3, 1): row(5.),
+           (4, 1): row(5.), (5, 1): row(5.)}
+    changes = diff_benchmarks(old, new)
+    assert [c.ratio for c in changes] == [2.0, 0.5]
+
+
+def test_compare_page(tmpdir):
+    """Test the build comparison page"""
+    topdir = str(tmpdir)
+    utils.make_build_dirs(topdir, ['20191110', '20191111', '20191112'])
+    with open(str(tmpdir.join('develop', '20191112-abcdef', 'build',
+                              'imp-gitlog')), 'w') as fh:
+        fh.write('abcdef1234567\0Me\0me@example.com\0Fix #42\n')
+    utils.configure_app(results.app, topdir, [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+        "INSERT INTO imp_test_names VALUES (2, 'test_secret.py', 2)",
+        "INSERT INTO imp_test VALUES (1, 1, '2019-11-10', 'OK', 1., "
+        "NULL, NULL)",
+        "INSERT INTO imp_test VALUES (1, 1, '2019-11-12', 'FAIL', 1., "
+        "'NEWFAIL', NULL)",
+        "INSERT INTO imp_test VALUES (2, 1, '2019-11-10', 'OK', 1., "
+        "NULL, NULL)",
+        "INSERT INTO imp_test VALUES (2, 1, '2019-11-12', 'FAIL', 1., "
+        "'NEWFAIL', NULL)"])
+    c = results.app.test_client()
+    rv = c.get('/compare?since=20191110')
+    assert rv.status_code == 200
+    assert b'1 tests newly failed' in rv.data
+    assert b'test_foo.py' in rv.data
+    # Lab-only tests are not shown
+    assert b'test_secret.py' not in rv.data
+    assert b'/issues/42' in rv.data
+    # The build to compare against must be given, and must exist
+    assert c.get('/compare').status_code == 400
+    assert c.get('/compare?since=2019').status_code == 400
+    assert c.get('/compare?since_version=9.9.9').status_code == 400
+
+
+def test_build_comparison(tmpdir, monkeypatch):
+    """Test comparing builds, and caching only finished comparisons"""
+    monkeypatch.setattr(cache, '_caches', {})
+    topdir = str(tmpdir)
+    bdir = utils.make_build_dirs(topdir, ['20191110', '20191112'])
+    config = {'TOPDIR': topdir, 'LAB_ONLY_TOPDIR': topdir}
+    conn = MySQLdb.connect(utils.SCHEMA + [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.old', 0)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-10', 1, 1, "
+        "'OK', 1)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-10', 2, 1, "
+        "'TEST', 1)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-12', 1, 1, "
+        "'BUILD', 1)"])
+    since, date = datetime.date(2019, 11, 10), datetime.date(2019, 11, 12)
+    comp = get_build_comparison(conn, config, since, date, False, 'develop')
+    # Components no longer built are included
+    assert sorted((u.unit_name, u.unit_id, u.old_state, u.new_state)
+                  for u in comp.units) == [('IMP.core', 1, 'OK', 'BUILD'),
+                                           ('IMP.old', 2, 'TEST', None)]
+    # Builds in progress are not cached
+    assert get_build_comparison(conn, config, since, date, False,
+                                'develop') is not comp
+    for d in ('20191110', '20191112'):
+        with open(os.path.join(bdir, d + '-abcdef', 'build',
+                               'build_info.pck'), 'wb') as fh:
+            pickle.dump({}, fh)
+    comp = get_build_comparison(conn, config, since, date, False, 'develop')
+    assert get_build_comparison(conn, config, since, date, False,
+                                'develop') is comp
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import datetime
+import zlib
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results import details
+from results.imp_build_utils import BuildDatabase
+from results.snapshot import export_snapshot
+
+DATE = datetime.date(2019, 11, 13)
+
+TRACEBACK = u'Traceback (most recent call last):\nAssertionError: é'
+
+SQL = [
+    "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+    "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+    "INSERT INTO imp_test_archs VALUES (2, 'mac10v4-intel')",
+    "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+    "INSERT INTO imp_test_names VALUES (2, 'test_bar.py', 1)",
+    u"INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'FAIL', 1., "
+    u"'NEWFAIL', '%s')" % TRACEBACK,
+    u"INSERT INTO imp_test VALUES (1, 2, '2019-11-13', 'FAIL', 1., "
+    u"'NEWFAIL', '%s')" % TRACEBACK,
+    "INSERT INTO imp_test VALUES (2, 1, '2019-11-13', 'FAIL', 1., "
+    "'NEWFAIL', 'Timed out')",
+    "INSERT INTO imp_test VALUES (2, 2, '2019-11-13', 'OK', 1., NULL, '')"]
+
+
+def _migrate(conn, monkeypatch):
+    monkeypatch.setattr(details, '_details', details.LRUCache(10))
+    return details.migrate(conn, 'imp_test', batch_size=2)
+
+
+def test_migrate(monkeypatch):
+    """Test moving test output into deduplicated storage"""
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    assert _migrate(conn, monkeypatch) == 3
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM imp_test_detail')
+    # The two identical outputs are stored only once
+    assert c.fetchone()[0] == 2
+    c.execute('SELECT detail FROM imp_test ORDER BY name, arch')
+    rows = [r[0] for r in c.fetchall()]
+    assert rows[:3] == [details.get_reference(TRACEBACK)] * 2 \
+        + [details.get_reference('Timed out')]
+    assert len(rows[0]) == 45
+    assert rows[3] == ''
+    # Each batch continues from the last row of the previous one
+    assert 'date>' in [q for q in conn.sql if 'NOT LIKE' in q][-1]
+    # Migrating again does nothing
+    assert details.migrate(conn, 'imp_test') == 0
+
+
+def test_read_path(monkeypatch):
+    """Test that BuildDatabase returns the text of migrated output"""
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    _migrate(conn, monkeypatch)
+    db = BuildDatabase(conn, {'TOPDIR': '/', 'LAB_ONLY_TOPDIR': '/'},
+                       DATE, False, 'develop')
+    # Output is returned as UTF-8 bytes, as MySQLdb does
+    traceback = TRACEBACK.encode('utf-8')
+    assert db.get_test_details([(1, 1), (2, 1), (2, 2)]) \
+        == {(1, 1): traceback, (2, 1): 'Timed out'}
+    rows = db.query_tests(['name', 'arch', 'detail'], failed=True,
+                          order_by=('name', 'arch')).fetchall()
+    assert [r['detail'] for r in rows] \
+        == [traceback, traceback, 'Timed out']
+    assert all(isinstance(r['detail'], bytes) for r in rows)
+    # Outputs are now in memory, so are not fetched again
+    del conn.sql[:]
+    assert db.get_test_details([(1, 2)]) == {(1, 2): traceback}
+    assert not any('imp_test_detail' in sql for sql in conn.sql)
+
+
+def test_snapshot(tmpdir, monkeypatch):
+    """Test that snapshots include deduplicated output"""
+    config = {'TOPDIR': str(tmpdir), 'LAB_ONLY_TOPDIR': str(tmpdir),
+              'SNAPSHOT_DIR': str(tmpdir.join('snapshots')),
+              'DETAIL_STORE': True}
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    _migrate(conn, monkeypatch)
+    export_snapshot(BuildDatabase(conn, config, DATE, True, 'develop'))
+    monkeypatch.setattr(details, '_details', details.LRUCache(10))
+    db = BuildDatabase(conn, config, DATE, False, 'develop')
+    assert db.build_conn is not conn
+    assert db.get_test_details([(1, 1)]) \
+        == {(1, 1): TRACEBACK.encode('utf-8')}
+
+
+def test_detail_page(tmpdir, monkeypatch):
+    """Test showing migrated output"""
+    utils.setup_app(results.app, tmpdir, monkeypatch, SQL)
+    monkeypatch.setattr(details, '_details', details.LRUCache(10))
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    details.migrate(conn, 'imp_test')
+    monkeypatch.setattr(MySQLdb, 'connect', lambda *args, **keys: conn)
+    c = results.app.test_client()
+    rv = c.get('/detail/2/1')
+    assert rv.data == b'Timed out'
+
+
+def test_more_than_cached(monkeypatch):
+    """Test resolving more outputs than are kept in memory"""
+    monkeypatch.setattr(details, '_details', details.LRUCache(2))
+    conn = MySQLdb.connect(utils.SCHEMA)
+    outputs = ['output %d' % i for i in range(5)]
+    c = conn.cursor()
+    for text in outputs:
+        c.execute('INSERT INTO imp_test_detail (hash, body) VALUES (%s, %s)',
+                  (details.get_reference(text)[len(details.REFERENCE_PREFIX):],
+                   MySQLdb.Binary(zlib.compress(text))))
+    refs = dict((i, details.get_reference(t)) for i, t in enumerate(outputs))
+    assert details.resolve(conn, refs) == dict(enumerate(outputs))
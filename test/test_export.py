@@ -0,0 +1,115 @@
+import datetime
+import gzip
+import json
+from StringIO import StringIO
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results import cache, export
+from results.imp_build_utils import BuildDatabase
+
+SQL = [
+    "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+    "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+    "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+    "INSERT INTO imp_test_archs VALUES (2, 'mac10v4-intel')",
+    "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+    "INSERT INTO imp_test_names VALUES (2, 'test_secret.py', 2)",
+    "INSERT INTO imp_test VALUES (1, 1, '2019-11-12', 'OK', 1., NULL, '')",
+    "INSERT INTO imp_test VALUES (1, 2, '2019-11-12', 'FAIL', 2., "
+    "'NEWFAIL', 'Traceback')",
+    "INSERT INTO imp_test VALUES (2, 1, '2019-11-12', 'OK', 3., NULL, '')",
+    "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'OK', 4., NULL, '')",
+    "INSERT INTO imp_benchmark_files VALUES (1, 'bench_foo.py', 1)",
+    "INSERT INTO imp_benchmark_names VALUES (1, 'foo', 'alg', 1)",
+    "INSERT INTO imp_benchmark VALUES (1, 2, '2019-11-13', 5., 0.5)"]
+
+
+def _d(day):
+    return datetime.date(2019, 11, day)
+
+
+def _get_rows(conn, kind, since, until, lab_only=False, **kwargs):
+    config = {'TOPDIR': '/', 'LAB_ONLY_TOPDIR': '/'}
+    db = BuildDatabase(conn, config, None, lab_only, 'develop')
+    return export.get_rows(db, kind, since, until, **kwargs)
+
+
+def test_get_rows(monkeypatch):
+    """Test getting rows to export"""
+    monkeypatch.setattr(cache, '_caches', {})
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    columns, rows = _get_rows(conn, 'tests', _d(12), _d(13), lab_only=True)
+    assert columns == export.TEST_COLUMNS
+    rows = list(rows)
+    assert len(rows) == 4
+    assert rows[1] == (_d(12), 'test_foo.py', 'IMP.core', 'mac10v4-intel',
+                       'FAIL', 2., 'NEWFAIL')
+    # Names come from the lookup, not joins
+    assert all('imp_test_names' not in q for q in conn.sql[-1:])
+    _, rows = _get_rows(conn, 'tests', _d(12), _d(12), arch=1)
+    assert [r[1] for r in rows] == ['test_foo.py']
+    # Components are selected by the query
+    _, rows = _get_rows(conn, 'tests', _d(12), _d(13), unit=2, lab_only=True)
+    assert [r[1] for r in rows] == ['test_secret.py']
+    assert 'name IN (' in conn.sql[-1]
+    _, rows = _get_rows(conn, 'tests', _d(12), _d(13), unit=2)
+    assert list(rows) == []
+    _, rows = _get_rows(conn, 'benchmarks', _d(1), _d(30))
+    assert list(rows) == [(_d(13), 'foo', 'alg', 'bench_foo.py', 'IMP.core',
+                           'mac10v4-intel', 5., 0.5)]
+
+
+def test_new_names(monkeypatch):
+    """Test that names added after the lookup was made are found"""
+    monkeypatch.setattr(cache, '_caches', {})
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    export.get_names(conn, {})
+    c = conn.cursor()
+    c.execute("INSERT INTO imp_test_names VALUES (3, 'test_new.py', 1)")
+    c.execute("INSERT INTO imp_test VALUES (3, 1, '2019-11-13', 'OK', 1., "
+              "NULL, '')")
+    _, rows = _get_rows(conn, 'tests', _d(13), _d(13))
+    assert next(rows)[1] == 'test_foo.py'
+    # Names are reloaded before reading from the (unbuffered) cursor starts
+    assert conn.sql[-1].startswith('SELECT date, name')
+    assert [r[1] for r in rows] == ['test_new.py']
+
+
+def test_format_rows(monkeypatch):
+    """Test formatting and compressing rows"""
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 2)
+    columns = ('date', 'name', 'runtime')
+    rows = [(_d(12), 'foo', 1.5), (_d(13), 'bar, baz', None), (_d(14), 'x', 2.)]
+    chunks = list(export.format_rows(columns, iter(rows), 'csv'))
+    assert len(chunks) == 2
+    assert ''.join(chunks) == ('date,name,runtime\r\n2019-11-12,foo,1.5\r\n'
+                               '2019-11-13,"bar, baz",\r\n2019-11-14,x,2.0\r\n')
+    out = ''.join(export.format_rows(columns, iter(rows), 'ndjson'))
+    lines = [json.loads(x) for x in out.splitlines()]
+    assert lines[1] == {'date': '2019-11-13', 'name': 'bar, baz',
+                        'runtime': None}
+    gz = ''.join(export.gzip_chunks(export.format_rows(columns, iter(rows),
+                                                       'ndjson')))
+    assert gzip.GzipFile(fileobj=StringIO(gz)).read() == out
+
+
+def test_export_page(tmpdir, monkeypatch):
+    """Test exporting through the web application"""
+    utils.setup_app(results.app, tmpdir, monkeypatch, SQL)
+    c = results.app.test_client()
+    rv = c.get('/export/tests.ndjson?since=20191112&until=20191113',
+               headers={'Accept-Encoding': 'gzip'})
+    assert rv.status_code == 200
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    out = gzip.GzipFile(fileobj=StringIO(rv.data)).read()
+    # Lab-only components are not shown to the public
+    assert [json.loads(x)['test'] for x in out.splitlines()] \
+        == ['test_foo.py'] * 3
+    rv = c.get('/export/benchmarks.csv')
+    assert 'Content-Encoding' not in rv.headers
+    assert rv.data.splitlines()[1].startswith('2019-11-13,foo,alg,')
+    assert c.get('/export/foo.csv').status_code == 404
+    assert c.get('/export/tests.xml').status_code == 404
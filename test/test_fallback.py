@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results import fallback
+
+
+def _setup(tmpdir, monkeypatch):
+    utils.setup_app(results.app, tmpdir, monkeypatch, [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+        "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'FAIL', 1., "
+        "'NEWFAIL', 'Traceback: foo')"])
+
+
+def _database_down():
+    raise MySQLdb.OperationalError("Can't connect to MySQL server")
+
+
+def test_outage(tmpdir, monkeypatch):
+    """Test showing kept pages when the database is down"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/failures')
+    assert rv.status_code == 200
+    assert b'class="stale"' not in rv.data
+    monkeypatch.setattr(results, '_connect_db', _database_down)
+    rv = c.get('/failures')
+    assert rv.status_code == 200
+    assert b'test_foo.py' in rv.data
+    assert b'database is currently unavailable' in rv.data
+    assert rv.headers['Warning'] == '110 - "Response is Stale"'
+    # Pages not seen before cannot be shown
+    assert c.get('/long').status_code == 500
+    # Pages that are too old are not shown
+    results.app.config['MAX_STALENESS'] = 0
+    try:
+        time.sleep(0.01)
+        assert c.get('/failures').status_code == 500
+    finally:
+        del results.app.config['MAX_STALENESS']
+
+
+def test_stale_while_revalidate(tmpdir, monkeypatch):
+    """Test showing kept pages while they are refreshed"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    results.app.config['STALE_AFTER'] = 60
+    try:
+        c.get('/failures')
+        # A fresh copy is shown without a notice
+        monkeypatch.setattr(results, '_connect_db', _database_down)
+        rv = c.get('/failures')
+        assert b'test_foo.py' in rv.data
+        assert b'class="stale"' not in rv.data
+        results.app.config['STALE_AFTER'] = 0
+        time.sleep(0.01)
+        rv = c.get('/failures')
+        assert b'This page is being updated' in rv.data
+    finally:
+        del results.app.config['STALE_AFTER']
+
+
+def test_single_refresh(tmpdir, monkeypatch):
+    """Test that a stale page is only refreshed once at a time"""
+    _setup(tmpdir, monkeypatch)
+    started = []
+
+    class MockThread(object):
+        def __init__(self, target):
+            self.daemon = False
+
+        def start(self):
+            started.append(self)
+    monkeypatch.setattr(fallback, '_refreshing', set())
+    monkeypatch.setattr(fallback.threading, 'Thread', MockThread)
+    c = results.app.test_client()
+    results.app.config['STALE_AFTER'] = 0
+    try:
+        c.get('/failures')
+        time.sleep(0.01)
+        for i in range(2):
+            rv = c.get('/failures')
+            assert b'This page is being updated' in rv.data
+        assert len(started) == 1
+    finally:
+        del results.app.config['STALE_AFTER']
+
+
+def test_new_build(tmpdir, monkeypatch):
+    """Test that pages kept for one build are not shown for the next"""
+    _setup(tmpdir, monkeypatch)
+    # (results.build_calendar is hidden by the view function of that name)
+    monkeypatch.setattr(sys.modules['results.build_calendar'],
+                        'CHECK_INTERVAL', 0)
+    c = results.app.test_client()
+    results.app.config['STALE_AFTER'] = 60
+    try:
+        rv = c.get('/failures')
+        assert b'2019-11-13' in rv.data
+        bdir = str(tmpdir.join('develop'))
+        os.makedirs(os.path.join(bdir, '20191114-abcdef', 'build'))
+        os.unlink(os.path.join(bdir, 'lastbuild'))
+        os.symlink(os.path.join(bdir, '20191114-abcdef'),
+                   os.path.join(bdir, 'lastbuild'))
+        rv = c.get('/failures')
+        assert b'2019-11-14' in rv.data
+        assert b'class="stale"' not in rv.data
+    finally:
+        del results.app.config['STALE_AFTER']
@@ -0,0 +1,50 @@
+import utils
+
+utils.set_search_paths(__file__)
+import results
+
+
+def test_print_fragment(tmpdir, monkeypatch, capsys):
+    """Test caching of page fragments"""
+    utils.setup_app(results.app, tmpdir, monkeypatch)
+    calls = []
+
+    def fragment(out, arg):
+        calls.append(arg)
+        # Output from elsewhere (e.g. other threads) is not captured
+        print("<p>other</p>")
+        out.write("<p>%s</p>\n" % arg)
+    with results.app.test_request_context('/?date=20191113'):
+        p = results.index.TestPage(results.get_db(), results.app.config)
+        p.print_fragment(('foo',), fragment, 'bar')
+        p.print_fragment(('foo',), fragment, 'baz')
+        p.print_fragment(('other',), fragment, 'baz')
+    assert calls == ['bar', 'baz']
+    assert capsys.readouterr()[0] == '<p>other</p>\n<p>bar</p>\n' \
+        '<p>bar</p>\n<p>other</p>\n<p>baz</p>\n'
+
+
+def test_shared_navigation(tmpdir, monkeypatch, capsys):
+    """Test sharing navigation between public and lab-only pages"""
+    utils.setup_app(results.app, tmpdir, monkeypatch)
+    calls = []
+    display_branch_link = results.index.TestPage.display_branch_link
+
+    def counting_branch_link(self, out):
+        calls.append(self.lab_only)
+        display_branch_link(self, out)
+    monkeypatch.setattr(results.index.TestPage, 'display_branch_link',
+                        counting_branch_link)
+    outs = []
+    for lab_only in (False, True):
+        if lab_only:
+            monkeypatch.setenv('HTTPS', 'on')
+            monkeypatch.setenv('REMOTE_USER', 'foo')
+        with results.app.test_request_context('/?date=20191113'):
+            p = results.index.TestPage(results.get_db(), results.app.config)
+            assert p.lab_only == lab_only
+            p.display_navigation()
+        outs.append(capsys.readouterr()[0])
+    assert calls == [False]
+    assert 'id="branchlist"' in outs[1]
+    assert outs[0] != outs[1]
@@ -0,0 +1,83 @@
+import datetime
+import gzip
+import os
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results import index
+from results.freeze import freeze, get_build_dir, get_build_pages
+from results.imp_build_utils import BuildDatabase
+
+SQL = [
+    "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+    "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+    "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+    "INSERT INTO imp_test_archs VALUES (2, 'unknown-platform')",
+    "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+    "INSERT INTO imp_test_names VALUES (2, 'test_secret.py', 2)",
+    "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'FAIL', 1., "
+    "'NEWFAIL', 'Traceback: foo')",
+    "INSERT INTO imp_test VALUES (2, 1, '2019-11-13', 'FAIL', 1., "
+    "NULL, 'Traceback: secret')",
+    "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 1, 1, 'TEST', 1)",
+    "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 2, 2, 'TEST', 1)",
+    "INSERT INTO imp_test_reporev VALUES ('2019-11-13', 'abc', NULL)"]
+DATE = datetime.date(2019, 11, 13)
+
+
+def test_get_build_pages(tmpdir):
+    """Test the list of pages to freeze for a build"""
+    config = {'TOPDIR': str(tmpdir), 'LAB_ONLY_TOPDIR': str(tmpdir)}
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    db = BuildDatabase(conn, config, DATE, False, 'develop')
+    args = '?date=20191113&branch=develop'
+    assert get_build_pages(db) == [
+        ('failures.html', '/failures' + args), ('long.html', '/long' + args),
+        ('component/1.html', '/component/1' + args),
+        ('platform/1.html', '/platform/1' + args),
+        ('detail/1/1.txt', '/detail/1/1' + args)]
+    db = BuildDatabase(conn, config, DATE, True, 'develop')
+    pages = [p[0] for p in get_build_pages(db)]
+    assert 'component/2.html' in pages
+    assert 'detail/2/1.txt' in pages
+
+
+def test_freeze(tmpdir, monkeypatch):
+    """Test freezing a build, and only rerendering it when it changes"""
+    # Lists longer than a page are frozen whole
+    monkeypatch.setattr(index, 'PAGE_SIZE', 1)
+    topdir = str(tmpdir.join('builds'))
+    utils.make_build_dirs(topdir, ['20191113'])
+    utils.configure_app(results.app, topdir, SQL)
+    config = dict(results.app.config)
+    config['FREEZE_DIR'] = str(tmpdir.join('frozen'))
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    assert freeze(conn, config, 'develop', [DATE], processes=2) == 2
+    public = get_build_dir(config, 'develop', DATE, False)
+    lab = get_build_dir(config, 'develop', DATE, True)
+    with open(os.path.join(public, 'component', '1.html')) as fh:
+        assert 'test_foo.py' in fh.read()
+    with gzip.open(os.path.join(public, 'failures.html.gz')) as fh:
+        page = fh.read()
+        assert 'test_foo.py' in page
+        assert 'test_secret.py' not in page
+    with open(os.path.join(lab, 'failures.html')) as fh:
+        page = fh.read()
+        assert 'test_secret.py' in page
+        assert 'test_foo.py' in page
+        assert 'after=' not in page
+    with open(os.path.join(lab, 'detail', '2', '1.txt')) as fh:
+        assert fh.read() == 'Traceback: secret'
+    assert not os.path.exists(os.path.join(public, 'component', '2.html'))
+    # Nothing has changed, so nothing should be rerendered
+    assert freeze(conn, config, 'develop', [DATE], processes=2) == 0
+    conn.db.execute("INSERT INTO imp_test VALUES (1, 2, '2019-11-13', "
+                    "'OK', 1., NULL, '')")
+    assert freeze(conn, config, 'develop', [DATE], processes=2) == 2
+    # A change in state, with the same number of tests, is also detected
+    conn.db.execute("UPDATE imp_test SET state='OK' WHERE name=1 AND arch=1")
+    assert freeze(conn, config, 'develop', [DATE], processes=2) == 2
+    # Only the frozen builds remain, with no temporary directories
+    assert sorted(os.listdir(os.path.dirname(public))) == ['20191113']
@@ -0,0 +1,110 @@
+import datetime
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+from results.history import FailureHistory
+
+
+def _d(day):
+    return datetime.date(2019, 11, day)
+
+
+def test_previous_dates():
+    """Test finding previous passes and failures from the history index"""
+    h = FailureHistory()
+    h.add_rows([(1, 2, 'OK', _d(1)), (1, 2, 'FAIL', _d(2)),
+                (1, 2, 'TIMEOUT', _d(3)), (1, 2, 'SKIP', _d(4)),
+                (1, 2, 'OK', _d(5)), (1, 2, 'FAIL', _d(6))])
+    assert h.last_date == _d(6)
+    # Passing tests: last failure
+    assert h.get_previous_date(1, 2, _d(1), False) is None
+    assert h.get_previous_date(1, 2, _d(5), False) == _d(3)
+    # Failing tests: last success
+    assert h.get_previous_date(1, 2, _d(3), True) == _d(1)
+    assert h.get_previous_date(1, 2, _d(6), True) == _d(5)
+    # Tests that never failed, or never passed
+    assert h.get_previous_date(9, 2, _d(6), False) is None
+    h.add_rows([(3, 2, 'FAIL', _d(7))])
+    assert h.get_previous_date(3, 2, _d(7), True) is None
+    # Cases the index cannot answer
+    for args in ((1, 2, _d(5), True), (1, 2, _d(3), False)):
+        try:
+            h.get_previous_date(*args)
+            assert False, "KeyError not raised"
+        except KeyError:
+            pass
+
+
+def test_failure_start():
+    """Test finding when a run of failures started"""
+    h = FailureHistory()
+    h.add_rows([(1, 2, 'OK', _d(1)), (1, 2, 'FAIL', _d(2)),
+                (1, 2, 'TIMEOUT', _d(3)), (1, 2, 'OK', _d(4))])
+    assert h.get_failure_start(1, 2, _d(3)) == _d(2)
+    assert h.get_failure_start(1, 2, _d(2)) == _d(2)
+    assert h.get_failure_start(1, 2, _d(1)) is None
+    assert h.get_failure_start(1, 2, _d(4)) is None
+    assert h.get_failure_start(9, 2, _d(4)) is None
+
+
+def _finished(date):
+    return True
+
+
+def test_update():
+    """Test incremental update of the history index from the database"""
+    conn = MySQLdb.connect([
+        "CREATE TABLE imp_test (name INT, arch INT, state TEXT, date TEXT)",
+        "INSERT INTO imp_test VALUES (1, 2, 'OK', '2019-11-01')",
+        "INSERT INTO imp_test VALUES (1, 2, 'FAIL', '2019-11-02')"])
+    h = FailureHistory()
+    assert h.update(conn, 'imp_test', '2019-11-03', _finished)
+    assert h.last_date == '2019-11-02'
+    # The build being asked about is not indexed, but can be answered
+    assert h.get_previous_date(1, 2, '2019-11-03', True) == '2019-11-01'
+    assert h.get_previous_date(1, 2, '2019-11-03', False) == '2019-11-02'
+    assert h.get_failure_start(1, 2, '2019-11-03') == '2019-11-02'
+    conn.db.execute("INSERT INTO imp_test VALUES (1, 2, 'FAIL', '2019-11-03')")
+    # Already up to date; the database is not queried
+    nsql = len(conn.sql)
+    assert h.update(conn, 'imp_test', '2019-11-03', _finished)
+    assert len(conn.sql) == nsql
+    assert h.update(conn, 'imp_test', '2019-11-04', _finished)
+    assert h.last_date == '2019-11-03'
+    assert h.get_previous_date(1, 2, '2019-11-03', True) == '2019-11-01'
+    assert conn.sql[-1].endswith('AND date>%s ORDER BY date')
+    # Dates newer than the index cannot be answered
+    try:
+        h.get_previous_date(1, 2, '2019-11-05', True)
+        assert False, "KeyError not raised"
+    except KeyError:
+        pass
+
+
+def test_update_unfinished():
+    """Test that a build still being added is indexed once it finishes"""
+    conn = MySQLdb.connect([
+        "CREATE TABLE imp_test (name INT, arch INT, state TEXT, date TEXT)",
+        "INSERT INTO imp_test VALUES (1, 2, 'OK', '2019-11-01')",
+        "INSERT INTO imp_test VALUES (1, 2, 'FAIL', '2019-11-02')"])
+    h = FailureHistory()
+    assert not h.update(conn, 'imp_test', '2019-11-03', lambda date: False)
+    assert h.last_date == '2019-11-01'
+    conn.db.execute("INSERT INTO imp_test VALUES (1, 3, 'FAIL', '2019-11-02')")
+    assert h.update(conn, 'imp_test', '2019-11-03', _finished)
+    assert h.last_date == '2019-11-02'
+    assert h.get_failure_start(1, 2, '2019-11-02') == '2019-11-02'
+    assert h.get_failure_start(1, 3, '2019-11-02') == '2019-11-02'
+
+
+def test_update_in_progress():
+    """Test not waiting for another thread to update the index"""
+    conn = MySQLdb.connect([
+        "CREATE TABLE imp_test (name INT, arch INT, state TEXT, date TEXT)"])
+    h = FailureHistory()
+    with h._lock:
+        assert not h.update(conn, 'imp_test', '2019-11-03', _finished,
+                            wait=False)
+    assert h.update(conn, 'imp_test', '2019-11-03', _finished, wait=False)
+    assert h.get_previous_date(1, 2, '2019-11-03', True) is None
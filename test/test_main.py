@@ -1,3 +1,6 @@
+import base64
+import json
+import re
 import utils
 
 utils.set_search_paths(__file__)
@@ -8,3 +11,77 @@ def test_summary():
     """Test the summary page"""
     c = results.app.test_client()
     _ = c.get('/')
+
+
+def _setup_tests(tmpdir, monkeypatch):
+    utils.setup_app(results.app, tmpdir, monkeypatch, [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+        "INSERT INTO imp_test_names VALUES (2, 'test_bar.py', 1)",
+        "INSERT INTO imp_test_names VALUES (3, 'test_secret.py', 2)",
+        "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'FAIL', 1., "
+        "'NEWFAIL', 'Traceback: foo')",
+        "INSERT INTO imp_test VALUES (2, 1, '2019-11-13', 'OK', 1., "
+        "NULL, '')",
+        "INSERT INTO imp_test VALUES (3, 1, '2019-11-13', 'FAIL', 1., "
+        "NULL, 'Traceback: secret')"], dates=['20191112', '20191113'])
+
+
+def test_component(tmpdir, monkeypatch):
+    """Test the component page"""
+    _setup_tests(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/component/1')
+    assert rv.status_code == 200
+    assert b'test_foo.py' in rv.data
+    # Test output should be fetched on demand, not included in the page
+    assert b'Traceback' not in rv.data
+    assert b'data-details="/details?' in rv.data
+    assert b'data-test="1:1"' in rv.data
+    assert b'data-test="2:1"' not in rv.data
+
+
+def test_details(tmpdir, monkeypatch):
+    """Test fetching test output"""
+    _setup_tests(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/detail/1/1')
+    assert rv.status_code == 200
+    assert rv.data == b'Traceback: foo'
+    assert c.get('/detail/2/1').status_code == 404
+    # Lab-only tests are not visible
+    assert c.get('/detail/3/1').status_code == 404
+    rv = c.post('/details?date=20191113',
+                data={'tests': '1:1,2:1,3:1,garbage'})
+    assert rv.status_code == 200
+    assert json.loads(rv.data) == {'1:1': 'Traceback: foo'}
+
+
+def test_paged_tests(tmpdir, monkeypatch):
+    """Test paging through lists of tests"""
+    _setup_tests(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/component/1?sort=name&n=1')
+    assert rv.status_code == 200
+    assert b'test_bar.py' in rv.data
+    assert b'test_foo.py' not in rv.data
+    m = re.search(b'class="loadmore"><a href="([^"]+)"', rv.data)
+    url = m.group(1).replace(b'&amp;', b'&').decode('ascii')
+    rv = c.get(url + '&format=json')
+    data = json.loads(rv.data)
+    assert 'test_foo.py' in data['rows']
+    assert 'id="detail1"' in data['rows']
+    assert data['next'] is None
+    assert c.get('/component/1?after=garbage').status_code == 400
+    # Valid JSON, but not a cursor for the sort order
+    for cursor in ('{}', '[]', '["test_bar.py"]', '[["x"], 1]'):
+        assert c.get('/component/1?sort=name&after='
+                     + base64.urlsafe_b64encode(cursor)).status_code == 400
+    rv = c.get('/failures')
+    assert b'test_foo.py' in rv.data
+    assert b'test_bar.py' not in rv.data
+    assert b'test_secret.py' not in rv.data
+    rv = c.get('/long')
+    assert b'test_foo.py' not in rv.data
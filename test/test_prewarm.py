@@ -0,0 +1,79 @@
+import datetime
+import os
+import pickle
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+from results import prewarm
+from results.prewarm import BuildWatcher, get_prewarm_urls, prewarm_build
+from results.imp_build_utils import BuildDatabase
+
+SQL = [
+    "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+    "INSERT INTO imp_test_units VALUES (2, 'IMP.algebra', 0)",
+    "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+    "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+    "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'FAIL', 1., "
+    "'NEWFAIL', 'Traceback: foo')",
+    "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 1, 1, 'TEST', 1)",
+    "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 2, 1, 'OK', 1)"]
+DATE = datetime.date(2019, 11, 13)
+
+
+def test_watcher(tmpdir):
+    """Test noticing new builds"""
+    topdir = str(tmpdir)
+    bdir = utils.make_build_dirs(topdir, ['20191112', '20191113'],
+                                 last='20191112')
+    w = BuildWatcher(topdir, ['develop', 'master'])
+    assert w.check() == [('develop', datetime.date(2019, 11, 12))]
+    assert w.check() == []
+    os.unlink(os.path.join(bdir, 'lastbuild'))
+    os.symlink(os.path.join(bdir, '20191113-abcdef'),
+               os.path.join(bdir, 'lastbuild'))
+    assert w.check() == [('develop', DATE)]
+    # A build can be tried again
+    w.retry('develop')
+    assert w.check() == [('develop', DATE)]
+    assert w.check() == []
+
+
+def test_fetch_url(monkeypatch):
+    """Test that errors fetching pages are reported, not raised"""
+    def mock_urlopen(url, timeout):
+        assert timeout == prewarm.FETCH_TIMEOUT
+        raise IOError("connection reset")
+    monkeypatch.setattr(prewarm.urllib2, 'urlopen', mock_urlopen)
+    prewarm._fetch_url('https://example.com/results/')
+
+
+def test_prewarm(tmpdir):
+    """Test preparing for a new build"""
+    config = {'TOPDIR': str(tmpdir), 'LAB_ONLY_TOPDIR': str(tmpdir),
+              'SNAPSHOT_DIR': str(tmpdir.join('snapshot')),
+              'ARCHIVE_DIR': str(tmpdir.join('archive'))}
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    db = BuildDatabase(conn, config, DATE, False, 'develop')
+    assert get_prewarm_urls(db) == ['/failures', '/long', '/component/1']
+    fetched = []
+    # Nothing is prepared for a build that has not finished
+    bdir = utils.make_build_dirs(str(tmpdir), ['20191113'])
+    assert not prewarm_build(conn, config, 'develop', DATE,
+                             'https://example.com/results/',
+                             fetch=fetched.append)
+    assert fetched == []
+    assert not os.path.exists(str(tmpdir.join('snapshot')))
+    with open(os.path.join(bdir, '20191113-abcdef', 'build',
+                           'build_info.pck'), 'wb') as fh:
+        pickle.dump({}, fh)
+    assert prewarm_build(conn, config, 'develop', DATE,
+                         'https://example.com/results/',
+                         fetch=fetched.append)
+    assert sorted(fetched) == ['https://example.com/results/component/1',
+                               'https://example.com/results/failures',
+                               'https://example.com/results/long']
+    assert os.path.exists(str(tmpdir.join('snapshot', 'develop',
+                                          '20191113.sqlite')))
+    assert os.path.exists(str(tmpdir.join('archive', 'develop', 'test',
+                                          '201911', 'rows')))
@@ -0,0 +1,95 @@
+import json
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+import results
+from results import search
+
+SQL = [
+    "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+    "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+    "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+    "INSERT INTO imp_test_archs VALUES (2, 'mac10v4-intel')",
+    "INSERT INTO imp_test_names VALUES (1, 'test_restraint.py', 1)",
+    "INSERT INTO imp_test_names VALUES (2, 'test_core_restraints.py', 1)",
+    "INSERT INTO imp_test_names VALUES (3, 'test_secret_restraint.py', 2)",
+    "INSERT INTO imp_test VALUES (1, 1, '2019-11-13', 'OK', 1., NULL, '')",
+    "INSERT INTO imp_test VALUES (1, 2, '2019-11-13', 'FAIL', 1., NULL, '')",
+    "INSERT INTO imp_test VALUES (3, 1, '2019-11-13', 'OK', 1., NULL, '')"]
+
+
+def _names(matches):
+    return [m.name for m in matches]
+
+
+def test_search_index():
+    """Test searching the index"""
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    s = search.SearchIndex()
+    s.update(lambda: conn)
+    assert _names(s.search('RESTRAINT', True)) \
+        == ['test_core_restraints.py', 'test_restraint.py',
+            'test_secret_restraint.py']
+    # Lab-only components and their tests are excluded from public searches
+    assert _names(s.search('restraint', False)) \
+        == ['test_core_restraints.py', 'test_restraint.py']
+    assert _names(s.search('secret', False)) == []
+    assert _names(s.search('secret', True)) \
+        == ['IMP.secret', 'test_secret_restraint.py']
+    # Components come first, then names starting with the query
+    assert _names(s.search('core', True)) \
+        == ['IMP.core', 'test_core_restraints.py']
+    assert _names(s.search('test_r', True)) \
+        == ['test_restraint.py']
+    # Short queries only match prefixes
+    assert _names(s.search('IM', True)) == ['IMP.core', 'IMP.secret']
+    assert _names(s.search('py', True)) == []
+    assert _names(s.search('', True)) == []
+    assert _names(s.search('restraint', True, limit=1)) \
+        == ['test_core_restraints.py']
+
+
+def test_search_index_update():
+    """Test adding new tests to the index"""
+    conn = MySQLdb.connect(utils.SCHEMA + SQL)
+    s = search.SearchIndex()
+    s.update(lambda: conn)
+    c = conn.cursor()
+    c.execute("INSERT INTO imp_test_names VALUES (4, 'test_new.py', 1)")
+
+    def no_conn():
+        raise AssertionError("should not connect")
+    # The index is not updated until the interval has passed
+    s.update(no_conn)
+    assert _names(s.search('new', True)) == []
+    del conn.sql[:]
+    s.update(lambda: conn, interval=0)
+    assert _names(s.search('new', True)) == ['test_new.py']
+    assert 'id>' in conn.sql[-1]
+    # Names are only indexed once
+    assert _names(s.search('test_re', True)) == ['test_restraint.py']
+
+
+def test_search_pages(tmpdir, monkeypatch):
+    """Test the search and autocomplete pages"""
+    utils.make_build_dirs(str(tmpdir), ['20191113'])
+    utils.configure_app(results.app, str(tmpdir), SQL)
+    monkeypatch.setattr(search, '_index', search.SearchIndex())
+    c = results.app.test_client()
+    rv = c.get('/search/complete?q=restr')
+    d = json.loads(rv.data)
+    assert [r['name'] for r in d['results']] \
+        == ['test_core_restraints.py', 'test_restraint.py']
+    assert d['results'][1] == {'kind': 'test', 'id': 1,
+                               'name': 'test_restraint.py',
+                               'component': 'IMP.core'}
+    rv = c.get('/search?q=restraint')
+    assert rv.status_code == 200
+    assert b'test_secret_restraint.py' not in rv.data
+    assert b'<a href="/?test=1&amp;plat=2">FAIL</a>' in rv.data
+    assert b'<a href="/?test=1&amp;plat=1">OK</a>' in rv.data
+    rv = c.get('/search?q=core')
+    assert b'/component/1?' in rv.data
+    rv = c.get('/search?q=nothing')
+    assert b'No tests or components match' in rv.data
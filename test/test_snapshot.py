@@ -0,0 +1,72 @@
+import datetime
+import os
+import utils
+
+utils.set_search_paths(__file__)
+import MySQLdb
+from results.imp_build_utils import BuildDatabase
+from results.snapshot import export_snapshot, get_snapshot_path
+
+DATE = datetime.date(2019, 11, 13)
+
+
+def test_snapshot(tmpdir):
+    """Test exporting a build to a snapshot and reading it back"""
+    config = {'TOPDIR': str(tmpdir), 'LAB_ONLY_TOPDIR': str(tmpdir),
+              'SNAPSHOT_DIR': str(tmpdir.join('snapshots'))}
+    branch_schema = [x.replace(' (', '_release_2_11_0 (', 1)
+                     for x in utils.SCHEMA if 'imp_test (' in x
+                     or 'imp_benchmark (' in x or 'reporev' in x
+                     or 'imp_build_summary' in x or 'imp_doc' in x
+                     or 'unit_result' in x]
+    conn = MySQLdb.connect(utils.SCHEMA + branch_schema + [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+        "INSERT INTO imp_test_names VALUES (2, 'test_old.py', 1)",
+        "INSERT INTO imp_test_release_2_11_0 VALUES (1, 1, '2019-11-13', "
+        "'FAIL', 1., 'NEWFAIL', 'Traceback')",
+        "INSERT INTO imp_test_release_2_11_0 VALUES (2, 1, '2019-11-12', "
+        "'FAIL', 1., NULL, NULL)",
+        "INSERT INTO imp_build_summary_release_2_11_0 VALUES "
+        "('2019-11-13', 0, 'TEST')",
+        "INSERT INTO imp_test_unit_result_release_2_11_0 VALUES "
+        "('2019-11-13', 1, 1, 'TEST', 42)"])
+    db = BuildDatabase(conn, config, DATE, True, 'release/2.11.0')
+    fname = export_snapshot(db)
+    assert fname == get_snapshot_path(config, 'release/2.11.0', DATE)
+    assert fname.endswith('release_2.11.0/20191113.sqlite')
+    assert os.listdir(os.path.dirname(fname)) == ['20191113.sqlite']
+
+    # Read back from the snapshot, using an empty MySQL database
+    empty = MySQLdb.connect([])
+    db = BuildDatabase(empty, config, DATE, False, 'release/2.11.0')
+    rows = list(db.get_all_failed_tests())
+    assert [(r['test_name'], r['unit_name'], r['arch_name'], r['state'])
+            for r in rows] == [('test_foo.py', 'IMP.core', 'x86_64-intel8',
+                                'FAIL')]
+    assert db.get_test_details([(1, 1)]) == {(1, 1): 'Traceback'}
+    assert db.get_test_dict() == {(1, 1): 'FAIL'}
+    assert db.get_build_summary() == 'TEST'
+    summary = db.get_unit_summary()
+    assert summary.data['IMP.core']['x86_64-intel8']['numfails'] == 1
+    assert empty.sql == []
+    # Connections to the snapshot are reused
+    assert BuildDatabase(empty, config, DATE, False,
+                         'release/2.11.0').build_conn is db.build_conn
+    # Other dates are not in the snapshot
+    db = BuildDatabase(conn, config, DATE - datetime.timedelta(days=1),
+                       False, 'release/2.11.0')
+    assert db.get_test_dict() == {(2, 1): 'FAIL'}
+    # Tests not in the snapshot can still be named
+    db = BuildDatabase(conn, config, DATE, False, 'release/2.11.0')
+    assert db.get_test_names([2])[2]['test_name'] == 'test_old.py'
+
+
+def test_no_date(tmpdir):
+    """Test a BuildDatabase with no date when snapshots are configured"""
+    config = {'TOPDIR': str(tmpdir), 'LAB_ONLY_TOPDIR': str(tmpdir),
+              'SNAPSHOT_DIR': str(tmpdir.join('snapshots'))}
+    conn = MySQLdb.connect(utils.SCHEMA)
+    db = BuildDatabase(conn, config, None, True, 'develop')
+    assert db.build_conn is conn
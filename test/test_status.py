@@ -0,0 +1,99 @@
+import datetime
+import json
+import utils
+
+utils.set_search_paths(__file__)
+import results
+from results import history
+
+
+def _setup(tmpdir, monkeypatch):
+    utils.setup_app(results.app, tmpdir, monkeypatch, [
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_archs VALUES (2, 'mac10v4-intel')",
+        "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 1)",
+        "INSERT INTO imp_test_names VALUES (2, 'test_bar.py', 1)",
+        "INSERT INTO imp_test_names VALUES (3, 'test_secret.py', 2)"]
+        + ["INSERT INTO imp_test VALUES (%d, %d, '2019-11-%d', '%s', %d., "
+           "NULL, '')" % (name, arch, day, state, day)
+           for name, arch, day, state in (
+               (1, 1, 11, 'OK'), (1, 1, 12, 'FAIL'), (1, 1, 13, 'OK'),
+               (1, 2, 11, 'FAIL'), (1, 2, 12, 'OK'), (1, 2, 13, 'FAIL'),
+               (2, 1, 13, 'OK'), (3, 1, 13, 'OK'))],
+        dates=['20191111', '20191112', '20191113'], build_info={})
+
+
+def _post(c, tests):
+    rv = c.post('/status', data=json.dumps({'tests': tests}),
+                content_type='application/json')
+    return rv.status_code, json.loads(rv.data) if rv.status_code == 200 \
+        else None
+
+
+def test_status(tmpdir, monkeypatch):
+    """Test looking up the state of many tests at once"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    status, d = _post(c, [['test_foo.py', 'x86_64-intel8', '20191113'],
+                          [1, 2, None],
+                          [1, 2, '20191112'],
+                          [2, 1, '20191112'],
+                          ['test_secret.py', 1, '20191113']])
+    assert status == 200
+    r = d['results']
+    assert r[0] == {'test': 'test_foo.py', 'id': 1,
+                    'platform': 'x86_64-intel8', 'date': '20191113',
+                    'state': 'OK', 'runtime': 13.0,
+                    'previous_failure': '20191112'}
+    assert r[1]['date'] == '20191113'
+    assert r[1]['state'] == 'FAIL'
+    assert r[1]['previous_success'] == '20191112'
+    assert r[2]['previous_failure'] == '20191111'
+    # Tests that did not run, or that we cannot see, have no state
+    assert r[3]['state'] is None
+    assert r[4]['state'] is None
+    assert 'previous_failure' not in r[4]
+
+
+def test_status_bad_request(tmpdir, monkeypatch):
+    """Test malformed test status requests"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    assert _post(c, [[1, 99, None]])[0] == 400
+    assert _post(c, [[1, 1, 'garbage']])[0] == 400
+    assert _post(c, [[1, 1]])[0] == 400
+    assert _post(c, [[[1], 1, None]])[0] == 400
+    assert c.post('/status', data='garbage').status_code == 400
+    # Too many tests are rejected, not silently truncated
+    monkeypatch.setattr(results.index, 'MAX_STATUS_TESTS', 1)
+    assert _post(c, [[1, 1, None]])[0] == 200
+    assert _post(c, [[1, 1, None], [2, 1, None]])[0] == 413
+
+
+def test_previous_dates_not_indexed(tmpdir, monkeypatch):
+    """Test finding previous results not in the failure history index"""
+    _setup(tmpdir, monkeypatch)
+    with results.app.test_request_context('/'):
+        p = results.index.TestPage(results.get_db(), results.app.config)
+        # The index only knows when passing tests last failed, and vice versa
+        key = (1, 1, datetime.date(2019, 11, 13), True)
+        d = p.get_previous_test_dates(p.db, [key])
+    # (sqlite does not keep the type of MAX(date), so compare as strings)
+    assert str(d[key]) == '2019-11-11'
+
+
+def test_future_date(tmpdir, monkeypatch):
+    """Test that a date after the last build does not break the index"""
+    _setup(tmpdir, monkeypatch)
+    with results.app.test_request_context('/'):
+        p = results.index.TestPage(results.get_db(), results.app.config)
+        future = (1, 2, datetime.date(2999, 1, 1), True)
+        p.get_previous_test_dates(p.db, [future])
+        key = (1, 2, datetime.date(2019, 11, 13), True)
+        assert p.get_previous_test_dates(p.db, [key]) \
+            == {key: datetime.date(2019, 11, 12)}
+    # The index was not moved past the last build
+    assert history.get_failure_history('imp_test')._upto \
+        == datetime.date(2019, 11, 13)
@@ -0,0 +1,68 @@
+import json
+import utils
+
+utils.set_search_paths(__file__)
+import results
+
+
+def _setup(tmpdir, monkeypatch):
+    build_info = {'modules': [{'name': 'core', 'pycov': '90', 'cppcov': '80'},
+                              {'name': 'em', 'pycov': None, 'cppcov': '50'}]}
+    utils.setup_app(results.app, tmpdir, monkeypatch, [
+        "INSERT INTO imp_test_reporev VALUES ('2019-11-13', 'abcdef', "
+        "'2.12.0')",
+        "INSERT INTO imp_test_units VALUES (1, 'IMP.core', 0)",
+        "INSERT INTO imp_test_units VALUES (2, 'IMP.secret', 1)",
+        "INSERT INTO imp_test_units VALUES (3, 'IMP.em', 0)",
+        "INSERT INTO imp_test_archs VALUES (1, 'x86_64-intel8')",
+        "INSERT INTO imp_test_archs VALUES (2, 'mac10v4-intel')",
+        "INSERT INTO imp_test_names VALUES (1, 'test_foo.py', 3)",
+        "INSERT INTO imp_test VALUES (1, 2, '2019-11-13', 'FAIL', 1., "
+        "'NEWFAIL', '')",
+        "INSERT INTO imp_build_summary VALUES ('2019-11-13', 0, 'TEST')",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 1, 1, "
+        "'OK', 0)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 1, 2, "
+        "'OK', 0)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 2, 1, "
+        "'BUILD', 0)",
+        "INSERT INTO imp_test_unit_result VALUES ('2019-11-13', 3, 2, "
+        "'TEST', 0)"], build_info=build_info)
+
+
+def test_summary_json(tmpdir, monkeypatch):
+    """Test the JSON build summary"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/summary.json')
+    assert rv.status_code == 200
+    d = json.loads(rv.data)
+    assert d['date'] == '2019-11-13'
+    assert d['state'] == 'TEST'
+    assert d['revision'] == 'abcdef'
+    # Lab-only components are not shown to the public
+    assert sorted(d['units']) == ['IMP.core', 'IMP.em']
+    assert d['archs'] == ['x86_64-intel8', 'mac10v4-intel']
+    core, em = d['units'].index('IMP.core'), d['units'].index('IMP.em')
+    assert d['grid'][core] == ['OK', 'OK']
+    assert d['grid'][em] == [None, 'TEST']
+    assert d['failures'][em] == [None, 1]
+    assert d['new_failures'][em] == [None, 1]
+    assert d['coverage'][core] == ['90', '80']
+    assert d['coverage'][em] == [None, '50']
+    rv = c.get('/summary.json',
+               headers={'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 304
+
+
+def test_summary_json_filters(tmpdir, monkeypatch):
+    """Test choosing fields, components and platforms in the JSON summary"""
+    _setup(tmpdir, monkeypatch)
+    c = results.app.test_client()
+    rv = c.get('/summary.json?fields=grid&units=IMP.em,IMP.secret'
+               '&archs=mac10v4-intel')
+    d = json.loads(rv.data)
+    assert d == {'branch': 'develop', 'date': '2019-11-13',
+                 'units': ['IMP.em'], 'archs': ['mac10v4-intel'],
+                 'grid': [['TEST']]}
+    assert c.get('/summary.json?fields=foo').status_code == 400
@@ -1,4 +1,5 @@
 import os
+import pickle
 import sys
 import flask
 
@@ -17,3 +18,68 @@ def set_search_paths(fname):
     sys.path.insert(0, os.path.join(os.path.dirname(fname), 'mock'))
     # Path to top level
     sys.path.insert(0, os.path.join(os.path.dirname(fname), '..'))
+
+
+# Tables used by the application, in sqlite3 syntax
+SCHEMA = [
+    "CREATE TABLE imp_test_units (id INTEGER PRIMARY KEY, name TEXT, "
+    "lab_only BOOLEAN)",
+    "CREATE TABLE imp_test_archs (id INTEGER PRIMARY KEY, name TEXT)",
+    "CREATE TABLE imp_test_names (id INTEGER PRIMARY KEY, name TEXT, "
+    "unit INTEGER)",
+    "CREATE TABLE imp_test (name INTEGER, arch INTEGER, date DATE, "
+    "state TEXT, runtime FLOAT, delta TEXT, detail TEXT)",
+    "CREATE TABLE imp_test_detail (hash TEXT PRIMARY KEY, body BLOB)",
+    "CREATE TABLE imp_test_unit_result (date DATE, unit INTEGER, "
+    "arch INTEGER, state TEXT, logline INTEGER)",
+    "CREATE TABLE imp_test_reporev (date DATE, rev TEXT, version TEXT)",
+    "CREATE TABLE imp_test_other_reporev (date DATE, repo TEXT, rev TEXT)",
+    "CREATE TABLE imp_build_summary (date DATE, lab_only BOOLEAN, "
+    "state TEXT)",
+    "CREATE TABLE imp_doc (date DATE, nbroken_manual INTEGER, "
+    "nbroken_tutorial INTEGER, nbroken_rmf_manual INTEGER)",
+    "CREATE TABLE imp_benchmark_files (id INTEGER PRIMARY KEY, name TEXT, "
+    "unit INTEGER)",
+    "CREATE TABLE imp_benchmark_names (id INTEGER PRIMARY KEY, name TEXT, "
+    "algorithm TEXT, file INTEGER)",
+    "CREATE TABLE imp_benchmark (name INTEGER, platform INTEGER, date DATE, "
+    "runtime FLOAT, checkval FLOAT)"]
+
+
+def make_build_dirs(topdir, dates, branch='develop', last=None,
+                    build_info=None):
+    """Make a build directory for each date (YYYYMMDD), and point the
+       lastbuild link at the last one. If `build_info` is given, also mark
+       each build as finished, by writing it as the build_info pickle."""
+    bdir = os.path.join(topdir, branch)
+    for date in dates:
+        build = os.path.join(bdir, date + '-abcdef', 'build')
+        os.makedirs(build)
+        if build_info is not None:
+            with open(os.path.join(build, 'build_info.pck'), 'wb') as fh:
+                pickle.dump(build_info, fh)
+    os.symlink(os.path.join(bdir, (last or dates[-1]) + '-abcdef'),
+               os.path.join(bdir, 'lastbuild'))
+    return bdir
+
+
+def configure_app(app, topdir, sql=()):
+    """Point the app at a mock database, initialized with the schema
+       plus the given SQL statements, and at build results in topdir"""
+    app.config.update({'HOST': None, 'USER': None, 'PASSWORD': None,
+                       'DATABASE': SCHEMA + list(sql),
+                       'TOPDIR': topdir, 'LAB_ONLY_TOPDIR': topdir})
+
+
+def setup_app(app, tmpdir, monkeypatch, sql=(), dates=('20191113',),
+              build_info=None):
+    """Set up the app for a test: make builds on the given dates in tmpdir
+       (see make_build_dirs), point the app at them and at a mock database
+       (see configure_app), and start with empty in-memory caches"""
+    from results import cache, history
+    topdir = str(tmpdir)
+    make_build_dirs(topdir, dates, build_info=build_info)
+    configure_app(app, topdir, sql)
+    monkeypatch.setattr(cache, '_caches', {})
+    monkeypatch.setattr(history, '_indexes', {})
+    return topdir